@@ -27,6 +27,7 @@ coincident triggers.
 import numpy, logging, h5py, pycbc.pnutils
 from itertools import izip
 from scipy.interpolate import interp1d  
+from pycbc.kernels import inline, declare
 
 def background_bin_from_string(background_bins, data):
     """ Return template ids for each bin as defined by the format string
@@ -185,13 +186,12 @@ def time_coincidence(t1, t2, window, slide_step=0):
     left = numpy.searchsorted(fold2, fold1 - window)
     right = numpy.searchsorted(fold2, fold1 + window)
 
-    idx1 = numpy.repeat(sort1, right-left)
-    idx2 = [sort2[l:r] for l,r in zip(left, right)]
-
-    if len(idx2) > 0:
-        idx2 = numpy.concatenate(idx2)
-    else:
-        idx2 = numpy.array([])
+    # Each trigger of the first detector is paired with the triggers in
+    # sort2[left:right], so lay these ranges out one after another
+    count = right - left
+    idx1 = numpy.repeat(sort1, count)
+    offset = numpy.arange(len(idx1)) - numpy.repeat(count.cumsum() - count, count)
+    idx2 = sort2[numpy.repeat(left, count) + offset]
     
     if slide_step:
         diff = ((t1 / slide_step)[idx1] - (t2 / slide_step)[idx2])
@@ -232,60 +232,82 @@ def cluster_coincs(stat, time1, time2, timeslide_id, slide, window):
         logging.info('No coinc triggers in one, or both, ifos.')
         return numpy.array([])
     
-    indices = []
     if numpy.isfinite(slide):
         time = (time2 + (time1 + timeslide_id * slide)) / 2
     else:
         time = 0.5 * (time2 + time1)
-        
-    tslide = timeslide_id.astype(numpy.float128)
-    time = time.astype(numpy.float128)
-    
-    span = (time.max() - time.min()) + window * 10
-    time = time + span * tslide
-    
-    time_sorting = time.argsort()
-    stat = stat[time_sorting]
-    time = time[time_sorting]
-    
+
+    # Times relative to the earliest one are exact in double precision, and
+    # each timeslide is clustered separately, so there is no need for the
+    # extended precision needed to offset the timeslides from each other
+    time = time.astype(numpy.float64)
+    time = time - time.min()
+    tslide = numpy.array(timeslide_id, dtype=numpy.int64)
+
     logging.info('sorting...')
-    left = numpy.searchsorted(time, time - window)
-    right = numpy.searchsorted(time, time + window)
+    time_sorting = numpy.lexsort((time, tslide))
+    time = time[time_sorting]
+    tslide = tslide[time_sorting]
+    stat = numpy.array(stat, dtype=numpy.float64)[time_sorting]
     logging.info('done sorting')
-    indices = numpy.zeros(len(left), dtype=numpy.uint32)
-    
-    # i is the index we are inspecting, j is the next one to save
-    i = 0
-    j = 0
-    while i < len(left):
-        l = left[i]
-        r = right[i]
-       
-        # If there are no other points to compare it is obviosly the max
-        if (r - l) == 1:
-            indices[j] = i
-            j += 1
-            i += 1            
-            continue            
-        
-        # Find the location of the maximum within the time interval around i
-        max_loc = stat[l:r].argmax() + l 
-        
-        # If this point is the max, we can skip to the right boundary
-        if max_loc == i:
-            indices[j] = i
-            i = r
-            j += 1
-        
-        # If the max is later than i, we can skip to it
-        elif max_loc > i:
-            i = max_loc 
-            
-        elif max_loc < i:
-            i += 1
 
-    indices = indices[:j]
-            
+    indices = _cluster_sorted_coincs(stat, time, tslide, window)
+
     logging.info('done clustering coinc triggers: %s triggers remaining' % len(indices))
     return time_sorting[indices]
 
+cluster_coincs_code = """
+    // i is the index we are inspecting, j is the next one to save, and
+    // [l, r) are the coincidences in the same timeslide within the
+    // window of i
+    long int i = 0, j = 0, l = 0, r = 0;
+    while (i < n){
+        while (tslide[l] < tslide[i] ||
+               (tslide[l] == tslide[i] && time[l] < time[i] - window))
+            l++;
+        if (r < i + 1)
+            r = i + 1;
+        while (r < n && tslide[r] == tslide[i] &&
+               time[r] < time[i] + window)
+            r++;
+
+        // Find the location of the maximum within the window around i
+        long int max_loc = l;
+        for (long int k = l + 1; k < r; k++){
+            if (stat[k] > stat[max_loc])
+                max_loc = k;
+        }
+
+        if (max_loc == i){
+            // If this point is the max, we can skip to the right boundary
+            indices[j] = i;
+            j++;
+            i = r;
+        }
+        else if (max_loc > i)
+            // If the max is later than i, we can skip to it
+            i = max_loc;
+        else
+            i++;
+    }
+    count[0] = j;
+"""
+
+declare(cluster_coincs_code,
+        ['stat', 'time', 'tslide', 'window', 'n', 'indices', 'count'],
+        ['double*', 'double*', 'int64_t*', 'double', 'int', 'unsigned int*',
+         'int64_t*'])
+
+def _cluster_sorted_coincs(stat, time, tslide, window):
+    """ Return the indices of the coincidences which have the largest
+    statistic within the given window of them, in the same timeslide.
+    The coincidences must be sorted by timeslide, and then by time.
+    """
+    window = float(window)
+    n = len(time)
+    indices = numpy.zeros(n, dtype=numpy.uint32)
+    count = numpy.zeros(1, dtype=numpy.int64)
+    inline(cluster_coincs_code,
+           ['stat', 'time', 'tslide', 'window', 'n', 'indices', 'count'],
+           extra_compile_args=['-march=native -O3 -w'])
+    return indices[:count[0]]
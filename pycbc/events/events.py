@@ -193,6 +193,38 @@ def effsnr(snr, reduced_x2, fac=250.):
     else:
         return effsnr[0]
 
+class _HDFTriggerWriter(object):
+    """ Write columns of triggers to an hdf file. If resizable is True, the
+    columns may be written several times, each time appending to them.
+    """
+    def __init__(self, name, prefix, resizable=False):
+        import h5py
+        self.f = h5py.File(name, 'w')
+        self.prefix = prefix
+        self.resizable = resizable
+
+    def __setitem__(self, name, data):
+        col = self.prefix + '/' + name
+        if not self.resizable:
+            self.f.create_dataset(col, data=data,
+                                  compression='gzip',
+                                  compression_opts=9,
+                                  shuffle=True)
+        elif col not in self.f:
+            self.f.create_dataset(col, data=data, maxshape=(None,),
+                                  chunks=True,
+                                  compression='gzip',
+                                  compression_opts=9,
+                                  shuffle=True)
+        else:
+            dset = self.f[col]
+            num = len(dset)
+            dset.resize((num + len(data),))
+            dset[num:] = data
+
+    def close(self):
+        self.f.close()
+
 class EventManager(object):
     def __init__(self, opt, column, column_types, **kwds):
         self.opt = opt
@@ -206,6 +238,52 @@ class EventManager(object):
         self.template_params = []
         self.template_index = -1
         self.template_events = numpy.array([], dtype=self.event_dtype)
+        self.flush_writer = None
+        self.num_flushed_events = 0
+
+    # The events are held as a list of arrays, which are only concatenated
+    # when the events are accessed, so that adding events does not copy all
+    # of the events found so far
+    def _get_chunks(self, name):
+        chunks = getattr(self, name, [])
+        if len(chunks) != 1:
+            if len(chunks):
+                chunks = [numpy.concatenate(chunks)]
+            else:
+                chunks = [numpy.array([], dtype=self.event_dtype)]
+            setattr(self, name, chunks)
+        return chunks[0]
+
+    def _set_chunks(self, name, value):
+        setattr(self, name, [] if value is None else [value])
+
+    @property
+    def events(self):
+        """ Array of all events of the finalized templates """
+        return self._get_chunks('_event_chunks')
+
+    @events.setter
+    def events(self, value):
+        self._set_chunks('_event_chunks', value)
+
+    @property
+    def template_events(self):
+        """ Array of the events of the current template """
+        return self._get_chunks('_template_event_chunks')
+
+    @template_events.setter
+    def template_events(self, value):
+        self._set_chunks('_template_event_chunks', value)
+
+    def _add_events(self, events):
+        """ Add an array of events to those of the finalized templates, and
+        flush them to the output file if there are too many.
+        """
+        self._event_chunks.append(events)
+        if self.flush_writer is not None:
+            num = sum(len(c) for c in self._event_chunks)
+            if num > self.flush_max_events:
+                self.flush_events()
 
     @classmethod
     def from_multi_ifo_interface(cls, opt, ifo, column, column_types, **kwds):
@@ -222,12 +300,10 @@ class EventManager(object):
         return cls(opt, column, column_types, **kwds)
 
     def chisq_threshold(self, value, num_bins, delta=0):
-        remove = []
-        for i, event in enumerate(self.events):
-            xi = event['chisq'] / (event['chisq_dof'] / 2 + 1 + delta * event['snr'].conj() * event['snr'])
-            if xi > value:
-                remove.append(i)
-        self.events = numpy.delete(self.events, remove)
+        e = self.events
+        snrsq = (e['snr'].conj() * e['snr']).real
+        xi = e['chisq'] / (e['chisq_dof'] / 2 + 1 + delta * snrsq)
+        self.events = e[numpy.logical_not(xi > value)]
 
     def newsnr_threshold(self, threshold):
         """ Remove events with newsnr smaller than given threshold
@@ -235,10 +311,40 @@ class EventManager(object):
         if not self.opt.chisq_bins:
             raise RuntimeError('Chi-square test must be enabled in order to use newsnr threshold')
 
-        remove = [i for i, e in enumerate(self.events) if \
-            newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']) < threshold]
-        self.events = numpy.delete(self.events, remove)
-        
+        e = self.events
+        if len(e) == 0:
+            return
+        stat = numpy.array(newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']),
+                           ndmin=1)
+        self.events = e[numpy.logical_not(stat < threshold)]
+
+    def apply_cut(self, expression):
+        """ Keep only the events passing a cut on their columns.
+
+        Parameters
+        ----------
+        expression : str
+            An expression which is evaluated on the whole set of events at
+            once and gives a boolean array, True for each event to keep. The
+            columns of the events can be used by name, together with
+            numpy, abs, newsnr and effsnr, e.g.
+            "(abs(snr) > 6) & (chisq / chisq_dof < 2)".
+        """
+        e = self.events
+        safe_dict = {'numpy': numpy, 'abs': abs, 'newsnr': newsnr,
+                     'effsnr': effsnr, 'True': True, 'False': False}
+        for name in e.dtype.names:
+            safe_dict[name] = e[name]
+        keep = eval(expression, {"__builtins__":None}, safe_dict)
+
+        keep = numpy.array(keep, ndmin=1)
+        if keep.dtype != bool:
+            raise ValueError("The cut %s does not give a boolean array"
+                             % expression)
+        if len(keep) == 1:
+            keep = numpy.repeat(keep, len(e))
+        self.events = e[keep]
+
     def keep_near_injection(self, window, injections):
         from pycbc.events.veto import indices_within_times
         if len(self.events) == 0:
@@ -255,18 +361,18 @@ class EventManager(object):
             return
         
         e = self.events
-        stat = newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof'])
+        stat = numpy.array(newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']),
+                           ndmin=1)
         time = e['time_index']
         
         wtime = (time / window).astype(numpy.int32)
-        bins = numpy.unique(wtime)
-        
-        keep = []
-        for b in bins:
-            bloc = numpy.where((wtime == b))[0]
-            bloudest = stat[bloc].argsort()[-num_keep:]
-            keep.append(bloc[bloudest])
-        keep = numpy.concatenate(keep)
+
+        # Sort by interval and then by statistic, and keep the last num_keep
+        # events of each interval
+        order = numpy.lexsort((stat, wtime))
+        wtime = wtime[order]
+        last = numpy.searchsorted(wtime, wtime, side='right')
+        keep = order[last - numpy.arange(len(order)) <= num_keep]
         self.events = e[keep]
 
     def maximize_over_bank(self, tcolumn, column, window):
@@ -330,7 +436,7 @@ class EventManager(object):
                     new_events[c] = v.numpy()
                 else:
                     new_events[c] = v
-        self.template_events = numpy.append(self.template_events, new_events)
+        self._template_event_chunks.append(new_events)
 
     def cluster_template_events(self, tcolumn, column, window_size):
         """ Cluster the internal events over the named column
@@ -348,8 +454,51 @@ class EventManager(object):
         self.template_params[-1].update(kwds)
 
     def finalize_template_events(self):
-        self.events = numpy.append(self.events, self.template_events)
-        self.template_events = numpy.array([], dtype=self.event_dtype)
+        self._add_events(self.template_events)
+        self.template_events = None
+
+    def set_flush(self, outname, max_events, event_filter=None):
+        """ Write the events to the hdf output file in chunks, whenever more
+        than max_events are held in memory, instead of all at once when
+        write_events is called.
+
+        Parameters
+        ----------
+        outname : str
+            The name of the output hdf file. It should be the same as that
+            given to write_events.
+        max_events : int
+            The maximum number of events of finalized templates to keep in
+            memory.
+        event_filter : {None, function}, optional
+            A function called with the event manager before each flush, which
+            can remove events. Only cuts that act on each event separately
+            should be applied, since the events are written out in chunks.
+        """
+        if '.hdf' not in outname:
+            raise ValueError('Events can only be flushed to an hdf file')
+        self.make_output_dir(outname)
+        self.flush_outname = outname
+        self.flush_max_events = max_events
+        self.flush_event_filter = event_filter
+        self.flush_writer = _HDFTriggerWriter(outname,
+                                              self.opt.channel_name[0:2],
+                                              resizable=True)
+
+    def flush_events(self):
+        """ Write the events of the finalized templates to the output file
+        given to set_flush, and remove them from memory. The number of events
+        removed, before the event filter is applied, is added to
+        num_flushed_events.
+        """
+        self.num_flushed_events += len(self.events)
+        if self.flush_event_filter is not None:
+            self.flush_event_filter(self)
+        events = self.events
+        events.sort(order='template_id')
+        if len(events):
+            self._write_hdf_events(self.flush_writer, events)
+        self.events = None
 
     def make_output_dir(self, outname):
         path = os.path.dirname(outname)
@@ -370,64 +519,17 @@ class EventManager(object):
             raise ValueError('Cannot write to this format')
 
     def write_to_hdf(self, outname):
-        class fw(object):
-            def __init__(self, name, prefix):
-                import h5py
-                self.f = h5py.File(name, 'w')
-                self.prefix = prefix
-
-            def __setitem__(self, name, data):
-                col = self.prefix + '/' + name
-                self.f.create_dataset(col, data=data,
-                                      compression='gzip',
-                                      compression_opts=9,
-                                      shuffle=True)
-
-        self.events.sort(order='template_id')
-
-        # Template id hack
-        m1 = numpy.array([p['tmplt'].mass1 for p in self.template_params], dtype=numpy.float32)
-        m2 = numpy.array([p['tmplt'].mass2 for p in self.template_params], dtype=numpy.float32)
-        s1 = numpy.array([p['tmplt'].spin1z for p in self.template_params], dtype=numpy.float32)
-        s2 = numpy.array([p['tmplt'].spin2z for p in self.template_params], dtype=numpy.float32)
-        th = numpy.zeros(len(m1), dtype=int)
-        for j, v in enumerate(zip(m1, m2, s1, s2)):
-            th[j] = hash(v)
-
-        tid = self.events['template_id']
-        f = fw(outname, self.opt.channel_name[0:2])
-
-        if len(self.events):
-            f['snr'] = abs(self.events['snr'])
-            f['coa_phase'] = numpy.angle(self.events['snr'])
-            f['chisq'] = self.events['chisq']
-            f['bank_chisq'] = self.events['bank_chisq']
-            f['bank_chisq_dof'] = self.events['bank_chisq_dof']
-            f['cont_chisq'] = self.events['cont_chisq']
-            f['end_time'] = self.events['time_index'] / float(self.opt.sample_rate) + self.opt.gps_start_time
-
-            template_sigmasq = numpy.array([t['sigmasq'] for t in self.template_params], dtype=numpy.float32)
-            f['sigmasq'] = template_sigmasq[tid]
-
-            template_durations = [p['tmplt'].template_duration for p in self.template_params]
-            f['template_duration'] = numpy.array(template_durations, dtype=numpy.float32)[tid]
-
-            # FIXME: Can we get this value from the autochisq instance?
-            cont_dof = self.opt.autochi_number_points
-            if self.opt.autochi_onesided is None:
-                cont_dof = cont_dof * 2
-            if self.opt.autochi_two_phase:
-                cont_dof = cont_dof * 2
-            if self.opt.autochi_max_valued_dof:
-                cont_dof = self.opt.autochi_max_valued_dof
-            f['cont_chisq_dof'] = numpy.repeat(cont_dof, len(self.events))
-
-            if 'chisq_dof' in self.events.dtype.names:
-                f['chisq_dof'] = self.events['chisq_dof'] / 2 + 1
-            else:
-                f['chisq_dof'] = numpy.zeros(len(self.events))
-
-            f['template_hash'] = th[tid]
+        if self.flush_writer is not None:
+            if outname != self.flush_outname:
+                raise ValueError('Events are being flushed to %s, not %s' %
+                                 (self.flush_outname, outname))
+            self.flush_events()
+            f = self.flush_writer
+        else:
+            self.events.sort(order='template_id')
+            f = _HDFTriggerWriter(outname, self.opt.channel_name[0:2])
+            if len(self.events):
+                self._write_hdf_events(f, self.events)
 
         if self.opt.trig_start_time:
             f['search/start_time'] = numpy.array([self.opt.trig_start_time])
@@ -438,6 +540,55 @@ class EventManager(object):
             f['search/end_time'] = numpy.array([self.opt.trig_end_time])
         else:
             f['search/end_time'] = numpy.array([self.opt.gps_end_time - self.opt.segment_end_pad])
+        f.close()
+
+    def _write_hdf_events(self, f, events):
+        """ Write the columns of the given events, sorted by template id, to
+        an _HDFTriggerWriter.
+        """
+        # Only the templates with events are needed
+        utid, tid = numpy.unique(events['template_id'], return_inverse=True)
+        params = [self.template_params[t] for t in utid]
+
+        # Template id hack
+        m1 = numpy.array([p['tmplt'].mass1 for p in params], dtype=numpy.float32)
+        m2 = numpy.array([p['tmplt'].mass2 for p in params], dtype=numpy.float32)
+        s1 = numpy.array([p['tmplt'].spin1z for p in params], dtype=numpy.float32)
+        s2 = numpy.array([p['tmplt'].spin2z for p in params], dtype=numpy.float32)
+        th = numpy.zeros(len(m1), dtype=int)
+        for j, v in enumerate(zip(m1, m2, s1, s2)):
+            th[j] = hash(v)
+
+        f['snr'] = abs(events['snr'])
+        f['coa_phase'] = numpy.angle(events['snr'])
+        f['chisq'] = events['chisq']
+        f['bank_chisq'] = events['bank_chisq']
+        f['bank_chisq_dof'] = events['bank_chisq_dof']
+        f['cont_chisq'] = events['cont_chisq']
+        f['end_time'] = events['time_index'] / float(self.opt.sample_rate) + self.opt.gps_start_time
+
+        template_sigmasq = numpy.array([t['sigmasq'] for t in params], dtype=numpy.float32)
+        f['sigmasq'] = template_sigmasq[tid]
+
+        template_durations = [p['tmplt'].template_duration for p in params]
+        f['template_duration'] = numpy.array(template_durations, dtype=numpy.float32)[tid]
+
+        # FIXME: Can we get this value from the autochisq instance?
+        cont_dof = self.opt.autochi_number_points
+        if self.opt.autochi_onesided is None:
+            cont_dof = cont_dof * 2
+        if self.opt.autochi_two_phase:
+            cont_dof = cont_dof * 2
+        if self.opt.autochi_max_valued_dof:
+            cont_dof = self.opt.autochi_max_valued_dof
+        f['cont_chisq_dof'] = numpy.repeat(cont_dof, len(events))
+
+        if 'chisq_dof' in events.dtype.names:
+            f['chisq_dof'] = events['chisq_dof'] / 2 + 1
+        else:
+            f['chisq_dof'] = numpy.zeros(len(events))
+
+        f['template_hash'] = th[tid]
 
     def write_to_xml(self, outname):
         """ Write the found events to a sngl inspiral table
@@ -746,6 +897,8 @@ class EventManagerMultiDet(EventManager):
             self.event_dtype.append( (column, coltype) )
 
         self.events = numpy.array([], dtype=self.event_dtype)
+        self.flush_writer = None
+        self.num_flushed_events = 0
         self.event_id_map = {}
         self.event_index = 0
         self.template_params = []
@@ -809,8 +962,7 @@ class EventManagerMultiDet(EventManager):
                         event2 = self.template_event_dict[ifo2][idx2]
                         self.coinc_list.append((event1, event2))
         for ifo in self.ifos:
-            self.events = numpy.append(self.events,
-                                                 self.template_event_dict[ifo])
+            self._add_events(self.template_event_dict[ifo])
             self.template_event_dict[ifo] = numpy.array([],
                                                         dtype=self.event_dtype)
 
@@ -15,7 +15,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from pycbc.types import zeros, complex64, float32
-from scipy.weave import inline
+from pycbc.kernels import inline, declare
 import numpy as _np
 import pycbc.opt
 from pycbc.opt import omp_support, omp_libs, omp_flags
@@ -724,6 +724,9 @@ int parallel_thresh_cluster(std::complex<float> * __restrict inarr, const uint32
 max_only_code = """
 max_simd(inarr, mval, norm, (int64_t *) mloc, (int64_t) nstart[0], (int64_t) howmany[0]);
 """
+declare(max_only_code, ['inarr', 'mval', 'norm', 'mloc', 'nstart', 'howmany'],
+        ['float*', 'float*', 'float*', 'int64_t*', 'int64_t*', 'int64_t*'],
+        support_code=thresh_cluster_support)
 
 class MaxOnlyObject(object):
     def __init__(self, inarray, verbose=0):
@@ -757,6 +760,11 @@ windowed_max_code = """
 windowed_max(inarr, (int64_t) arrlen[0], cvals, norms, (int64_t *) locs, (int64_t ) winsize[0],
              (int64_t) startoffset[0]);
 """
+declare(windowed_max_code, ['inarr', 'arrlen', 'cvals', 'norms', 'locs',
+                            'winsize', 'startoffset'],
+        ['std::complex<float>*', 'int64_t*', 'std::complex<float>*', 'float*',
+         'int64_t*', 'int64_t*', 'int64_t*'],
+        support_code=thresh_cluster_support)
 
 class WindowedMaxObject(object):
     def __init__(self, inarray, winsize, verbose=0):
@@ -798,6 +806,11 @@ thresh_cluster_code = """
 return_val = parallel_thresh_cluster(series, (uint32_t) slen, values, locs,
                                      (float) thresh, (uint32_t) window, (uint32_t) segsize);
 """
+declare(thresh_cluster_code, ['series', 'slen', 'values', 'locs', 'thresh',
+                              'window', 'segsize'],
+        ['std::complex<float>*', 'int', 'std::complex<float>*',
+         'unsigned int*', 'double', 'int', 'int'],
+        support_code=thresh_cluster_support)
 
 if pycbc.opt.HAVE_GETCONF:
     default_segsize = pycbc.opt.LEVEL2_CACHE_SIZE / _np.dtype( _np.complex64).itemsize
@@ -22,7 +22,7 @@
 # =============================================================================
 #
 import numpy
-from scipy.weave import inline
+from pycbc.kernels import inline, declare
 from .simd_threshold import thresh_cluster_support, default_segsize
 from .events import _BaseThresholdCluster
 from pycbc.opt import omp_libs, omp_flags
@@ -35,20 +35,7 @@ def threshold_numpy(series, value):
 
 threshold_only = threshold_numpy
 
-outl = None
-outv = None
-count = None
-def threshold_inline(series, value):
-    arr = numpy.array(series.data.view(dtype=numpy.float32), copy=False)
-    global outl, outv, count
-    if outl is None or len(outl) < len(series):
-        outl = numpy.zeros(len(series), dtype=numpy.uint32)
-        outv = numpy.zeros(len(series), dtype=numpy.complex64)
-        count = numpy.zeros(1, dtype=numpy.uint32)
-        
-    N = len(series)
-    threshold = value**2.0
-    code = """  
+threshold_code = """  
         float v = threshold;
         unsigned int num_parallel_regions = 16;
         unsigned int t=0;
@@ -79,8 +66,25 @@ def threshold_inline(series, value):
         }       
         
         count[0] = t;
-    """
-    inline(code, ['N', 'arr', 'outv', 'outl', 'count', 'threshold'],
+"""
+declare(threshold_code, ['N', 'arr', 'outv', 'outl', 'count', 'threshold'],
+        ['int', 'float*', 'std::complex<float>*', 'unsigned int*',
+         'unsigned int*', 'double'])
+
+outl = None
+outv = None
+count = None
+def threshold_inline(series, value):
+    arr = numpy.array(series.data.view(dtype=numpy.float32), copy=False)
+    global outl, outv, count
+    if outl is None or len(outl) < len(series):
+        outl = numpy.zeros(len(series), dtype=numpy.uint32)
+        outv = numpy.zeros(len(series), dtype=numpy.complex64)
+        count = numpy.zeros(1, dtype=numpy.uint32)
+        
+    N = len(series)
+    threshold = value**2.0
+    inline(threshold_code, ['N', 'arr', 'outv', 'outl', 'count', 'threshold'],
                     extra_compile_args=['-march=native -O3 -w'] + omp_flags,
                     libraries=omp_libs
           )
@@ -92,6 +96,16 @@ def threshold_inline(series, value):
 
 threshold=threshold_inline
 
+cluster_code = """
+             return_val = parallel_thresh_cluster(series, (uint32_t) slen, values, locs,
+                                         (float) threshold, (uint32_t) window, (uint32_t) segsize);
+              """
+declare(cluster_code, ['series', 'slen', 'values', 'locs', 'threshold',
+                       'window', 'segsize'],
+        ['std::complex<float>*', 'int', 'std::complex<float>*',
+         'unsigned int*', 'double', 'int', 'int'],
+        support_code=thresh_cluster_support)
+
 class CPUThresholdCluster(_BaseThresholdCluster):
     def __init__(self, series):
         self.series = numpy.array(series.data, copy=False)
@@ -100,10 +114,7 @@ class CPUThresholdCluster(_BaseThresholdCluster):
         self.outv = numpy.zeros(self.slen, numpy.complex64)
         self.outl = numpy.zeros(self.slen, numpy.uint32)
         self.segsize = default_segsize
-        self.code = """
-             return_val = parallel_thresh_cluster(series, (uint32_t) slen, values, locs,
-                                         (float) threshold, (uint32_t) window, (uint32_t) segsize);
-              """
+        self.code = cluster_code
         self.support = thresh_cluster_support
 
     def threshold_and_cluster(self, threshold, window):
@@ -380,11 +380,11 @@ plan_many_r2c_d.restype = ctypes.c_void_p
 # translate input and output dtypes into the correct planning function.
 
 _plan_funcs_dict = { ('complex64', 'complex64') : plan_many_c2c_f,
-                     ('complex64', 'float32') : plan_many_r2c_f,
-                     ('float32', 'complex64') : plan_many_c2r_f,
+                     ('complex64', 'float32') : plan_many_c2r_f,
+                     ('float32', 'complex64') : plan_many_r2c_f,
                      ('complex128', 'complex128') : plan_many_c2c_d,
-                     ('complex128', 'float64') : plan_many_r2c_d,
-                     ('float64', 'complex128') : plan_many_c2r_d }
+                     ('complex128', 'float64') : plan_many_c2r_d,
+                     ('float64', 'complex128') : plan_many_r2c_d }
 
 # To avoid multiple-inheritance, we set up a function that returns much
 # of the initialization that will need to be handled in __init__ of both
@@ -406,13 +406,13 @@ def _fftw_setup(fftobj):
         tmpin = zeros(len(fftobj.invec), dtype = fftobj.invec.dtype)
         tmpout = zeros(len(fftobj.outvec), dtype = fftobj.outvec.dtype)
         # C2C, forward
-        if fftobj.forward and (fftobj.outvec.dtype in [complex64, complex128]):
+        if fftobj.forward and (fftobj.invec.dtype in [complex64, complex128]):
             plan = plan_func(1, n.ctypes.data, fftobj.nbatch,
                              tmpin.ptr, inembed.ctypes.data, 1, fftobj.idist,
                              tmpout.ptr, onembed.ctypes.data, 1, fftobj.odist,
                              FFTW_FORWARD, flags)
         # C2C, backward
-        elif not fftobj.forward and (fftobj.invec.dtype in [complex64, complex128]):
+        elif not fftobj.forward and (fftobj.outvec.dtype in [complex64, complex128]):
             plan = plan_func(1, n.ctypes.data, fftobj.nbatch,
                              tmpin.ptr, inembed.ctypes.data, 1, fftobj.idist,
                              tmpout.ptr, onembed.ctypes.data, 1, fftobj.odist,
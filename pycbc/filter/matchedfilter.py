@@ -66,6 +66,42 @@ class Correlator(object):
         real_cls = _correlate_factory(*args, **kwargs)
         return real_cls(*args, **kwargs)
 
+@pycbc.scheme.schemed(BACKEND_PREFIX)
+def _batch_correlate_factory(x, y, z, size, nbatch, kmin, kmax):
+    pass
+
+class BatchCorrelator(object):
+    """ Create a correlator engine acting on a batch of vectors at once
+
+    Parameters
+    ---------
+    x : complex64
+      Input pycbc.types.Array (or subclass); it will be conjugated. It holds
+      either nbatch vectors stored contiguously with a stride of size, or a
+      single vector that is used for every member of the batch.
+    y : complex64
+      Input pycbc.types.Array (or subclass); it will not be conjugated. It
+      may have either of the layouts allowed for x.
+    z : complex64
+      Output pycbc.types.Array (or subclass) holding nbatch vectors stored
+      contiguously with a stride of size. Elements kmin:kmax of each
+      vector will contain conj(x) * y, element by element
+    size : int
+      The stride, in elements, between consecutive vectors of the batch
+    nbatch : int
+      The number of vectors in the batch
+    kmin : int
+      The first element of each vector to correlate
+    kmax : int
+      One past the last element of each vector to correlate
+
+    The addresses in memory of the data of all three parameter vectors
+    must be the same modulo pycbc.PYCBC_ALIGNMENT
+    """
+    def __new__(cls, *args, **kwargs):
+        real_cls = _batch_correlate_factory(*args, **kwargs)
+        return real_cls(*args, **kwargs)
+
 # The class below should serve as the parent for all schemed classes.
 # The intention is that this class serves simply as the location for
 # all documentation of the class and its methods, though that is not
@@ -91,7 +127,7 @@ class MatchedFilterControl(object):
     def __init__(self, low_frequency_cutoff, high_frequency_cutoff, snr_threshold, tlen,
                  delta_f, dtype, segment_list, template_output, use_cluster,
                  downsample_factor=1, upsample_threshold=1, upsample_method='pruned_fft',
-                 gpu_callback_method='none'):
+                 gpu_callback_method='none', batch_size=1, segment_memory=None):
         """ Create a matched filter engine.
 
         Parameters
@@ -118,6 +154,17 @@ class MatchedFilterControl(object):
             The fraction of the snr_threshold to trigger on the subsampled filter.
         upsample_method : {pruned_fft, str}
             The method to upsample or interpolate the reduced rate filter.
+        batch_size : {1, int}, optional
+            The number of templates to filter at once. If larger than one,
+            template_output must hold batch_size templates, each stored with a
+            stride of tlen, and batch_matched_filter_and_cluster should be
+            used in place of matched_filter_and_cluster.
+        segment_memory : {None, Array}, optional
+            If given, the memory holding all of the segments in segment_list,
+            each stored with a stride of tlen, as provided by
+            StrainSegments.fourier_segments(contiguous=True). Each template is
+            then filtered against all segments at once by
+            multi_segment_matched_filter_and_cluster.
         """
         # Assuming analysis time is constant across templates and segments, also
         # delta_f is constant across segments.
@@ -130,7 +177,39 @@ class MatchedFilterControl(object):
         self.fhigh = high_frequency_cutoff
         self.gpu_callback_method = gpu_callback_method
 
-        if downsample_factor == 1:
+        self.batch_size = batch_size
+        if (batch_size > 1 or segment_memory is not None) and \
+                                                      downsample_factor != 1:
+            raise ValueError("Batched filtering is not supported together "
+                             "with a downsample factor")
+
+        if batch_size > 1 and segment_memory is not None:
+            raise ValueError("Templates and segments cannot both be batched")
+
+        if batch_size > 1:
+            self._setup_batch(batch_size, segment_list, template_output,
+                              use_cluster)
+
+            # One correlation of the whole template batch per segment,
+            # followed by a single batched inverse fft
+            self.batch_correlators = []
+            for seg in self.segments:
+                corr = BatchCorrelator(self.htilde, seg, self.corr_mem,
+                                       self.tlen, batch_size,
+                                       self.kmin, self.kmax)
+                self.batch_correlators.append(corr)
+
+        elif segment_memory is not None:
+            self._setup_batch(len(segment_list), segment_list,
+                              template_output, use_cluster)
+
+            # A single correlation of the template against all segments
+            self.segment_correlator = BatchCorrelator(self.htilde,
+                                       segment_memory, self.corr_mem,
+                                       self.tlen, len(segment_list),
+                                       self.kmin, self.kmax)
+
+        elif downsample_factor == 1:
             self.snr_mem = zeros(self.tlen, dtype=self.dtype)
             self.corr_mem = zeros(self.tlen, dtype=self.dtype)
             self.segments = segment_list
@@ -270,6 +349,132 @@ class MatchedFilterControl(object):
         logging.info("%s points above threshold" % str(len(idx)))
         return self.snr_mem, norm, self.corr_mem, idx, snrv
 
+    def _setup_batch(self, nbatch, segment_list, template_output, use_cluster):
+        """ Allocate the memory and the batched inverse fft shared by the
+        batched filtering modes.
+        """
+        self.segments = segment_list
+        self.htilde = template_output
+        self.use_cluster = use_cluster
+        self.kmin, self.kmax = get_cutoff_indices(self.flow, self.fhigh,
+                                                  self.delta_f, self.tlen)
+        self.snr_mem = zeros(self.tlen * nbatch, dtype=self.dtype)
+        self.corr_mem = zeros(self.tlen * nbatch, dtype=self.dtype)
+        self.ifft = IFFT(self.corr_mem, self.snr_mem, nbatch=nbatch,
+                         size=self.tlen)
+
+        # Views of each member of the batch, and the thresholding engines
+        # on them, which are created as needed for each analyzed interval
+        self.snr_rows = [self.snr_mem[i * self.tlen:(i + 1) * self.tlen]
+                         for i in range(nbatch)]
+        self.corr_rows = [self.corr_mem[i * self.tlen:(i + 1) * self.tlen]
+                          for i in range(nbatch)]
+        self.batch_threshold_and_clusterers = {}
+
+    def _batch_threshold_and_cluster(self, row, segnum, threshold, window):
+        """ Threshold and cluster one member of the batched snr memory over
+        the analyzed interval of the given segment.
+        """
+        ana = self.segments[segnum].analyze
+        snr = self.snr_rows[row][ana]
+        if not self.use_cluster:
+            return events.threshold_only(snr, threshold)
+
+        key = (row, ana.start, ana.stop)
+        if key not in self.batch_threshold_and_clusterers:
+            self.batch_threshold_and_clusterers[key] = \
+                                           events.ThresholdCluster(snr)
+        thresh = self.batch_threshold_and_clusterers[key]
+        return thresh.threshold_and_cluster(threshold, window)
+
+    def batch_matched_filter_and_cluster(self, segnum, template_norms, windows):
+        """ Return the complex snr and normalization for a batch of templates.
+
+        Calculate the matched filter of all the templates held in the
+        template memory against a single segment, then threshold and cluster
+        each resulting snr time series.
+
+        Parameters
+        ----------
+        segnum : int
+            Index into the list of segments at MatchedFilterControl construction
+            against which to filter.
+        template_norms : list of floats
+            The htilde, template normalization factor of each template to
+            filter. Only the first len(template_norms) templates of the batch
+            are used.
+        windows : {int, list of ints}
+            Size of the window over which to cluster triggers, in samples,
+            either for all templates or for each template in turn.
+
+        Returns
+        -------
+        results : list of tuples
+            For each template, the tuple (snr, norm, correlation, idx, snrv),
+            as returned by matched_filter_and_cluster.
+        """
+        num = len(template_norms)
+        if num > self.batch_size:
+            raise ValueError("More templates given than the batch size")
+
+        if not hasattr(windows, '__len__'):
+            windows = [windows] * num
+
+        self.batch_correlators[segnum].correlate()
+        self.ifft.execute()
+
+        results = []
+        for i, (template_norm, window) in enumerate(zip(template_norms, windows)):
+            norm = (4.0 * self.delta_f) / sqrt(template_norm)
+            snrv, idx = self._batch_threshold_and_cluster(i, segnum,
+                                          self.snr_threshold / norm, window)
+            if len(idx) == 0:
+                results.append(([], [], [], [], []))
+                continue
+
+            logging.info("%s points above threshold" % str(len(idx)))
+            results.append((self.snr_rows[i], norm, self.corr_rows[i],
+                            idx, snrv))
+        return results
+
+    def multi_segment_matched_filter_and_cluster(self, template_norms, window):
+        """ Return the complex snr and normalization for every segment.
+
+        Calculate the matched filter of the template against all of the
+        segments at once, then threshold and cluster the snr time series of
+        each segment over its analyzed interval.
+
+        Parameters
+        ----------
+        template_norms : list of floats
+            The htilde, template normalization factor for the psd of each
+            segment, in the order of the segments given at construction.
+        window : int
+            Size of the window over which to cluster triggers, in samples
+
+        Returns
+        -------
+        results : list of tuples
+            For each segment, the tuple (snr, norm, correlation, idx, snrv),
+            as returned by matched_filter_and_cluster.
+        """
+        self.segment_correlator.correlate()
+        self.ifft.execute()
+
+        results = []
+        for segnum, template_norm in enumerate(template_norms):
+            norm = (4.0 * self.delta_f) / sqrt(template_norm)
+            snrv, idx = self._batch_threshold_and_cluster(segnum, segnum,
+                                          self.snr_threshold / norm, window)
+            if len(idx) == 0:
+                results.append(([], [], [], [], []))
+                continue
+
+            logging.info("%s points above threshold" % str(len(idx)))
+            results.append((self.snr_rows[segnum], norm,
+                            self.corr_rows[segnum], idx, snrv))
+        return results
+
     def heirarchical_matched_filter_and_cluster(self, htilde, template_norm, stilde, window):
         """ Return the complex snr and normalization. 
     
@@ -831,5 +1036,6 @@ def quadratic_interpolate_peak(left, middle, right):
 
 __all__ = ['match', 'matched_filter', 'sigmasq', 'sigma', 'get_cutoff_indices',
            'sigmasq_series', 'make_frequency_series', 'overlap', 'overlap_cplx',
-           'matched_filter_core', 'correlate', 'MatchedFilterControl']
+           'matched_filter_core', 'correlate', 'MatchedFilterControl',
+           'BatchCorrelator']
 
@@ -23,7 +23,7 @@
 #
 import numpy
 from pycbc.opt import omp_libs, omp_flags
-from scipy.weave import inline
+from pycbc.kernels import inline, declare
 from .simd_correlate import default_segsize, corr_parallel_code, corr_support
 from .matchedfilter import _BaseCorrelator
 
@@ -53,6 +53,10 @@ for (int i=0; i<N; i++){
 """
 single_code = code.replace('TYPE', 'float')
 double_code = code.replace('TYPE', 'double')
+for _code, _ctype in [(single_code, 'std::complex<float>*'),
+                      (double_code, 'std::complex<double>*')]:
+    declare(_code, ['xa', 'ya', 'za', 'N'], [_ctype, _ctype, _ctype, 'int'],
+            support_code=support)
 
 def correlate_inline(x, y, z):
     if z.precision == 'single':
@@ -98,3 +102,28 @@ class CPUCorrelator(_BaseCorrelator):
         
 def _correlate_factory(x, y, z):
     return CPUCorrelator
+
+class CPUBatchCorrelator(_BaseCorrelator):
+    def __init__(self, x, y, z, size, nbatch, kmin, kmax):
+        self.size = size
+        self.nbatch = nbatch
+        self.x = self._batch_view(x, kmin, kmax)
+        self.y = self._batch_view(y, kmin, kmax)
+        self.z = self._batch_view(z, kmin, kmax)
+
+    def _batch_view(self, vec, kmin, kmax):
+        """ Return a view of the correlated part of each member of the batch;
+        a single vector is broadcast against the rest of the batch.
+        """
+        arr = numpy.array(vec.data, copy=False)
+        if len(arr) >= self.size * self.nbatch:
+            arr = arr[:self.size * self.nbatch].reshape(self.nbatch, self.size)
+            return arr[:, kmin:kmax]
+        return arr[kmin:kmax]
+
+    def correlate(self):
+        numpy.conjugate(self.x, out=self.z)
+        self.z *= self.y
+
+def _batch_correlate_factory(x, y, z, size, nbatch, kmin, kmax):
+    return CPUBatchCorrelator
@@ -138,6 +138,43 @@ LDAS_FIR_LP[8] = numpy.array( \
     -6.5785565693739621e-05, -1.7899485045886187e-19])
 
 
+# The factors of the successive stages that the ldas method resamples by
+LDAS_STAGES = {1: [], 2: [2], 4: [4], 8: [4, 2], 16: [4, 4], 32: [4, 2, 4],
+               64: [4, 4, 4]}
+
+def _polyphase_decimate(data, coefficients, factor, num_out):
+    """Return `num_out` samples of the data filtered by an FIR filter and
+    decimated, computing only the retained samples.
+
+    Output sample j is sum_k coefficients[k] * data[j * factor + n - 1 - k],
+    where n is the number of coefficients, so that the first output sample
+    is the first one that the filter is fully inside the data for. The data
+    must be long enough to give `num_out` such samples. The filter is split
+    into one subfilter for each phase of the decimation, each of which is
+    convolved with the samples of its phase.
+    """
+    taps = len(coefficients)
+    out = numpy.zeros(num_out, dtype=numpy.float64)
+    for p in xrange(min(factor, taps)):
+        sub = coefficients[p::factor]
+        first = taps - 1 - p - factor * (len(sub) - 1)
+        phase = data[first::factor][:num_out + len(sub) - 1]
+        out += numpy.convolve(phase, sub, mode='valid')
+    return out
+
+def lowpass_fir(factor):
+    """Return the coefficients of the LDAS low pass FIR filter used when
+    resampling by the given integer factor.
+
+    The coefficients are designed in the same way as those of LDAS, with a
+    Kaiser window with beta = 5 and a filter order of 20 * factor, so that
+    they match the tabulated LDAS coefficients for factors of 2, 4 and 8.
+    """
+    if factor in LDAS_FIR_LP:
+        return LDAS_FIR_LP[factor]
+    return scipy.signal.firwin(20 * factor + 1, 1.0 / factor,
+                               window=('kaiser', 5))
+
 _resample_func = {numpy.dtype('float32'): lal.ResampleREAL4TimeSeries,
                  numpy.dtype('float64'): lal.ResampleREAL8TimeSeries}
 
@@ -155,6 +192,11 @@ def resample_to_delta_t(timeseries, delta_t, method='butterworth'):
         The time series to be resampled
     delta_t: float
         The desired time step 
+    method: {'butterworth', 'ldas', 'polyphase'}
+        The method used to resample. The 'ldas' method applies the LDAS low
+        pass filters in stages for factors of 8 and above. The 'polyphase'
+        method applies the LDAS filter for any integer factor in one stage,
+        and only computes the samples that are kept.
 
     Returns
     -------
@@ -225,6 +267,25 @@ def resample_to_delta_t(timeseries, delta_t, method='butterworth'):
         # Decimate the time series
         data = data[::factor] * 1
         
+    elif method == 'polyphase':
+        factor = int(round(delta_t / timeseries.delta_t))
+        if factor < 1 or abs(factor * timeseries.delta_t - delta_t) > \
+                                                       1e-6 * delta_t:
+            raise ValueError('Polyphase resampling needs an integer factor')
+
+        filter_coefficients = lowpass_fir(factor)
+        half = len(filter_coefficients) / 2
+
+        # The samples within half the filter length of either end of the
+        # time series are corrupted, and so are zeroed
+        data = numpy.zeros((len(timeseries) + factor - 1) / factor)
+        first = (half + factor - 1) / factor
+        end = (len(timeseries) - half + factor - 1) / factor
+        if end > first:
+            data[first:end] = _polyphase_decimate(
+                                timeseries.numpy()[first * factor - half:],
+                                filter_coefficients, factor, end - first)
+
     else:
         raise ValueError('Invalid resampling method: %s' % method)
         
@@ -281,5 +342,5 @@ def highpass(timeseries, frequency, filter_order=8, attenuation=0.1):
 
     
 
-__all__ = ['resample_to_delta_t', 'highpass']
+__all__ = ['resample_to_delta_t', 'highpass', 'lowpass_fir']
 
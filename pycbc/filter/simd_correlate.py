@@ -15,7 +15,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from pycbc.types import float32
-from scipy.weave import inline
+from pycbc.kernels import inline, declare
 import numpy as _np
 import pycbc.opt
 from pycbc.opt import omp_support, omp_libs, omp_flags
@@ -417,6 +417,8 @@ void ccorrf_parallel(std::complex<float> * __restrict inconj,
 corr_simd_code = """
 ccorrf_simd(htilde, stilde, qtilde, (int64_t) arrlen);
 """
+declare(corr_simd_code, ['htilde', 'stilde', 'qtilde', 'arrlen'],
+        ['float*', 'float*', 'float*', 'int'], support_code=corr_support)
 
 def correlate_simd(ht, st, qt):
     htilde = _np.array(ht.data, copy = False).view(dtype = float32)
@@ -432,6 +434,9 @@ def correlate_simd(ht, st, qt):
 corr_parallel_code = """
 ccorrf_parallel(htilde, stilde, qtilde, (int64_t) arrlen, (int64_t) segsize);
 """
+declare(corr_parallel_code, ['htilde', 'stilde', 'qtilde', 'arrlen', 'segsize'],
+        ['std::complex<float>*', 'std::complex<float>*',
+         'std::complex<float>*', 'int', 'int'], support_code=corr_support)
 # We need a segment size (number of complex elements) such that *three* segments
 # of that size will fit in the L2 cache. We also want it to be a power of two.
 # We are dealing with single-precision complex numbers, which each require 8 bytes.
@@ -19,7 +19,7 @@ This modules contains functions for reading in data from frame files or caches
 import lalframe, logging
 import lal
 import numpy
-import os.path
+import os, os.path, glob, hashlib, tempfile, urlparse
 from pycbc.types import TimeSeries
 
 
@@ -63,8 +63,138 @@ def _read_channel(channel, stream, start, duration):
     return TimeSeries(data.data.data, delta_t=data.deltaT, epoch=start, 
                       dtype=d_type)
 
+def _entry_path(entry):
+    """ Return the local path of a frame cache entry, or None if the frame
+    file is not on a local or mounted file system.
+    """
+    url = urlparse.urlparse(entry.url)
+    if url.scheme not in ('', 'file'):
+        return None
+    return os.path.abspath(url.path)
+
+# The default size limit of the frame data cache, in GB
+DEFAULT_FRAME_CACHE_SIZE = 10
+
+def _frame_cache_size():
+    """ Return the size limit of the frame data cache in bytes, which is
+    given in GB by the PYCBC_FRAME_CACHE_SIZE environment variable.
+    """
+    size = os.environ.get('PYCBC_FRAME_CACHE_SIZE', DEFAULT_FRAME_CACHE_SIZE)
+    return float(size) * 1024 ** 3
+
+def _prune_frame_cache(cache_dir, max_bytes, keep=None):
+    """ Remove the least recently used entries of the frame data cache until
+    it holds no more than max_bytes, other than the entry named keep.
+    Processes that have memory mapped a removed entry can still use it.
+    """
+    entries = []
+    for name in glob.glob(os.path.join(cache_dir, '*.npy')):
+        try:
+            st = os.stat(name)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+        total -= size
+
+def _cached_file_channel(path, channel, t0, dt, cache_dir):
+    """ Return the data of a channel over the whole of a frame file, and its
+    sample interval, from the frame data cache.
+
+    The channel is decoded from the frame file and added to the cache if it
+    is not already there. Cached data is keyed by the path, size and
+    modification time of the frame file, and by the channel, and is memory
+    mapped copy-on-write, so that it is shared between the processes that
+    read it until it is modified. The least recently used entries are
+    removed when the cache grows beyond its size limit.
+    """
+    stat = os.stat(path)
+    key = hashlib.sha1('%s %s %s %s %s %s' % (path, stat.st_size,
+                       stat.st_mtime, channel, t0, dt)).hexdigest()
+    found = glob.glob(os.path.join(cache_dir, key + '_*.npy'))
+    if not found:
+        dir_name, file_name = os.path.split(path)
+        stream = lalframe.FrOpen(dir_name, file_name)
+        data = _read_channel(channel, stream, lal.LIGOTimeGPS(t0), dt)
+
+        # Write to a temporary file first, so that other processes never
+        # see a partly written entry
+        name = os.path.join(cache_dir,
+                            '%s_%s.npy' % (key, float(data.delta_t).hex()))
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            f = os.fdopen(fd, 'wb')
+            numpy.save(f, data.numpy())
+            f.close()
+            os.rename(tmp, name)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        found = [name]
+        _prune_frame_cache(cache_dir, _frame_cache_size(), keep=name)
+    else:
+        # Mark the entry as recently used
+        os.utime(found[0], None)
+
+    name = found[0]
+    delta_t = float.fromhex(name[:-len('.npy')].rsplit('_', 1)[1])
+    return numpy.load(name, mmap_mode='c'), delta_t
+
+def _read_channel_cached(channel, cache, start, duration, cache_dir):
+    """ Read a channel using the frame data cache, or return None if the
+    frame files do not cover the span contiguously.
+    """
+    end = float(start) + duration
+    entries = [e for e in cache.list
+               if e.t0 < end and e.t0 + e.dt > float(start)]
+    entries.sort(key=lambda e: e.t0)
+    if not entries or entries[0].t0 > float(start):
+        return None
+
+    pieces = []
+    delta_t = None
+    covered = float(start)
+    for entry in entries:
+        if entry.t0 > covered or entry.t0 + entry.dt <= covered:
+            continue
+        path = _entry_path(entry)
+        if path is None:
+            return None
+        data, delta_t = _cached_file_channel(path, channel, entry.t0,
+                                             entry.dt, cache_dir)
+        i0 = int(round((covered - entry.t0) / delta_t))
+        i1 = int(round((min(end, entry.t0 + entry.dt) - entry.t0) / delta_t))
+        pieces.append(data[i0:i1])
+        covered = min(end, entry.t0 + entry.dt)
+        if covered >= end:
+            break
+
+    if covered < end or \
+            sum(len(p) for p in pieces) != int(round(duration / delta_t)):
+        return None
+
+    # The cached data is only shared when it can be used in place
+    import pycbc.scheme
+    if len(pieces) == 1 and \
+            isinstance(pycbc.scheme.mgr.state, pycbc.scheme.CPUScheme):
+        return TimeSeries(pieces[0], delta_t=delta_t, epoch=start,
+                          copy=False)
+    return TimeSeries(numpy.concatenate(pieces), delta_t=delta_t,
+                      epoch=start)
+
 def read_frame(location, channels, start_time=None, 
-               end_time=None, duration=None):
+               end_time=None, duration=None, cache_dir=None):
     """Read time series from frame data.
 
     Using a the `location`, which can either be a frame file ".gwf" or a 
@@ -88,6 +218,16 @@ def read_frame(location, channels, start_time=None,
     duration : {None, float}, optional
         The amount of data to read in seconds. Note, this argument is 
         incompatible with `end`.
+    cache_dir : {None, string}, optional
+        A directory, ideally on a node-local disk, in which the channel data
+        decoded from each frame file is kept so that overlapping reads of
+        the same frame files, by this or other processes, are served from it
+        without reading the frame files again. Defaults to the value of the
+        PYCBC_FRAME_CACHE_DIR environment variable, if it is set. The
+        directory is created if needed. The least recently used entries are
+        removed when it holds more than PYCBC_FRAME_CACHE_SIZE GB of data,
+        or 10 GB if this is not set. If the cache cannot be used the frame
+        files are read directly.
 
     Returns
     -------
@@ -159,15 +299,43 @@ def read_frame(location, channels, start_time=None,
     #if duration > data_duration:
     #    raise ValueError("Requested duration longer than available data")
 
+    if cache_dir is None:
+        cache_dir = os.environ.get('PYCBC_FRAME_CACHE_DIR', None)
+    if cache_dir is not None and not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            # Another process may have created it
+            if not os.path.isdir(cache_dir):
+                logging.warn("Could not create the frame data cache %s: %s"
+                             % (cache_dir, e))
+                cache_dir = None
+
+    def read(channel):
+        if cache_dir is not None:
+            try:
+                data = _read_channel_cached(channel, stream.cache, start_time,
+                                            duration, cache_dir)
+            except (IOError, OSError) as e:
+                logging.warn("Could not use the frame data cache %s, so "
+                             "reading %s without it: %s"
+                             % (cache_dir, channel, e))
+                data = None
+            else:
+                if data is None:
+                    logging.info("Frame files do not cover the requested "
+                                 "data contiguously, so reading %s without "
+                                 "the frame data cache" % channel)
+            if data is not None:
+                return data
+        data = _read_channel(channel, stream, start_time, duration)
+        lalframe.FrStreamSeek(stream, start_time)
+        return data
+
     if type(channels) is list:
-        all_data = []
-        for channel in channels:
-            channel_data = _read_channel(channel, stream, start_time, duration)
-            lalframe.FrStreamSeek(stream, start_time)
-            all_data.append(channel_data)
-        return all_data
+        return [read(channel) for channel in channels]
     else:
-        return _read_channel(channels, stream, start_time, duration)
+        return read(channels)
         
 def datafind_connection(server=None):
     """ Return a connection to the datafind server
@@ -254,7 +422,8 @@ def frame_paths(frame_type, start_time, end_time, server=None):
     paths = [entry.path for entry in cache]
     return paths    
     
-def query_and_read_frame(frame_type, channels, start_time, end_time):
+def query_and_read_frame(frame_type, channels, start_time, end_time,
+                         cache_dir=None):
     """Read time series from frame data.
 
     Query for the locatin of physical frames matching the frame type. Return
@@ -272,6 +441,8 @@ def query_and_read_frame(frame_type, channels, start_time, end_time):
         beginning of the available frame(s). 
     end_time : LIGOTimeGPS or int
         The gps end time of the time series. Defaults to the end of the frame.
+    cache_dir : {None, string}, optional
+        The directory of the frame data cache, as for `read_frame`.
 
     Returns
     -------
@@ -289,7 +460,8 @@ def query_and_read_frame(frame_type, channels, start_time, end_time):
     logging.info('found files: %s' % (' '.join(paths)))
     return read_frame(paths, channels, 
                       start_time=start_time, 
-                      end_time=end_time)
+                      end_time=end_time,
+                      cache_dir=cache_dir)
     
 __all__ = ['read_frame', 'frame_paths', 
            'datafind_connection', 
@@ -6,6 +6,7 @@ import h5py
 import numpy as np
 import logging
 import inspect
+import collections
 
 from lal import LIGOTimeGPS, YRJUL_SI
 
@@ -21,13 +22,107 @@ from pycbc.tmpltbank import return_search_summary
 from pycbc.tmpltbank import return_empty_sngl
 from pycbc import events, pnutils
 
+class _DatasetPiece(object):
+    """ A dataset of an hdf5 file that is read only when rows are taken
+    from it, and not kept in memory afterwards.
+    """
+    def __init__(self, fname, key, length, dtype):
+        self.fname = fname
+        self.key = key
+        self.length = length
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        f = h5py.File(self.fname, "r")
+        ds = f[self.key]
+        if isinstance(index, slice):
+            data = ds[index]
+        elif len(index) == 0:
+            data = np.array([], dtype=self.dtype)
+        else:
+            # Read the span of rows that holds the selection, as h5py's
+            # own point selection is slow for many rows
+            start, stop = index.min(), index.max() + 1
+            data = ds[start:stop][index - start]
+        f.close()
+        return data
+
+class _ColumnStore(object):
+    """ The columns of a set of hdf5 files, each of which is only read when
+    it is first used.
+
+    Datasets that are stored contiguously and uncompressed are memory mapped
+    rather than read, so that only the rows that are used are ever loaded.
+    Other datasets are read each time rows are taken from them, so that
+    only the columns materialized by a DictArray are held in memory.
+    """
+    def __init__(self, files, groups):
+        self.files = files
+        self.groups = groups
+        self._pieces = {}
+
+    def keys(self):
+        return list(self.groups)
+
+    def pieces(self, key):
+        """ Return the part of the column held by each file that has it """
+        if key not in self._pieces:
+            pieces = []
+            for fname in self.files:
+                f = h5py.File(fname, "r")
+                if key in f:
+                    ds = f[key]
+                    offset = ds.id.get_offset()
+                    if offset is not None and ds.chunks is None \
+                            and ds.compression is None and len(ds) > 0:
+                        pieces.append(np.memmap(fname, mode='r',
+                                                dtype=ds.dtype, offset=offset,
+                                                shape=ds.shape))
+                    else:
+                        pieces.append(_DatasetPiece(fname, key, len(ds),
+                                                    ds.dtype))
+                f.close()
+            self._pieces[key] = pieces
+        return self._pieces[key]
+
+class _ArrayStore(object):
+    """ The columns of a dictionary of in memory arrays """
+    def __init__(self, data):
+        self.data = data
+
+    def keys(self):
+        return list(self.data.keys())
+
+    def pieces(self, key):
+        return [self.data[key]]
+
+class _Columns(collections.Mapping):
+    """ The dictionary of the columns of a DictArray, which are materialized
+    when they are first accessed.
+    """
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __getitem__(self, key):
+        return self.owner._column(key)
+
+    def __iter__(self):
+        return iter(self.owner._store.keys())
+
+    def __len__(self):
+        return len(self.owner._store.keys())
+
 class DictArray(object):
     """ Utility for organizing sets of arrays of equal length. 
     
     Manages a dictionary of arrays of equal length. This can also
-    be instantiated with a set of hdf5 files and the key values. The full
-    data is always in memory and all operations create new instances of the
-    DictArray.
+    be instantiated with a set of hdf5 files and the key values. Columns are
+    only read from the files when they are first accessed, and `select` and
+    `remove` return views that hold the indices of the selected rows, so
+    that the columns of a view are only materialized when they are used.
     """
     def __init__(self, data=None, files=None, groups=None):
         """ Create a DictArray
@@ -41,31 +136,74 @@ class DictArray(object):
         groups: list of strings
             List of keys into each file. Required by the files options.
         """
-        self.data = data
-        
         if files:
-            self.data = {}
-            for g in groups:
-                self.data[g] = []
-            
-            for f in files:
-                d = h5py.File(f)
-                for g in groups:
-                    if g in d:
-                        self.data[g].append(d[g][:])
-                    
-            for k in self.data:
-                if not len(self.data[k]) == 0:
-                    self.data[k] = np.concatenate(self.data[k])
+            self._store = _ColumnStore(files, groups)
+        else:
+            self._store = _ArrayStore(data)
+        self._index = None
+        self._cache = {}
 
-        for k in self.data:
-            setattr(self, k, self.data[k])
+    @property
+    def data(self):
+        """ Dictionary of the columns of this DictArray """
+        return _Columns(self)
+
+    def __getattr__(self, key):
+        if key.startswith('_') or key not in self._store.keys():
+            raise AttributeError(key)
+        return self._column(key)
+
+    def _materialize(self, key):
+        """ Return the selected rows of a column, without caching them """
+        pieces = self._store.pieces(key)
+        if len(pieces) == 0:
+            return np.array([])
+
+        if self._index is None:
+            if len(pieces) == 1:
+                col = pieces[0][:]
+                if isinstance(pieces[0], _DatasetPiece):
+                    return col
+                return np.array(col)
+            return np.concatenate([p[:] for p in pieces])
+
+        if len(pieces) == 1:
+            return pieces[0][self._index]
+
+        # Gather the rows of each file that are selected
+        offsets = np.cumsum([0] + [len(p) for p in pieces])
+        which = np.searchsorted(offsets, self._index, side='right') - 1
+        col = np.empty(len(self._index), dtype=pieces[0].dtype)
+        for i, piece in enumerate(pieces):
+            locs = np.where(which == i)[0]
+            if len(locs):
+                col[locs] = piece[self._index[locs] - offsets[i]]
+        return col
+
+    def _column(self, key):
+        if key not in self._cache:
+            self._cache[key] = self._materialize(key)
+        return self._cache[key]
+
+    def _view(self, index):
+        """ Return a DictArray of the given rows of the underlying columns """
+        view = self.__class__.__new__(self.__class__)
+        view.__dict__.update(self.__dict__)
+        view._index = index
+        view._cache = {}
+        return view
 
     def _return(self, data):
         return self.__class__(data=data)
 
     def __len__(self):
-        return len(self.data[self.data.keys()[0]])
+        if self._index is not None:
+            return len(self._index)
+        for k in self._store.keys():
+            pieces = self._store.pieces(k)
+            if len(pieces):
+                return sum(len(p) for p in pieces)
+        return 0
 
     def __add__(self, other):
         data = {}
@@ -73,21 +211,21 @@ class DictArray(object):
             data[k] = np.concatenate([self.data[k], other.data[k]])
         return self._return(data=data)
 
+    def _rows(self):
+        if self._index is None:
+            return np.arange(len(self))
+        return self._index
+
     def select(self, idx):
-        """ Return a new DictArray containing only the indexed values
+        """ Return a view of this DictArray containing only the indexed values
         """
-        data = {}
-        for k in self.data:
-            data[k] = self.data[k][idx]
-        return self._return(data=data)
+        return self._view(self._rows()[idx])
    
     def remove(self, idx):
-        """ Return a new DictArray that does not contain the indexed values
+        """ Return a view of this DictArray that does not contain the indexed
+        values
         """
-        data = {}
-        for k in self.data:
-            data[k] = np.delete(self.data[k], idx)
-        return self._return(data=data)
+        return self._view(np.delete(self._rows(), idx))
 
 class StatmapData(DictArray):
     def __init__(self, data=None, seg=None, attrs=None,
@@ -112,7 +250,7 @@ class StatmapData(DictArray):
         time1, time2, stat, and timeslide_id
         """
         # If no events, do nothing
-        if len(self.time1) == 0 or len(self.time2) == 0:
+        if len(self) == 0:
             return self
         from pycbc.events import cluster_coincs
         interval = self.attrs['timeslide_interval']
@@ -126,7 +264,7 @@ class StatmapData(DictArray):
             f.attrs[k] = self.attrs[k]
             
         for k in self.data:
-            f[k] = self.data[k]
+            f[k] = self._materialize(k)
 
         for key in self.seg.keys():
             f['segments/%s/start' % key] = self.seg[key]['start'][:]
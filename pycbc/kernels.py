@@ -0,0 +1,312 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+This module provides ahead of time compiled versions of the CPU kernels that
+are otherwise compiled by scipy.weave when they are first used.
+
+Modules declare each of their weave kernels, with the C types of its
+arguments, using `declare`. When pycbc is installed, `build_library` compiles
+all of the declared kernels into a single shared library that is installed
+alongside this module. The `inline` function of this module is then used in
+place of scipy.weave.inline: it calls the compiled kernel if the library has
+one for the given code and argument types, and otherwise falls back to weave.
+A kernel whose code has changed since the library was built is not found in
+it, and so is compiled by weave as before.
+
+The library is compiled for the CPU of the build host. The CPU flags of that
+host are recorded alongside it, and the library is not used on a host that
+lacks any of them, such as an older compute node of a shared install, where
+the kernels are compiled by weave instead.
+"""
+import os, sys, ctypes, hashlib, logging, subprocess, tempfile, shutil
+import numpy
+from collections import OrderedDict
+
+# The modules that declare kernels, which are imported when building
+KERNEL_MODULES = ['pycbc.events.coinc',
+                  'pycbc.events.threshold_cpu',
+                  'pycbc.events.simd_threshold',
+                  'pycbc.filter.matchedfilter_cpu',
+                  'pycbc.filter.simd_correlate',
+                  'pycbc.vetoes.chisq_cpu',
+                  'pycbc.waveform.spa_tmplt_cpu',
+                 ]
+
+LIBRARY_NAME = 'libpycbc_kernels.so'
+CPU_FLAGS_SUFFIX = '.cpuflags'
+
+_array_types = {numpy.dtype(numpy.float32): 'float',
+                numpy.dtype(numpy.float64): 'double',
+                numpy.dtype(numpy.complex64): 'std::complex<float>',
+                numpy.dtype(numpy.complex128): 'std::complex<double>',
+                numpy.dtype(numpy.int32): 'int',
+                numpy.dtype(numpy.uint32): 'unsigned int',
+                numpy.dtype(numpy.int64): 'int64_t',
+                numpy.dtype(numpy.uint64): 'uint64_t',
+               }
+
+_scalar_ctypes = {'int': ctypes.c_int,
+                  'double': ctypes.c_double,
+                 }
+
+_header = """
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <math.h>
+#include <complex>
+"""
+
+_declared = OrderedDict()
+
+def cpu_flags():
+    """ Return the set of instruction set flags of the CPU of this host, or
+    None if they cannot be found.
+    """
+    try:
+        f = open('/proc/cpuinfo')
+        lines = f.readlines()
+        f.close()
+    except IOError:
+        return None
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name.strip() in ('flags', 'Features'):
+            return set(value.split())
+    return None
+
+def c_type(value):
+    """ Return the C type that scipy.weave would use for the given value, or
+    None if it is not one that the compiled kernels support.
+    """
+    if isinstance(value, numpy.ndarray):
+        if value.dtype in _array_types:
+            return _array_types[value.dtype] + '*'
+        return None
+    if isinstance(value, (bool, int, long, numpy.integer)):
+        return 'int'
+    if isinstance(value, (float, numpy.floating)):
+        return 'double'
+    return None
+
+def symbol_name(code, support_code, arg_types):
+    """ Return the name of the compiled kernel for the given code, support
+    code and argument types.
+    """
+    key = '\n'.join([code, support_code or ''] + list(arg_types))
+    return 'pycbc_kernel_' + hashlib.sha1(key).hexdigest()[:20]
+
+def declare(code, arg_names, arg_types, support_code=None):
+    """ Declare a kernel to be compiled into the kernel library.
+
+    Parameters
+    ----------
+    code : str
+        The code of the kernel, as it is given to scipy.weave.inline
+    arg_names : list of str
+        The names of the variables the kernel uses, in the order that they
+        are given to inline
+    arg_types : list of str
+        The C type of each variable, as returned by `c_type`. Kernels are
+        only compiled for these types.
+    support_code : {None, str}
+        The support code of the kernel
+    """
+    if len(arg_names) != len(arg_types):
+        raise ValueError("A type must be given for each argument of a kernel")
+    name = symbol_name(code, support_code, arg_types)
+    _declared[name] = (code, list(arg_names), list(arg_types),
+                       support_code or '')
+
+def kernel_source(name, code, arg_names, arg_types):
+    """ Return the C++ source of a kernel as a function of the library """
+    args = ', '.join('%s %s' % (t, n) for t, n in zip(arg_types, arg_names))
+    return """
+extern "C" long %s(%s){
+    long return_val = 0;
+    {
+%s
+    }
+    return return_val;
+}
+""" % (name, args, code)
+
+def build_library(path, compiler='g++', extra_flags=None):
+    """ Compile all of the declared kernels into a shared library.
+
+    Kernels that share support code are compiled together, as the support
+    code may define functions.
+
+    Parameters
+    ----------
+    path : str
+        The name of the shared library to write
+    compiler : {'g++', str}
+        The C++ compiler to use
+    extra_flags : {None, list of str}
+        Flags given to the compiler in place of the default ones, which are
+        those used with scipy.weave.
+    """
+    import importlib, pycbc
+    for module in KERNEL_MODULES:
+        importlib.import_module(module)
+
+    from pycbc.opt import omp_flags, omp_libs
+    if extra_flags is None:
+        extra_flags = ['-march=native', '-O3', '-w']
+    flags = ['-shared', '-fPIC'] + extra_flags + omp_flags
+
+    groups = OrderedDict()
+    for name, (code, arg_names, arg_types, support) in _declared.items():
+        groups.setdefault(support, []).append(
+                                 kernel_source(name, code, arg_names, arg_types))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sources = []
+        for i, (support, kernels) in enumerate(groups.items()):
+            src = os.path.join(tmpdir, 'kernels_%s.cpp' % i)
+            f = open(src, 'w')
+            f.write(_header + support + ''.join(kernels))
+            f.close()
+            sources.append(src)
+
+        cmd = [compiler] + flags + ['-o', path] + sources
+        cmd += ['-l%s' % lib for lib in omp_libs]
+        logging.info(' '.join(cmd))
+        subprocess.check_call(cmd)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # Record the CPU the library was compiled for
+    flags = cpu_flags()
+    if flags is not None:
+        f = open(path + CPU_FLAGS_SUFFIX, 'w')
+        f.write(' '.join(sorted(flags)))
+        f.close()
+    elif os.path.exists(path + CPU_FLAGS_SUFFIX):
+        os.remove(path + CPU_FLAGS_SUFFIX)
+
+    logging.info("Compiled %s kernels into %s" % (len(_declared), path))
+    return path
+
+def library_supported(path):
+    """ Return True if the library at path can be run on the CPU of this
+    host, which must have all of the CPU flags of the host that built it.
+    """
+    flags_file = path + CPU_FLAGS_SUFFIX
+    if not os.path.exists(flags_file):
+        # The flags of the build host were not known, so neither should
+        # those of this one be
+        return cpu_flags() is None
+
+    f = open(flags_file)
+    build_flags = set(f.read().split())
+    f.close()
+    flags = cpu_flags()
+    if flags is None:
+        return False
+    missing = build_flags - flags
+    if missing:
+        logging.info("Not using the kernel library %s, which was compiled "
+                     "for a CPU with %s" % (path, ' '.join(sorted(missing))))
+        return False
+    return True
+
+def load_library(path):
+    """ Load the kernel library at path, or return None if it cannot be
+    used on this host.
+    """
+    if not library_supported(path):
+        return None
+    try:
+        return ctypes.cdll.LoadLibrary(path)
+    except OSError as e:
+        logging.warn("Could not load the kernel library %s: %s" % (path, e))
+        return None
+
+_library = None
+_functions = {}
+
+def get_library():
+    """ Return the kernel library, or None if it was not built """
+    global _library
+    if _library is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            LIBRARY_NAME)
+        _library = False
+        if os.path.exists(path) and 'PYCBC_NO_COMPILED_KERNELS' not in os.environ:
+            _library = load_library(path) or False
+    return _library or None
+
+def get_kernel(code, support_code, arg_types):
+    """ Return the compiled function of a kernel, or None if it is not in
+    the kernel library.
+    """
+    name = symbol_name(code, support_code, arg_types)
+    if name not in _functions:
+        fn = None
+        lib = get_library()
+        if lib is not None:
+            try:
+                fn = getattr(lib, name)
+                fn.restype = ctypes.c_long
+                fn.argtypes = [ctypes.c_void_p if t.endswith('*')
+                               else _scalar_ctypes[t] for t in arg_types]
+            except AttributeError:
+                fn = None
+        _functions[name] = fn
+    return _functions[name]
+
+def inline(code, arg_names, local_dict=None, global_dict=None,
+           support_code=None, **kwds):
+    """ Run a kernel in the same way as scipy.weave.inline.
+
+    The compiled kernel is used if the kernel library has one for the code
+    and the types of the given variables. Otherwise the kernel is compiled
+    and run by scipy.weave, to which all of the arguments are passed.
+    """
+    frame = sys._getframe(1)
+    if local_dict is None:
+        local_dict = frame.f_locals
+    if global_dict is None:
+        global_dict = frame.f_globals
+
+    values = []
+    for name in arg_names:
+        if name in local_dict:
+            values.append(local_dict[name])
+        else:
+            values.append(global_dict[name])
+    arg_types = [c_type(v) for v in values]
+
+    if None not in arg_types:
+        fn = get_kernel(code, support_code, arg_types)
+        if fn is not None:
+            args = []
+            for v, t in zip(values, arg_types):
+                if t.endswith('*'):
+                    args.append(v.ctypes.data)
+                elif t == 'int':
+                    args.append(int(v))
+                else:
+                    args.append(float(v))
+            return fn(*args)
+
+    from scipy.weave import inline as weave_inline
+    return weave_inline(code, arg_names, local_dict=local_dict,
+                        global_dict=global_dict, support_code=support_code,
+                        **kwds)
@@ -25,7 +25,7 @@ from pycbc.types import required_opts, required_opts_multi_ifo
 from pycbc.types import ensure_one_opt, ensure_one_opt_multi_ifo
 
 def from_cli(opt, length, delta_f, low_frequency_cutoff, 
-             strain=None, dyn_range_factor=1, precision=None):
+             strain=None, dyn_range_factor=1, precision=None, estimator=None):
     """Parses the CLI options related to the noise PSD and returns a
     FrequencySeries with the corresponding PSD. If necessary, the PSD is
     linearly interpolated to achieve the resolution specified in the CLI.
@@ -56,6 +56,10 @@ def from_cli(opt, length, delta_f, low_frequency_cutoff,
         If 'single' the PSD will be converted to float32, if not already in
         that precision. If 'double' the PSD will be converted to float64, if
         not already in that precision.
+    estimator : {None, IncrementalPSD}
+        If given, the PSD is estimated by this estimator, of which `strain`
+        must be a part of the time series, so that the segment spectra are
+        shared with the other parts that it is called for.
 
     Returns
     -------
@@ -82,9 +86,16 @@ def from_cli(opt, length, delta_f, low_frequency_cutoff,
     elif opt.psd_estimation and not (opt.psd_model or 
                                      opt.psd_file or opt.asd_file):
         # estimate PSD from data
-        psd = welch(strain, avg_method=opt.psd_estimation,
-                    seg_len=int(opt.psd_segment_length * sample_rate),
-                    seg_stride=int(opt.psd_segment_stride * sample_rate))
+        if estimator is not None:
+            start = int(round(float(strain.start_time -
+                  estimator.timeseries.start_time) / strain.delta_t))
+            psd = estimator.psd(start, start + len(strain))
+        else:
+            median_method = getattr(opt, 'psd_median_method', None) or 'exact'
+            psd = welch(strain, avg_method=opt.psd_estimation,
+                        seg_len=int(opt.psd_segment_length * sample_rate),
+                        seg_stride=int(opt.psd_segment_stride * sample_rate),
+                        median_method=median_method)
 
         if delta_f != psd.delta_f:
             psd = interpolate(psd, delta_f)
@@ -169,6 +180,12 @@ def insert_psd_option_group(parser, output=True):
     psd_options.add_argument("--psd-segment-stride", type=float, 
                           help="(Required for --psd-estimation) The separation"
                                " between consecutive segments (s)")
+    psd_options.add_argument("--psd-median-method", default="exact",
+                          choices=["exact", "p2"],
+                          help="(Optional) How the median of the segment PSDs "
+                          "is taken when measuring the PSD. 'p2' uses a "
+                          "running estimate that does not keep every segment "
+                          "PSD in memory. Default 'exact'.")
     psd_options.add_argument("--psd-inverse-length", type=float, 
                           help="(Optional) The maximum length of the impulse"
                           " response of the overwhitening filter (s)")
@@ -216,6 +233,12 @@ def insert_psd_option_group_multi_ifo(parser):
                           action=MultiDetOptionAction, metavar='IFO:STRIDE',
                           help="(Required for --psd-estimation) The separation"
                                " between consecutive segments (s)")
+    psd_options.add_argument("--psd-median-method", nargs="+",
+                          action=MultiDetOptionAction, metavar='IFO:METHOD',
+                          help="(Optional) How the median of the segment PSDs "
+                          "is taken when measuring the PSD. Choose from "
+                          "exact or p2; p2 uses a running estimate that does "
+                          "not keep every segment PSD in memory.")
     psd_options.add_argument("--psd-inverse-length", type=float, nargs="+",
                           action=MultiDetOptionAction, metavar='IFO:LENGTH',
                           help="(Optional) The maximum length of the impulse"
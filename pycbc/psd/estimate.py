@@ -19,7 +19,9 @@
 import numpy
 from pycbc.types import Array, FrequencySeries, TimeSeries, zeros
 from pycbc.types import real_same_precision_as, complex_same_precision_as
-from pycbc.fft import fft, ifft
+from pycbc.fft import fft, ifft, FFT
+from pycbc.fft.backend_support import get_backend
+from numpy.lib.stride_tricks import as_strided
 
 def median_bias(n):
     """Calculate the bias of the median average PSD computed from `n` segments.
@@ -52,8 +54,160 @@ def median_bias(n):
         ans += 1.0 / (2*i + 1) - 1.0 / (2*i)
     return ans
 
+class SegmentSpectra(object):
+    """Calculate the power spectra of windowed segments of a time series,
+    many segments at a time, with a single batched FFT.
+
+    Parameters
+    ----------
+    seg_len : int
+        Segment length in samples.
+    window : numpy.ndarray
+        The window applied to each segment before Fourier transforming.
+    delta_t : float
+        The sample spacing of the time series.
+    dtype : numpy.dtype
+        The real dtype of the time series.
+    batch_size : {64, int}
+        The number of segments transformed at once.
+
+    The segments are always held in host memory. Outside of the CPU scheme,
+    or when the fft backend has no batched FFT class, they are transformed
+    with numpy.
+    """
+    def __init__(self, seg_len, window, delta_t, dtype, batch_size=64):
+        import pycbc.scheme
+        if dtype == numpy.float32:
+            fs_dtype = numpy.complex64
+        else:
+            fs_dtype = numpy.complex128
+
+        self.seg_len = seg_len
+        self.flen = seg_len / 2 + 1
+        self.delta_t = delta_t
+        self.batch_size = batch_size
+        self.window = numpy.array(window, dtype=dtype)
+
+        self.fft = None
+        if isinstance(pycbc.scheme.mgr.state, pycbc.scheme.CPUScheme) and \
+                hasattr(get_backend(), 'FFT'):
+            self.segment_mem = zeros(seg_len * batch_size, dtype=dtype)
+            self.segment_tilde_mem = zeros(self.flen * batch_size,
+                                           dtype=fs_dtype)
+            self.segments = self.segment_mem.numpy().reshape(batch_size,
+                                                             seg_len)
+            self.segment_tildes = self.segment_tilde_mem.numpy().reshape(
+                                                        batch_size, self.flen)
+            self.fft = FFT(self.segment_mem, self.segment_tilde_mem,
+                           nbatch=batch_size, size=seg_len)
+        else:
+            self.segments = numpy.zeros((batch_size, seg_len), dtype=dtype)
+
+    def spectra(self, data, starts):
+        """Return the power spectrum of the segments of the data starting at
+        each of the given sample indices, with the DC and Nyquist components
+        halved to be consistent with TO10095.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            The time series samples.
+        starts : numpy.ndarray
+            The start of each segment, at most batch_size of them.
+
+        Returns
+        -------
+        psds : numpy.ndarray
+            Array of shape (len(starts), seg_len / 2 + 1) holding the power
+            spectrum of each segment, not yet normalized by the window.
+        """
+        num = len(starts)
+        starts = numpy.asarray(starts)
+        stride = numpy.diff(starts) if num > 1 else [self.seg_len]
+        if num > 1 and (stride == stride[0]).all() and stride[0] > 0:
+            # The segments are a strided view of the data
+            view = as_strided(data[starts[0]:], shape=(num, self.seg_len),
+                    strides=(stride[0] * data.strides[0], data.strides[0]))
+            numpy.multiply(view, self.window, out=self.segments[:num])
+        else:
+            for i, start in enumerate(starts):
+                numpy.multiply(data[start:start + self.seg_len], self.window,
+                               out=self.segments[i])
+        if self.fft is not None:
+            self.segments[num:] = 0
+            self.fft.execute()
+            tilde = self.segment_tildes[:num]
+        else:
+            tilde = numpy.fft.rfft(self.segments[:num], axis=1)
+        tilde *= self.delta_t
+        psds = tilde.real ** 2 + tilde.imag ** 2
+        psds[:, 0] /= 2
+        psds[:, -1] /= 2
+        return psds
+
+class P2Median(object):
+    """Running estimate of the median of each element of a sequence of
+    arrays, using the P-square algorithm of Jain and Chlamtac (1985), which
+    keeps five markers per element rather than the arrays themselves.
+    """
+    def __init__(self):
+        self.count = 0
+        self.first = []
+
+    def update(self, x):
+        """Add the array x to the sequence"""
+        x = numpy.array(x, dtype=numpy.float64)
+        self.count += 1
+        if self.count <= 5:
+            self.first.append(x)
+            if self.count == 5:
+                self.q = numpy.sort(numpy.array(self.first), axis=0)
+                self.n = numpy.zeros(self.q.shape)
+                self.n += numpy.arange(5)[:, None]
+                self.desired = numpy.arange(5, dtype=numpy.float64)
+                self.first = None
+            return
+
+        q, n = self.q, self.n
+        numpy.minimum(q[0], x, out=q[0])
+        numpy.maximum(q[4], x, out=q[4])
+        n[1:4] += x < q[1:4]
+        n[4] += 1
+        self.desired += [0, 0.25, 0.5, 0.75, 1]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            adj = ((d >= 1) & (n[i + 1] - n[i] > 1)) | \
+                  ((d <= -1) & (n[i - 1] - n[i] < -1))
+            if not adj.any():
+                continue
+
+            sgn = numpy.sign(d[adj])
+            qa, qb, qc = q[i - 1][adj], q[i][adj], q[i + 1][adj]
+            na, nb, nc = n[i - 1][adj], n[i][adj], n[i + 1][adj]
+
+            # Parabolic prediction of the marker height, or linear if that
+            # would not keep the markers in order
+            qp = qb + sgn / (nc - na) * ((nb - na + sgn) * (qc - qb) / (nc - nb)
+                                       + (nc - nb - sgn) * (qb - qa) / (nb - na))
+            linear = (qp <= qa) | (qp >= qc)
+            qn = numpy.where(sgn > 0, qc, qa)
+            nn = numpy.where(sgn > 0, nc, na)
+            qp[linear] = (qb + sgn * (qn - qb) / (nn - nb))[linear]
+
+            q[i][adj] = qp
+            n[i][adj] += sgn
+
+    def median(self):
+        """Return the current estimate of the median"""
+        if self.count == 0:
+            raise ValueError('No arrays have been given')
+        if self.count < 5:
+            return numpy.median(numpy.array(self.first), axis=0)
+        return self.q[2].copy()
+
 def welch(timeseries, seg_len=4096, seg_stride=2048, window='hann', \
-        avg_method='median'):
+        avg_method='median', median_method='exact', batch_size=64):
     """PSD estimator based on Welch's method.
 
     Parameters
@@ -68,6 +222,12 @@ def welch(timeseries, seg_len=4096, seg_stride=2048, window='hann', \
         Function used to window segments before Fourier transforming.
     avg_method : {'median', 'mean', 'median-mean'}
         Method used for averaging individual segment PSDs.
+    median_method : {'exact', 'p2'}
+        How medians are taken. 'exact' keeps the PSD of every segment in
+        one array, while 'p2' uses a running estimate of the median that
+        does not store them.
+    batch_size : {64, int}
+        Number of segments Fourier transformed at once.
 
     Returns
     -------
@@ -77,9 +237,9 @@ def welch(timeseries, seg_len=4096, seg_stride=2048, window='hann', \
     Raises
     ------
     ValueError
-        For invalid choices of `seg_len`, `seg_stride` `window` and
-        `avg_method` and for inconsistent combinations of len(`timeseries`),
-        `seg_len` and `seg_stride`.
+        For invalid choices of `seg_len`, `seg_stride` `window`,
+        `avg_method` and `median_method` and for inconsistent combinations
+        of len(`timeseries`), `seg_len` and `seg_stride`.
 
     Notes
     -----
@@ -94,15 +254,12 @@ def welch(timeseries, seg_len=4096, seg_stride=2048, window='hann', \
         raise ValueError('Invalid window')
     if not avg_method in ('mean', 'median', 'median-mean'):
         raise ValueError('Invalid averaging method')
+    if not median_method in ('exact', 'p2'):
+        raise ValueError('Invalid median method')
     if type(seg_len) is not int or type(seg_stride) is not int \
         or seg_len <= 0 or seg_stride <= 0:
         raise ValueError('Segment length and stride must be positive integers')
 
-    if timeseries.precision == 'single':
-        fs_dtype = numpy.complex64
-    elif timeseries.precision == 'double':
-        fs_dtype = numpy.complex128
-        
     num_samples = len(timeseries)
     num_segments = num_samples / seg_stride
     
@@ -111,47 +268,206 @@ def welch(timeseries, seg_len=4096, seg_stride=2048, window='hann', \
     if num_samples != (num_segments - 1) * seg_stride + seg_len:
         raise ValueError('Incorrect choice of segmentation parameters')
         
-    w = Array(window_map[window](seg_len).astype(timeseries.dtype))
+    w = window_map[window](seg_len).astype(timeseries.dtype)
 
     # calculate psd of each segment
     delta_f = 1. / timeseries.delta_t / seg_len
-    segment_tilde = FrequencySeries(numpy.zeros(seg_len / 2 + 1), \
-        delta_f=delta_f, dtype=fs_dtype)
-        
-    segment_psds = []
-    for i in xrange(num_segments):
-        segment_start = i * seg_stride
-        segment_end = segment_start + seg_len
-        segment = timeseries[segment_start:segment_end]
-        assert len(segment) == seg_len
-        fft(segment * w, segment_tilde)
-        seg_psd = abs(segment_tilde * segment_tilde.conj()).numpy()
-      
-        #halve the DC and Nyquist components to be consistent with TO10095
-        seg_psd[0] /= 2
-        seg_psd[-1] /= 2
-        
-        segment_psds.append(seg_psd)
-        
-    segment_psds = numpy.array(segment_psds)   
+    flen = seg_len / 2 + 1
+    batch_size = min(batch_size, num_segments)
+    spectra = SegmentSpectra(seg_len, w, timeseries.delta_t,
+                             timeseries.dtype, batch_size=batch_size)
+    data = timeseries.numpy()
 
     if avg_method == 'mean':
-        psd = numpy.mean(segment_psds, axis=0)
-    elif avg_method == 'median':
-        psd = numpy.median(segment_psds, axis=0) / median_bias(num_segments)
-    elif avg_method == 'median-mean':
-        odd_psds = segment_psds[::2]
-        even_psds = segment_psds[1::2]
-        odd_median = numpy.median(odd_psds, axis=0) / \
-            median_bias(len(odd_psds))
-        even_median = numpy.median(even_psds, axis=0) / \
-            median_bias(len(even_psds))
-        psd = (odd_median + even_median) / 2
+        psd = numpy.zeros(flen, dtype=numpy.float64)
+    elif median_method == 'exact':
+        segment_psds = numpy.zeros((num_segments, flen), dtype=timeseries.dtype)
+    else:
+        odd_median = P2Median()
+        even_median = P2Median()
+
+    for first in xrange(0, num_segments, batch_size):
+        num = min(batch_size, num_segments - first)
+        starts = (first + numpy.arange(num)) * seg_stride
+        seg_psds = spectra.spectra(data, starts)
+
+        if avg_method == 'mean':
+            psd += seg_psds.sum(axis=0)
+        elif median_method == 'exact':
+            segment_psds[first:first + num] = seg_psds
+        else:
+            for i, seg_psd in enumerate(seg_psds):
+                if (first + i) % 2 == 0 or avg_method == 'median':
+                    odd_median.update(seg_psd)
+                else:
+                    even_median.update(seg_psd)
+
+    if avg_method == 'mean':
+        psd /= num_segments
+    elif median_method == 'exact':
+        if avg_method == 'median':
+            psd = numpy.median(segment_psds, axis=0) / median_bias(num_segments)
+        else:
+            odd_psds = segment_psds[::2]
+            even_psds = segment_psds[1::2]
+            odd_median = numpy.median(odd_psds, axis=0) / \
+                median_bias(len(odd_psds))
+            even_median = numpy.median(even_psds, axis=0) / \
+                median_bias(len(even_psds))
+            psd = (odd_median + even_median) / 2
+    else:
+        if avg_method == 'median':
+            psd = odd_median.median() / median_bias(num_segments)
+        else:
+            psd = (odd_median.median() / median_bias(odd_median.count) +
+                   even_median.median() / median_bias(even_median.count)) / 2
 
     psd *= 2 * delta_f * seg_len / (w*w).sum()
 
     return FrequencySeries(psd, delta_f=delta_f, dtype=timeseries.dtype)
 
+class IncrementalPSD(object):
+    """Welch PSD estimates of windows of a time series, which reuse the
+    segment spectra that overlapping windows have in common.
+
+    The Welch segments are laid on a fixed grid, starting every `seg_stride`
+    samples from the start of the time series. The spectra of the segments
+    of the current window are kept in a ring buffer, so that moving the
+    window only transforms the segments that enter it, and the running sum
+    used for the mean is updated by the segments that enter and leave it.
+    For a window starting on the grid whose length fits a whole number of
+    segments, the PSD is the same as that given by `welch`.
+
+    Parameters
+    ----------
+    timeseries : TimeSeries
+        Time series whose windows the PSD is to be estimated for.
+    seg_len : int
+        Segment length in samples.
+    seg_stride : int
+        Separation between consecutive segments, in samples.
+    window : {'hann'}
+        Function used to window segments before Fourier transforming.
+    avg_method : {'median', 'mean', 'median-mean'}
+        Method used for averaging individual segment PSDs.
+    batch_size : {64, int}
+        Number of segments Fourier transformed at once.
+    """
+    def __init__(self, timeseries, seg_len, seg_stride, window='hann',
+                 avg_method='median', batch_size=64):
+        if window != 'hann':
+            raise ValueError('Invalid window')
+        if not avg_method in ('mean', 'median', 'median-mean'):
+            raise ValueError('Invalid averaging method')
+        if type(seg_len) is not int or type(seg_stride) is not int \
+            or seg_len <= 0 or seg_stride <= 0:
+            raise ValueError('Segment length and stride must be positive integers')
+
+        self.timeseries = timeseries
+        self.data = timeseries.numpy()
+        self.seg_len = seg_len
+        self.seg_stride = seg_stride
+        self.avg_method = avg_method
+        self.w = numpy.hanning(seg_len).astype(timeseries.dtype)
+        self.delta_f = 1. / timeseries.delta_t / seg_len
+        self.flen = seg_len / 2 + 1
+        self.spectra = SegmentSpectra(seg_len, self.w, timeseries.delta_t,
+                                      timeseries.dtype, batch_size=batch_size)
+
+        # The segments [first, last) are held in the ring buffer
+        self.capacity = 0
+        self.buffer = None
+        self.first = self.last = 0
+        self.total = numpy.zeros(self.flen, dtype=numpy.float64)
+
+    def _resize(self, capacity):
+        """Grow the ring buffer, keeping the segments it holds"""
+        held = numpy.arange(self.first, self.last)
+        buf = numpy.zeros((capacity, self.flen), dtype=self.timeseries.dtype)
+        if len(held):
+            buf[held % capacity] = self.buffer[held % self.capacity]
+        self.buffer = buf
+        self.capacity = capacity
+
+    def _drop(self, first, last):
+        """Remove the held segments outside of [first, last)"""
+        if first >= self.last or last <= self.first:
+            self.first = self.last = first
+            self.total[:] = 0
+            return
+
+        for k0, k1 in ((self.first, first), (last, self.last)):
+            if k1 > k0:
+                self.total -= self.buffer[numpy.arange(k0, k1) %
+                                          self.capacity].sum(axis=0)
+        self.first = max(self.first, first)
+        self.last = min(self.last, last)
+
+    def _add(self, k0, k1):
+        """Calculate and hold the spectra of segments [k0, k1)"""
+        batch = self.spectra.batch_size
+        for b in xrange(k0, k1, batch):
+            ks = numpy.arange(b, min(b + batch, k1))
+            seg_psds = self.spectra.spectra(self.data, ks * self.seg_stride)
+            self.buffer[ks % self.capacity] = seg_psds
+            self.total += seg_psds.sum(axis=0)
+
+    def segment_range(self, start, end):
+        """Return the first segment and one past the last segment of the
+        grid that lie within samples [start, end) of the time series.
+        """
+        first = -(-start // self.seg_stride)
+        last = (end - self.seg_len) // self.seg_stride + 1
+        return first, min(last, (len(self.data) - self.seg_len) //
+                                self.seg_stride + 1)
+
+    def psd(self, start, end):
+        """Return the PSD estimated from the segments within samples
+        [start, end) of the time series.
+
+        Returns
+        -------
+        psd : FrequencySeries
+            Frequency series containing the estimated PSD.
+
+        Raises
+        ------
+        ValueError
+            If no segment fits within the given samples.
+        """
+        first, last = self.segment_range(start, end)
+        num_segments = int(last - first)
+        if num_segments <= 0:
+            raise ValueError('No PSD segments fit within the given samples')
+
+        self._drop(first, last)
+        if num_segments > self.capacity:
+            self._resize(num_segments)
+        if self.first == self.last:
+            self.first = self.last = first
+        self._add(first, self.first)
+        self._add(self.last, last)
+        self.first, self.last = first, last
+
+        rows = numpy.arange(first, last) % self.capacity
+        if self.avg_method == 'mean':
+            psd = self.total / num_segments
+        elif self.avg_method == 'median':
+            psd = numpy.median(self.buffer[rows], axis=0) / \
+                median_bias(num_segments)
+        elif self.avg_method == 'median-mean':
+            odd_psds = self.buffer[rows[::2]]
+            even_psds = self.buffer[rows[1::2]]
+            odd_median = numpy.median(odd_psds, axis=0) / \
+                median_bias(len(odd_psds))
+            even_median = numpy.median(even_psds, axis=0) / \
+                median_bias(len(even_psds))
+            psd = (odd_median + even_median) / 2
+
+        psd = psd * (2 * self.delta_f * self.seg_len / (self.w * self.w).sum())
+        return FrequencySeries(psd, delta_f=self.delta_f,
+                               dtype=self.timeseries.dtype)
+
 def inverse_spectrum_truncation(psd, max_filter_len, low_frequency_cutoff=None, trunc_method=None):
     """Modify a PSD such that the impulse response associated with its inverse
     square root is no longer than `max_filter_len` time samples. In practice
@@ -20,7 +20,8 @@ import copy
 import logging, numpy, lal
 import pycbc.noise
 from pycbc import psd
-from pycbc.types import float32
+from pycbc.types import float32, zeros, FrequencySeries, TimeSeries
+from pycbc.types import complex_same_precision_as
 from pycbc.types import MultiDetOptionAppendAction, MultiDetOptionAction
 from pycbc.types import MultiDetOptionActionSpecial
 from pycbc.types import required_opts, required_opts_multi_ifo
@@ -29,6 +30,7 @@ from pycbc.types import copy_opts_for_single_ifo
 from pycbc.frame import read_frame, query_and_read_frame
 from pycbc.inject import InjectionSet, SGBurstInjectionSet
 from pycbc.filter import resample_to_delta_t, highpass, make_frequency_series
+from pycbc.fft import fft
 from pycbc.filter.zpk import filter_zpk
 
 def from_cli(opt, dyn_range_fac=1, precision='single'):
@@ -95,21 +97,18 @@ def from_cli(opt, dyn_range_fac=1, precision='single'):
         logging.info("Highpass Filtering")
         strain = highpass(strain, frequency=opt.strain_high_pass)
 
-        if precision == 'single':
-            logging.info("Converting to float32")
-            strain = (strain * dyn_range_fac).astype(float32)
-
+        gate_params = None
         if opt.gating_file is not None:
-            logging.info("Gating glitches")
             gate_params = numpy.loadtxt(opt.gating_file)
             if len(gate_params.shape) == 1:
                 gate_params = [gate_params]
-            strain = gate_data(
-                strain, gate_params,
-                data_start_time=(opt.gps_start_time - opt.pad_data))
 
-        logging.info("Resampling data")
-        strain = resample_to_delta_t(strain, 1.0/opt.sample_rate, method='ldas')
+        logging.info("Converting to float32, gating glitches and resampling")
+        pipeline = ConditioningPipeline(1.0/opt.sample_rate,
+                          dyn_range_fac=dyn_range_fac, precision=precision,
+                          gate_params=gate_params,
+                          data_start_time=(opt.gps_start_time - opt.pad_data))
+        strain = pipeline.condition(strain)
 
         logging.info("Highpass Filtering")
         strain = highpass(strain, frequency=opt.strain_high_pass)
@@ -429,7 +428,10 @@ def verify_strain_options_multi_ifo(opts, parser, ifos):
         required_opts_multi_ifo(opts, parser, ifo, required_opts_list)
 
 
-def gate_data(data, gate_params, data_start_time):
+def _gate_windows(length, delta_t, gate_params, data_start_time):
+    """ Yield the offset in samples and the window of each gate that overlaps
+    data of the given length.
+    """
     def inverted_tukey(M, n_pad):
         midlen = M - 2*n_pad
         if midlen < 1:
@@ -437,23 +439,142 @@ def gate_data(data, gate_params, data_start_time):
         padarr = 0.5*(1.+numpy.cos(numpy.pi*numpy.arange(n_pad)/n_pad))
         return numpy.concatenate((padarr,numpy.zeros(midlen),padarr[::-1]))
 
-    sample_rate = 1./data.delta_t
-    temp = data.data
+    sample_rate = 1./delta_t
+    duration = length * delta_t
     for glitch_time, glitch_width, pad_width in gate_params:
         t_start = glitch_time - glitch_width - pad_width - data_start_time
         t_end = glitch_time + glitch_width + pad_width - data_start_time
-        if t_start > data.duration or t_end < 0.:
+        if t_start > duration or t_end < 0.:
             continue # Skip gate segments that don't overlap
         win_samples = int(2*sample_rate*(glitch_width+pad_width))
         pad_samples = int(sample_rate*pad_width)
         window = inverted_tukey(win_samples, pad_samples)
         offset = int(t_start * sample_rate)
+        yield offset, window
+
+def gate_data(data, gate_params, data_start_time):
+    temp = data.data
+    for offset, window in _gate_windows(len(data), data.delta_t, gate_params,
+                                        data_start_time):
         idx1 = max(0, -offset)
         idx2 = min(len(window), len(data)-offset)
         temp[idx1+offset:idx2+offset] *= window[idx1:idx2]
 
     return data
 
+class ConditioningPipeline(object):
+    """ Scale, gate and resample strain data in a single pass.
+
+    This gives the same result as multiplying the data by the dynamic range
+    factor and converting it to single precision, gating it with `gate_data`
+    and resampling it with `resample_to_delta_t(method='ldas')`. The data is
+    processed in overlapping blocks instead, so that the scaled and gated
+    data is never held at the input sample rate, and the low pass filter of
+    each resampling stage is only evaluated at the samples that are kept.
+    """
+    def __init__(self, delta_t, dyn_range_fac=1, precision='single',
+                 gate_params=None, data_start_time=0, block_size=2**20):
+        """
+        Parameters
+        ----------
+        delta_t : float
+            The sample interval to resample the data to.
+        dyn_range_fac : {1, float}
+            The factor the data is multiplied by when converting it to
+            single precision.
+        precision : {'single', str}
+            If 'single', the data is scaled and converted to float32.
+            Otherwise the data keeps its precision and is not scaled.
+        gate_params : {None, list}
+            The time, width and padding of each gate to apply to the data,
+            as read from a gating file.
+        data_start_time : {0, float}
+            The time of the start of the data that the gates refer to.
+        block_size : {2**20, int}
+            The number of input samples processed at a time.
+        """
+        self.delta_t = delta_t
+        self.dyn_range_fac = dyn_range_fac
+        self.precision = precision
+        self.gate_params = gate_params
+        self.data_start_time = data_start_time
+        self.block_size = block_size
+
+    def _prepare(self, block, start, gates):
+        """ Scale and gate a block of the data starting at sample `start` """
+        if self.precision == 'single':
+            block = (block * self.dyn_range_fac).astype(float32)
+        else:
+            block = numpy.array(block)
+
+        end = start + len(block)
+        for offset, window in gates:
+            lo = max(start, offset)
+            hi = min(end, offset + len(window))
+            if hi > lo:
+                block[lo - start:hi - start] *= window[lo - offset:hi - offset]
+        return block
+
+    def _decimate(self, data, factor, dtype, gates=None):
+        """ Resample the data by one ldas stage, preparing each block first
+        if gates are given.
+        """
+        from pycbc.filter.resample import LDAS_FIR_LP, _polyphase_decimate
+        coefficients = LDAS_FIR_LP[factor]
+        half = len(coefficients) / 2
+
+        # The outputs within half the filter length of either end of the
+        # data are corrupted, and so are zeroed
+        out = numpy.zeros((len(data) + factor - 1) / factor, dtype=dtype)
+        first = (half + factor - 1) / factor
+        end = (len(data) - half + factor - 1) / factor
+
+        step = max(1, self.block_size / factor)
+        for j0 in xrange(first, end, step):
+            j1 = min(j0 + step, end)
+            start = j0 * factor - half
+            block = data[start:(j1 - 1) * factor + half + 1]
+            if gates is not None:
+                block = self._prepare(block, start, gates)
+            out[j0:j1] = _polyphase_decimate(block, coefficients, factor,
+                                             j1 - j0)
+        return out
+
+    def condition(self, strain):
+        """ Return the scaled, gated and resampled strain
+
+        Parameters
+        ----------
+        strain : TimeSeries
+            The strain data at its original sample rate.
+
+        Returns
+        -------
+        strain : TimeSeries
+            The conditioned strain at the sample interval of the pipeline.
+        """
+        from pycbc.filter.resample import LDAS_STAGES
+        factor = int(self.delta_t / strain.delta_t)
+        if factor not in LDAS_STAGES:
+            raise ValueError('Unsupported resample factor, %s, given' % factor)
+
+        gates = []
+        if self.gate_params is not None:
+            gates = list(_gate_windows(len(strain), strain.delta_t,
+                                       self.gate_params, self.data_start_time))
+
+        dtype = float32 if self.precision == 'single' else strain.dtype
+        data = strain.numpy()
+        if factor == 1:
+            data = self._prepare(data, 0, gates)
+
+        for i, stage in enumerate(LDAS_STAGES[factor]):
+            data = self._decimate(data, stage, dtype,
+                                  gates=gates if i == 0 else None)
+
+        return TimeSeries(data, delta_t=self.delta_t, dtype=dtype,
+                          epoch=strain._epoch)
+
 class StrainSegments(object):
     """ Class for managing manipulation of strain data for the purpose of
         matched filtering. This includes methods for segmenting and
@@ -466,6 +587,7 @@ class StrainSegments(object):
             for analysis.
         """
         self._fourier_segments = None
+        self.fourier_segment_mem = None
         self.strain = strain
 
         self.delta_t = strain.delta_t
@@ -593,7 +715,7 @@ class StrainSegments(object):
         self.segment_slices = segment_slices_red
         self.analyze_slices = analyze_slices_red
 
-    def fourier_segments(self):
+    def fourier_segments(self, contiguous=False):
         """ Return a list of the FFT'd segments.
 
         Return the list of FrequencySeries. Additional properties are
@@ -601,11 +723,32 @@ class StrainSegments(object):
         is a slice corresponding to the portion of the time domain equivelant
         of the segment to analyze for triggers. The value 'cumulative_index'
         indexes from the beginning of the original strain series.
+
+        If contiguous is True, the segments are views into a single Array,
+        stored as the attribute 'fourier_segment_mem', in which consecutive
+        segments are separated by time_len samples. This is the layout needed
+        to filter a template against all segments at once.
         """
+        if contiguous and self.fourier_segment_mem is None:
+            self._fourier_segments = None
+
         if not self._fourier_segments:
             self._fourier_segments = []
-            for seg_slice, ana in zip(self.segment_slices, self.analyze_slices):
-                freq_seg = make_frequency_series(self.strain[seg_slice])
+            if contiguous:
+                self.fourier_segment_mem = zeros(
+                    self.time_len * len(self.segment_slices),
+                    dtype=complex_same_precision_as(self.strain))
+
+            for i, (seg_slice, ana) in enumerate(zip(self.segment_slices,
+                                                     self.analyze_slices)):
+                if contiguous:
+                    start = i * self.time_len
+                    freq_seg = FrequencySeries(
+                        self.fourier_segment_mem[start:start + self.freq_len],
+                        delta_f=self.delta_f, copy=False)
+                    fft(self.strain[seg_slice], freq_seg)
+                else:
+                    freq_seg = make_frequency_series(self.strain[seg_slice])
                 freq_seg.analyze = ana
                 freq_seg.cumulative_index = seg_slice.start + ana.start
                 freq_seg.seg_slice = seg_slice
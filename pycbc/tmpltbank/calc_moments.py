@@ -15,6 +15,8 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from __future__ import division
+import os.path
+import logging
 import numpy
 from pycbc.tmpltbank.lambda_mapping import generate_mapping
         
@@ -77,12 +79,27 @@ def determine_eigen_directions(metricParams, preserveMoments=False,
         contains the result of all the integrals used in computing the metrics
         above. It can be used for the ethinca components calculation, or other
         similar calculations.
+
+    If metricParams has a cache directory, all of these are read from it when
+    they were calculated before for the same PSD and options, and are
+    written to it otherwise.
     """
    
     evals = {}
     evecs = {}
     metric = {}
     unmax_metric = {}
+
+    # Use the cached metric for these inputs if there is one
+    cache_file = None
+    if not (metricParams.moments and preserveMoments):
+        metricParams.metric_key = metricParams.get_metric_key(
+                      vary_fmax=vary_fmax, vary_density=vary_density)
+        cache_file = metricParams.metric_cache_file(metricParams.metric_key)
+        if cache_file is not None and os.path.exists(cache_file):
+            logging.info("Reading metric from %s" %(cache_file))
+            metricParams.load_metric(cache_file)
+            return metricParams
   
     # First step is to get the moments needed to calculate the metric
     if not (metricParams.moments and preserveMoments):
@@ -144,6 +161,10 @@ def determine_eigen_directions(metricParams, preserveMoments=False,
     metricParams.evecs = evecs
     metricParams.metric = metric
     metricParams.time_unprojected_metric = unmax_metric
+
+    if cache_file is not None:
+        logging.info("Writing metric to %s" %(cache_file))
+        metricParams.save_metric(cache_file)
     
     return metricParams
 
@@ -225,53 +246,50 @@ def get_moments(metricParams, vary_fmax=False, vary_density=None):
     psd_f = numpy.arange(len(psd_amp), dtype=float) * metricParams.deltaF 
     new_f, new_amp = interpolate_psd(psd_f, psd_amp, metricParams.deltaF)
 
-    # Need I7 first as this is the normalization factor
-    funct = lambda x: 1
-    I7 = calculate_moment(new_f, new_amp, metricParams.fLow, \
-                          metricParams.fUpper, metricParams.f0, funct,\
-                          vary_fmax=vary_fmax, vary_density=vary_density)
-
-    # Do all the J moments
+    fmin = metricParams.fLow
+    fmax = metricParams.fUpper
+    psd_x = new_f / metricParams.f0
+    deltax = psd_x[1] - psd_x[0]
+    mask = numpy.logical_and(new_f > fmin, new_f < fmax)
+    psdf_red = new_f[mask]
+    psdx_red = psd_x[mask]
+
+    # Every moment is the sum over frequency of the I7 integrand, times
+    # some power of log(x**(1./3.)), times x**((-i+7)/3.). weights holds the
+    # first two factors, for each power of the log.
+    base = psdx_red ** (-7./3.) * deltax / new_amp[mask]
+    logx = numpy.log(psdx_red ** (1./3.))
+    weights = base[:,None] * logx[:,None] ** numpy.arange(5)
+    orders = numpy.arange(-1, 18)
+    exponents = (-orders + 7) / 3.
+
+    # The moments at each cutoff are the cumulative sums of those between
+    # the previous cutoff and it. I7 is the J7 moment before normalization.
+    cutoffs = [fmax]
+    if vary_fmax:
+        cutoffs = list(numpy.arange(fmin + vary_density, fmax,
+                                    vary_density)) + cutoffs
+    bounds = numpy.searchsorted(psdf_red, cutoffs, side='left')
+    sums = numpy.zeros((len(cutoffs), len(orders), 5))
+    running = numpy.zeros((len(orders), 5))
+    start = 0
+    for c, end in enumerate(bounds):
+        for k in xrange(start, end, 65536):
+            kend = min(k + 65536, end)
+            powers = psdx_red[None,k:kend] ** exponents[:,None]
+            running = running + numpy.dot(powers, weights[k:kend])
+        sums[c] = running
+        start = max(start, end)
+
+    I7_idx = list(orders).index(7)
+    I7 = dict((cut, sums[c, I7_idx, 0]) for c, cut in enumerate(cutoffs))
     moments = {}
     moments['I7'] = I7
-    for i in xrange(-1,18):
-        funct = lambda x: x**((-i+7)/3.)
-        moments['J%d' %(i)] = calculate_moment(new_f, new_amp, \
-                                metricParams.fLow, metricParams.fUpper, \
-                                metricParams.f0, funct, norm=I7, \
-                                vary_fmax=vary_fmax, vary_density=vary_density)
-
-    # Do the logx multiplied by some power terms
-    for i in xrange(-1,18):
-        funct = lambda x: (numpy.log(x**(1./3.))) * x**((-i+7)/3.)
-        moments['log%d' %(i)] = calculate_moment(new_f, new_amp, \
-                                metricParams.fLow, metricParams.fUpper, \
-                                metricParams.f0, funct, norm=I7, \
-                                vary_fmax=vary_fmax, vary_density=vary_density)
-
-    # Do the loglog term
-    for i in xrange(-1,18):
-        funct = lambda x: (numpy.log(x**(1./3.)))**2 * x**((-i+7)/3.)
-        moments['loglog%d' %(i)] = calculate_moment(new_f, new_amp, \
-                                metricParams.fLow, metricParams.fUpper, \
-                                metricParams.f0, funct, norm=I7, \
-                                vary_fmax=vary_fmax, vary_density=vary_density)
-
-    # Do the logloglog term
-    for i in xrange(-1,18):
-        funct = lambda x: (numpy.log(x**(1./3.)))**3 * x**((-i+7)/3.)
-        moments['logloglog%d' %(i)] = calculate_moment(new_f, new_amp, \
-                                metricParams.fLow, metricParams.fUpper, \
-                                metricParams.f0, funct, norm=I7, \
-                                vary_fmax=vary_fmax, vary_density=vary_density)
-
-    # Do the logloglog term
-    for i in xrange(-1,18):
-        funct = lambda x: (numpy.log(x**(1./3.)))**4 * x**((-i+7)/3.)
-        moments['loglogloglog%d' %(i)] = calculate_moment(new_f, new_amp, \
-                                metricParams.fLow, metricParams.fUpper, \
-                                metricParams.f0, funct, norm=I7, \
-                                vary_fmax=vary_fmax, vary_density=vary_density)
+    names = ['J', 'log', 'loglog', 'logloglog', 'loglogloglog']
+    for p, name in enumerate(names):
+        for o, i in enumerate(orders):
+            moments['%s%d' %(name, i)] = dict((cut, sums[c, o, p] / I7[cut])
+                                          for c, cut in enumerate(cutoffs))
 
     metricParams.moments = moments
 
@@ -301,23 +319,10 @@ def interpolate_psd(psd_f, psd_amp, deltaF):
     # check for this. As this function runs quickly anyway (compared to the
     # moment calculation) I decided to always interpolate.
 
-    new_psd_f = []
-    new_psd_amp = []
-    fcurr = psd_f[0]
-
-    for i in xrange(len(psd_f) - 1):
-        f_low = psd_f[i]
-        f_high = psd_f[i+1]
-        amp_low = psd_amp[i]
-        amp_high = psd_amp[i+1]
-        while(1):
-            if fcurr > f_high:
-                break
-            new_psd_f.append(fcurr)
-            gradient = (amp_high - amp_low) / (f_high - f_low)
-            fDiff = fcurr - f_low
-            new_psd_amp.append(amp_low + fDiff * gradient)
-            fcurr = fcurr + deltaF
+    psd_f = numpy.asarray(psd_f, dtype=float)
+    num = int(numpy.floor((psd_f[-1] - psd_f[0]) / deltaF)) + 1
+    new_psd_f = psd_f[0] + deltaF * numpy.arange(num)
+    new_psd_amp = numpy.interp(new_psd_f, psd_f, psd_amp)
     return numpy.asarray(new_psd_f), numpy.asarray(new_psd_amp)
 
 
@@ -388,8 +393,11 @@ def calculate_moment(psd_f, psd_amp, fmin, fmax, f0, funct,
     if norm:
         moment[fmax] = moment[fmax] / norm[fmax]
     if vary_fmax:
-        for t_fmax in numpy.arange(fmin + vary_density, fmax, vary_density):
-            moment[t_fmax] = comps_red[psdf_red < t_fmax].sum()
+        t_fmaxs = numpy.arange(fmin + vary_density, fmax, vary_density)
+        cum_comps = numpy.concatenate([[0.], numpy.cumsum(comps_red)])
+        bounds = numpy.searchsorted(psdf_red, t_fmaxs, side='left')
+        for t_fmax, bound in zip(t_fmaxs, bounds):
+            moment[t_fmax] = cum_comps[bound]
             if norm:
                 moment[t_fmax] = moment[t_fmax] / norm[t_fmax]
     return moment
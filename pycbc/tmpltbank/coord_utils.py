@@ -73,6 +73,57 @@ def estimate_mass_range(numPoints, massRangeParams, metricParams, fUpper,\
 
     return numpy.array(lambdas)
 
+def estimate_covariance_evecs(numPoints, massRangeParams, metricParams,
+                              fUpper):
+    """
+    This function will estimate the covariance matrix of a large set of
+    points with random masses and spins, in the Cartesian coordinate system
+    given by the metric at fUpper (using estimate_mass_range with
+    covary=False), and return its eigenvalues and eigenvectors. These
+    eigenvectors give the rotation into the principal coordinate directions
+    (xi_i), and are what should be set as metricParams.evecsCV.
+
+    If metricParams has a cache directory the eigenvectors are read from it
+    when they were estimated before for the same metric, mass ranges, fUpper
+    and number of points, and are written to it otherwise.
+
+    Parameters
+    ----------
+    numPoints : int
+        Number of systems to simulate
+    massRangeParams : massRangeParameters instance
+        Instance holding all the details of mass ranges and spin ranges.
+    metricParams : metricParameters instance
+        Structure holding all the options for construction of the metric
+        and the eigenvalues and eigenvectors needed to manipulate the space.
+    fUpper : float
+        The value of fUpper to use when getting the mu coordinates from the
+        lambda coordinates. This must be a key in metricParams.evals and
+        metricParams.evecs.
+
+    Returns
+    -------
+    evalsCV : numpy.array
+        The eigenvalues of the covariance matrix.
+    evecsCV : numpy.array
+        The eigenvectors of the covariance matrix.
+    """
+    cache_file = metricParams.covariance_cache_file(massRangeParams, fUpper,
+                                                    numPoints)
+    if cache_file is not None and os.path.exists(cache_file):
+        logging.info("Reading covariance eigenvectors from %s" %(cache_file))
+        return metricParams.load_covariance(cache_file)
+
+    vals = estimate_mass_range(numPoints, massRangeParams, metricParams,
+                               fUpper, covary=False)
+    cov = numpy.cov(vals)
+    evalsCV, evecsCV = numpy.linalg.eig(cov)
+
+    if cache_file is not None:
+        logging.info("Writing covariance eigenvectors to %s" %(cache_file))
+        metricParams.save_covariance(cache_file, evalsCV, evecsCV)
+    return evalsCV, evecsCV
+
 def get_random_mass_point_particles(numPoints, massRangeParams):
     """
     This function will generate a large set of points within the chosen mass
@@ -19,6 +19,7 @@ import logging
 import textwrap
 import numpy
 import os
+import hashlib
 from pycbc.tmpltbank.lambda_mapping import get_ethinca_orders, pycbcValidOrdersHelpDescriptions
 from pycbc import pnutils
 from pycbc.tmpltbank.em_progenitors import load_ns_sequence
@@ -170,6 +171,15 @@ def insert_metric_calculation_options(parser):
     metricOpts.add_argument("--write-metric", action="store_true",
                 default=False, help="If given write the metric components "
                      "to disk as they are calculated.")
+    metricOpts.add_argument("--metric-cache-dir", action="store",
+                default=None, help="If given, the moments, metric, "
+                     "eigenvectors and covariance eigenvectors are stored "
+                     "in this directory, keyed by the PSD and the options "
+                     "that they depend on, and are read from it instead of "
+                     "being recalculated when they are found there. Note "
+                     "that reading the covariance eigenvectors means that "
+                     "the random mass points used to calculate them are "
+                     "not drawn. OPTIONAL.")
     return metricOpts
 
 def verify_metric_calculation_options(opts, parser):
@@ -201,7 +211,7 @@ class metricParameters(object):
     _evecs = None
     _evecsCV = None
     def __init__(self, pnOrder, fLow, fUpper, deltaF, f0=70,
-                 write_metric=False):
+                 write_metric=False, cache_dir=None):
         """
         Initialize an instance of the metricParameters by providing all
         options directly. See the help message associated with any code
@@ -215,6 +225,8 @@ class metricParameters(object):
         self.f0=f0
         self._moments=None
         self.write_metric=write_metric
+        self.cache_dir=cache_dir
+        self.metric_key=None
 
     @classmethod
     def from_argparse(cls, opts):
@@ -227,7 +239,126 @@ class metricParameters(object):
         have already been called before initializing the class.
         """
         return cls(opts.pn_order, opts.f_low, opts.f_upper, opts.delta_f,\
-                   f0=opts.f0, write_metric=opts.write_metric)
+                   f0=opts.f0, write_metric=opts.write_metric,
+                   cache_dir=getattr(opts, 'metric_cache_dir', None))
+
+    def get_metric_key(self, vary_fmax=False, vary_density=None):
+        """
+        Return the key of the metric that would be calculated from the PSD
+        and options held in this instance, by
+        pycbc.tmpltbank.determine_eigen_directions with the given vary_fmax
+        and vary_density. This is a hash of all of these inputs.
+        """
+        key = hashlib.sha1()
+        key.update(numpy.ascontiguousarray(self.psd.numpy()).tostring())
+        key.update(repr((float(self.psd.delta_f), self.pnOrder,
+                         float(self.fLow), float(self.fUpper),
+                         float(self.deltaF), float(self.f0), bool(vary_fmax),
+                         vary_density)))
+        return key.hexdigest()
+
+    def metric_cache_file(self, key):
+        """
+        Return the file in the cache directory holding the metric with the
+        given key, or None if there is no cache directory.
+        """
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, 'METRIC-%s.hdf' %(key))
+
+    def save_metric(self, filename):
+        """
+        Write the moments, metric and eigenvectors held in this instance to
+        an hdf file, from which they can be read with load_metric.
+        """
+        import h5py
+        freqs = sorted(self.evals.keys())
+        # Write to a temporary file first, so that other jobs sharing the
+        # cache never read a partly written file
+        tmp_name = filename + '.tmp%d' %(os.getpid())
+        f = h5py.File(tmp_name, 'w')
+        f['frequencies'] = numpy.array(freqs, dtype=float)
+        f['evals'] = numpy.array([self.evals[fr] for fr in freqs])
+        f['evecs'] = numpy.array([self.evecs[fr] for fr in freqs])
+        f['metric'] = numpy.array([self.metric[fr] for fr in freqs])
+        f['time_unprojected_metric'] = numpy.array(
+                        [self.time_unprojected_metric[fr] for fr in freqs])
+        cutoffs = sorted(self.moments['I7'].keys())
+        f['moments/cutoffs'] = numpy.array(cutoffs, dtype=float)
+        for name in self.moments:
+            f['moments/values/%s' %(name)] = \
+                        numpy.array([self.moments[name][c] for c in cutoffs])
+        f.close()
+        os.rename(tmp_name, filename)
+
+    def load_metric(self, filename):
+        """
+        Read the moments, metric and eigenvectors from an hdf file written by
+        save_metric into this instance.
+        """
+        import h5py
+        f = h5py.File(filename, 'r')
+        freqs = f['frequencies'][:]
+        evals = f['evals'][:]
+        evecs = f['evecs'][:]
+        metric = f['metric'][:]
+        unmax_metric = f['time_unprojected_metric'][:]
+        cutoffs = f['moments/cutoffs'][:]
+        moments = {}
+        for name in f['moments/values']:
+            values = f['moments/values/%s' %(name)][:]
+            moments[str(name)] = dict(zip(cutoffs, values))
+        f.close()
+
+        self.moments = moments
+        self.evals = dict(zip(freqs, evals))
+        self.evecs = dict((fr, numpy.matrix(ev)) for fr, ev in zip(freqs, evecs))
+        self.metric = dict((fr, numpy.matrix(m)) for fr, m in zip(freqs, metric))
+        self.time_unprojected_metric = dict((fr, numpy.matrix(m))
+                                        for fr, m in zip(freqs, unmax_metric))
+
+    def covariance_cache_file(self, massRangeParams, fUpper, numPoints):
+        """
+        Return the file in the cache directory holding the covariance
+        eigenvectors estimated from numPoints random points within the given
+        mass ranges, with the current metric at fUpper. None is returned if
+        there is no cache directory or the metric was not calculated by
+        pycbc.tmpltbank.determine_eigen_directions.
+        """
+        if self.cache_dir is None or self.metric_key is None:
+            return None
+        # Only the scalar mass range options identify the mass ranges
+        mass_opts = sorted((k, v) for k, v in massRangeParams.__dict__.items()
+                           if isinstance(v, (int, long, float, str, bool,
+                                             type(None))))
+        key = hashlib.sha1(repr((self.metric_key, float(fUpper),
+                                 int(numPoints), mass_opts))).hexdigest()
+        return os.path.join(self.cache_dir, 'COVARIANCE-%s.hdf' %(key))
+
+    def save_covariance(self, filename, evalsCV, evecsCV):
+        """
+        Write the eigenvalues and eigenvectors of a covariance matrix to an
+        hdf file, from which they can be read with load_covariance.
+        """
+        import h5py
+        tmp_name = filename + '.tmp%d' %(os.getpid())
+        f = h5py.File(tmp_name, 'w')
+        f['evals'] = evalsCV
+        f['evecs'] = evecsCV
+        f.close()
+        os.rename(tmp_name, filename)
+
+    def load_covariance(self, filename):
+        """
+        Return the eigenvalues and eigenvectors of a covariance matrix from an
+        hdf file written by save_covariance.
+        """
+        import h5py
+        f = h5py.File(filename, 'r')
+        evalsCV = f['evals'][:]
+        evecsCV = f['evecs'][:]
+        f.close()
+        return evalsCV, evecsCV
 
     @property
     def psd(self):
@@ -14,9 +14,10 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import copy
 import numpy
 import logging
+import multiprocessing
+from scipy.spatial import cKDTree
 from pycbc import pnutils
 from pycbc.tmpltbank import coord_utils
 
@@ -26,6 +27,9 @@ class PartitionedTmpltbank(object):
     based on position in the Cartesian parameter space where the axes are the
     principal components. It can also be used to hold intermediary
     products used while constructing (e.g.) a stochastic template bank.
+
+    The points are stored in contiguous arrays, in the order they were added,
+    and the bins hold the indices of the points within them.
     """
     def __init__(self, mass_range_params, metric_params, ref_freq,
                  bin_spacing, bin_range_check=1):
@@ -89,29 +93,34 @@ class PartitionedTmpltbank(object):
         chi2_min = chi2_min - 0.1*chi2_diff
         chi2_max = chi2_max + 0.1*chi2_diff
 
-        massbank = {}
-        bank = {}
-        # Also add a little bit here
-        for i in xrange(-2, int((chi1_max - chi1_min) // bin_spacing + 2)):
-            bank[i] = {}
-            massbank[i] = {}
-            for j in xrange(-2, int((chi2_max - chi2_min) // bin_spacing + 2)):
-                bank[i][j] = []
-                massbank[i][j] = {}
-                massbank[i][j]['mass1s'] = numpy.array([])
-
-        self.massbank = massbank
-        self.bank = bank
-        # Record minimum and maximum bins
-        self.min_chi1_bin = -2
-        self.min_chi2_bin = -2
-        self.max_chi1_bin = int((chi1_max - chi1_min) // bin_spacing + 1)
-        self.max_chi2_bin = int((chi2_max - chi2_min) // bin_spacing + 1)
         self.chi1_min = chi1_min
         self.chi1_max = chi1_max
         self.chi2_min = chi2_min
         self.chi2_max = chi2_max
 
+        # The points of the bank. The arrays are allocated when the first
+        # point is added and doubled in size when full.
+        # chi_coords: Axis 0 = point index, Axis 1 = chi coordinate index
+        # masses: Axis 0 = point index, Axis 1 = mass1, mass2, spin1z, spin2z
+        # point_bins: Axis 0 = point index, Axis 1 = chi1 bin, chi2 bin
+        # mus: Axis 0 = point index, Axis 1 = frequency cutoff index,
+        #      Axis 2 = mu coordinate index
+        self.num_points = 0
+        self.chi_coords = None
+        self.masses = None
+        self.point_bins = None
+        self.freqcuts = None
+        self.mus = None
+
+        # Hash of (chi1 bin, chi2 bin) to the list of indices of the points
+        # in that bin. Bins with no points are not stored.
+        self.bins = {}
+
+        # k-d tree over the first self.tree_size points, which is rebuilt by
+        # test_and_add_points when enough points have been added since
+        self.tree = None
+        self.tree_size = 0
+
         # How many adjacent bins should we check?
         self.bin_range_check = 1
         self.bin_loop_order = coord_utils.outspiral_loop(self.bin_range_check)
@@ -134,10 +143,8 @@ class PartitionedTmpltbank(object):
         spin1z : float
         spin2z : float
         """
-        mass1 = self.massbank[chi1_bin][chi2_bin]['mass1s'][idx]
-        mass2 = self.massbank[chi1_bin][chi2_bin]['mass2s'][idx]
-        spin1z = self.massbank[chi1_bin][chi2_bin]['spin1s'][idx]
-        spin2z = self.massbank[chi1_bin][chi2_bin]['spin2s'][idx]
+        mass1, mass2, spin1z, spin2z = \
+                               self.masses[self.bins[chi1_bin, chi2_bin][idx]]
         return mass1, mass2, spin1z, spin2z
 
     def get_freq_map_and_normalizations(self, frequency_list,
@@ -187,41 +194,36 @@ class PartitionedTmpltbank(object):
         # Identify bin
         chi1_bin = int((chi_coords[0] - self.chi1_min) // self.bin_spacing) 
         chi2_bin = int((chi_coords[1] - self.chi2_min) // self.bin_spacing)
-        self.check_bin_existence(chi1_bin, chi2_bin)
         return chi1_bin, chi2_bin
 
-
-    def check_bin_existence(self, chi1_bin, chi2_bin):
+    def get_neighbour_indices(self, chi1_bin, chi2_bin, first=0):
         """
-        Given indices for bins in chi1 and chi2 space check that the bin
-        exists in the object. If not add it. Also check for the existence of
-        all bins within +/- self.bin_range_check and add if not present.
+        Return the indices of the points in the given bin and all bins within
+        +/- self.bin_range_check of it, looping outwards from the given bin.
 
         Parameters
         -----------
         chi1_bin : int
-            The index of the chi1_bin to check
+            Index of the chi_1 bin.
         chi2_bin : int
-            The index of the chi2_bin to check
-        """
-        bin_range_check = self.bin_range_check
-        # Check if this bin actually exists. If not add it
-        if ( (chi1_bin < self.min_chi1_bin+bin_range_check) or
-             (chi1_bin > self.max_chi1_bin-bin_range_check) or
-             (chi2_bin < self.min_chi2_bin+bin_range_check) or
-             (chi2_bin > self.max_chi2_bin-bin_range_check) ):
-            for temp_chi1 in xrange(chi1_bin-bin_range_check,
-                                                   chi1_bin+bin_range_check+1):
-                if not self.massbank.has_key(temp_chi1):
-                    self.massbank[temp_chi1] = {}
-                    self.bank[temp_chi1] = {}
-                for temp_chi2 in xrange(chi2_bin-bin_range_check, 
-                                                   chi2_bin+bin_range_check+1):
-                    if not self.massbank[temp_chi1].has_key(temp_chi2):
-                        self.massbank[temp_chi1][temp_chi2] = {}
-                        self.massbank[temp_chi1][temp_chi2]['mass1s'] =\
-                                                                numpy.array([])
-                        self.bank[temp_chi1][temp_chi2] = []
+            Index of the chi_2 bin.
+        first : int
+            Only return the indices of points added at or after this index.
+
+        Returns
+        --------
+        indices : numpy.array
+            The indices of the points.
+        """
+        indices = []
+        for chi1_bin_offset, chi2_bin_offset in self.bin_loop_order:
+            key = (chi1_bin + chi1_bin_offset, chi2_bin + chi2_bin_offset)
+            if key in self.bins:
+                indices += self.bins[key]
+        indices = numpy.array(indices, dtype=int)
+        if first:
+            indices = indices[indices >= first]
+        return indices
 
     def calc_point_distance(self, chi_coords):
         """
@@ -242,18 +244,13 @@ class PartitionedTmpltbank(object):
             the closest matching point lies.
         """
         chi1_bin, chi2_bin = self.find_point_bin(chi_coords)
-        min_dist = 1000000000
-        indexes = None
-        for chi1_bin_offset, chi2_bin_offset in self.bin_loop_order:
-            curr_chi1_bin = chi1_bin + chi1_bin_offset
-            curr_chi2_bin = chi2_bin + chi2_bin_offset
-            for idx, bank_chis in \
-                            enumerate(self.bank[curr_chi1_bin][curr_chi2_bin]):
-                dist = coord_utils.calc_point_dist(chi_coords, bank_chis)
-                if dist < min_dist:
-                    min_dist = dist
-                    indexes = (curr_chi1_bin, curr_chi2_bin, idx)
-        return min_dist, indexes            
+        indices = self.get_neighbour_indices(chi1_bin, chi2_bin)
+        if not len(indices):
+            return 1000000000, None
+
+        dists = self._calc_dists(chi_coords, indices)
+        closest = dists.argmin()
+        return dists[closest], self._get_bin_and_idx(indices[closest])
 
     def test_point_distance(self, chi_coords, distance_threshold):
         """
@@ -274,17 +271,130 @@ class PartitionedTmpltbank(object):
         Boolean
             True if point is within the distance threshold. False if not.
 
+        """
+        return self._test_point_in_bins(chi_coords, distance_threshold)
+
+    def test_and_add_points(self, chi_coords, distance_threshold, mass1, mass2,
+                            spin1z, spin2z):
+        """
+        Test a block of points in turn, adding each one to the bank if it is
+        not within the distance threshold of the bank. This gives the same
+        result as calling test_point_distance and add_point_by_chi_coords for
+        each point in order, so a point is also tested against the points of
+        the block accepted before it. The points are first tested against the
+        existing bank all at once, using a k-d tree, so only the points that
+        survive this are then tested one at a time. The k-d tree finds the
+        same points as the bin test only if the bins are at least as wide as
+        the square root of the distance threshold, so if they are not all
+        of the points are tested through the bins.
+
+        Parameters
+        -----------
+        chi_coords : numpy.array
+            The position of the points in the chi coordinates. Axis 0 is the
+            chi coordinate index and axis 1 is the point index.
+        distance_threshold : float
+            The **SQUARE ROOT* of the metric distance to test as threshold.
+        mass1 : numpy.array
+            The heavier mass of each point.
+        mass2 : numpy.array
+            The lighter mass of each point.
+        spin1z: numpy.array
+            The [aligned] spin on the heavier body of each point.
+        spin2z: numpy.array
+            The [aligned] spin on the lighter body of each point.
+
+        Returns 
+        --------
+        accepted : numpy.array
+            Boolean array which is True for the points added to the bank.
+        """
+        points = numpy.array(chi_coords).T
+        accepted = numpy.zeros(len(points), dtype=bool)
+
+        # Rebuilding the tree costs more than testing a few recently added
+        # points through the bins, so only do so when many have been added.
+        use_tree = self.bin_spacing >= distance_threshold**0.5
+        if use_tree and self.num_points > 1.1 * self.tree_size:
+            self.tree = cKDTree(self.chi_coords[:self.num_points])
+            self.tree_size = self.num_points
+
+        candidates = numpy.arange(len(points))
+        if self.tree_size and use_tree:
+            # Use a slightly larger bound, and the exact same distance as
+            # calc_point_dist below, so the result does not depend on rounding
+            bound = 1.0001 * distance_threshold**0.5
+            _, nearest = self.tree.query(points, distance_upper_bound=bound)
+            close = numpy.flatnonzero(nearest < self.tree_size)
+            diffs = points[close] - self.chi_coords[nearest[close]]
+            dists = (diffs * diffs).sum(axis=1)
+            reject = close[dists < distance_threshold]
+            candidates = numpy.setdiff1d(candidates, reject)
+
+        first = self.tree_size if use_tree else 0
+        for idx in candidates:
+            if self._test_point_in_bins(points[idx], distance_threshold,
+                                        first=first):
+                continue
+            self.add_point_by_chi_coords(points[idx], mass1[idx], mass2[idx],
+                                         spin1z[idx], spin2z[idx])
+            accepted[idx] = True
+        return accepted
+
+    def _test_point_in_bins(self, chi_coords, distance_threshold, first=0):
+        """
+        Test if the distance between the supplied point and the points of the
+        bank with index at least first is less than the distance threshold.
         """
         chi1_bin, chi2_bin = self.find_point_bin(chi_coords)
-        for chi1_bin_offset, chi2_bin_offset in self.bin_loop_order:
-            curr_chi1_bin = chi1_bin + chi1_bin_offset
-            curr_chi2_bin = chi2_bin + chi2_bin_offset
-            for bank_chis in self.bank[curr_chi1_bin][curr_chi2_bin]:
-                dist = coord_utils.calc_point_dist(chi_coords, bank_chis)
-                if dist < distance_threshold:
-                    return True
-        else:
+        indices = self.get_neighbour_indices(chi1_bin, chi2_bin, first=first)
+        if not len(indices):
             return False
+        dists = self._calc_dists(chi_coords, indices)
+        return bool((dists < distance_threshold).any())
+
+    def _calc_dists(self, chi_coords, indices):
+        """
+        Return the **SQUARED** metric distance between the point and the
+        points of the bank with the given indices.
+        """
+        chi_diffs = self.chi_coords[indices] - chi_coords
+        return (chi_diffs * chi_diffs).sum(axis=1)
+
+    def _get_bin_and_idx(self, index):
+        """
+        Return the chi1_bin, chi2_bin and position within that bin of the
+        point with the given index.
+        """
+        chi1_bin, chi2_bin = self.point_bins[index]
+        return chi1_bin, chi2_bin, self.bins[chi1_bin, chi2_bin].index(index)
+
+    def _calc_renormed_dists(self, point_fupper, mus, indices):
+        """
+        Return the distance between the point and the points of the bank with
+        the given indices, using the metric of the lower of the two upper
+        frequency cutoffs and accounting for the change in normalization.
+        """
+        # *NOT* the same of .min and .max
+        f_upper = numpy.minimum(point_fupper, self.freqcuts[indices])
+        f_other = numpy.maximum(point_fupper, self.freqcuts[indices])
+        # NOTE: freq_idxes is a vector!
+        freq_idxes = numpy.array([self.frequency_map[f] for f in f_upper])
+        # vecs1 gives a 2x2 vector: idx0 = stored index, idx1 = mu index
+        vecs1 = mus[freq_idxes, :]
+        # vecs2 gives a 2x2 vector: idx0 = stored index, idx1 = mu index
+        vecs2 = self.mus[indices, freq_idxes, :]
+
+        # Now do the sums
+        dists = (vecs1 - vecs2)*(vecs1 - vecs2)
+        # This reduces to 1D: idx = stored index
+        dists = numpy.sum(dists, axis=1)
+        norm_upper = numpy.array([self.normalization_map[f] \
+                                  for f in f_upper])
+        norm_other = numpy.array([self.normalization_map[f] \
+                                  for f in f_other])
+        norm_fac = norm_upper / norm_other
+        return 1 - (1 - dists)*norm_fac
 
     def calc_point_distance_vary(self, chi_coords, point_fupper, mus):
         """
@@ -314,43 +424,14 @@ class PartitionedTmpltbank(object):
             the closest matching point lies.
         """
         chi1_bin, chi2_bin = self.find_point_bin(chi_coords)
-        min_dist = 1000000000
-        indexes = None
-        for chi1_bin_offset, chi2_bin_offset in self.bin_loop_order:
-            curr_chi1_bin = chi1_bin + chi1_bin_offset
-            curr_chi2_bin = chi2_bin + chi2_bin_offset
-            # No points = Next iteration
-            curr_bank = self.massbank[curr_chi1_bin][curr_chi2_bin]
-            if not curr_bank['mass1s'].size:
-                continue
+        indices = self.get_neighbour_indices(chi1_bin, chi2_bin)
+        if not len(indices):
+            return 1000000000, None
 
-            # *NOT* the same of .min and .max
-            f_upper = numpy.minimum(point_fupper, curr_bank['freqcuts'])
-            f_other = numpy.maximum(point_fupper, curr_bank['freqcuts'])
-            # NOTE: freq_idxes is a vector!
-            freq_idxes = numpy.array([self.frequency_map[f] for f in f_upper])
-            # vecs1 gives a 2x2 vector: idx0 = stored index, idx1 = mu index
-            vecs1 = mus[freq_idxes, :]
-            # vecs2 gives a 2x2 vector: idx0 = stored index, idx1 = mu index
-            range_idx = numpy.arange(len(freq_idxes))
-            vecs2 = curr_bank['mus'][range_idx,freq_idx,:]
-            
-            # Now do the sums
-            dists = (vecs1 - vecs2)*(vecs1 - vecs2)
-            # This reduces to 1D: idx = stored index
-            dists = numpy.sum(dists, axis=1)
-            norm_upper = numpy.array([self.normalization_map[f] \
-                                      for f in f_upper])
-            norm_other = numpy.array([self.normalization_map[f] \
-                                      for f in f_other])
-            norm_fac = norm_upper / norm_other
-            renormed_dists = 1 - (1 - dists)*norm_fac
-            curr_min_dist = renormed_dists.min()
-            if curr_min_dist < min_dist:
-                min_dist = curr_min_dist
-                indexes = curr_chi1_bin, curr_chi2_bin, renormed_dists.argmin()
-
-        return min_dist, indexes
+        renormed_dists = self._calc_renormed_dists(point_fupper, mus, indices)
+        closest = renormed_dists.argmin()
+        return (renormed_dists[closest],
+                self._get_bin_and_idx(indices[closest]))
 
     def test_point_distance_vary(self, chi_coords, point_fupper, mus, 
                                  distance_threshold):
@@ -383,44 +464,13 @@ class PartitionedTmpltbank(object):
             True if point is within the distance threshold. False if not.
         """
         chi1_bin, chi2_bin = self.find_point_bin(chi_coords)
-        for chi1_bin_offset, chi2_bin_offset in self.bin_loop_order:
-            curr_chi1_bin = chi1_bin + chi1_bin_offset
-            curr_chi2_bin = chi2_bin + chi2_bin_offset
-            # No points = Next iteration
-            curr_bank = self.massbank[curr_chi1_bin][curr_chi2_bin]
-            if not curr_bank['mass1s'].size:
-                continue
-
-            # *NOT* the same of .min and .max
-            f_upper = numpy.minimum(point_fupper, curr_bank['freqcuts'])
-            f_other = numpy.maximum(point_fupper, curr_bank['freqcuts'])
-            # NOTE: freq_idxes is a vector!
-            freq_idxes = numpy.array([self.frequency_map[f] for f in f_upper])
-            # vecs1 gives a 2x2 vector: idx0 = stored index, idx1 = mu index
-            vecs1 = mus[freq_idxes, :]
-            # vecs2 gives a 2x2 vector: idx0 = stored index, idx1 = mu index
-            range_idxes = numpy.arange(len(freq_idxes))
-            vecs2 = curr_bank['mus'][range_idxes,freq_idxes,:]
-
-            # Now do the sums
-            dists = (vecs1 - vecs2)*(vecs1 - vecs2)
-            # This reduces to 1D: idx = stored index
-            dists = numpy.sum(dists, axis=1)
-            # I wonder if this line actually speeds things up?
-            if (dists > distance_threshold).all():
-                continue
-            # This is only needed for close templates, should we prune?
-            norm_upper = numpy.array([self.normalization_map[f] \
-                                      for f in f_upper])
-            norm_other = numpy.array([self.normalization_map[f] \
-                                      for f in f_other])
-            norm_fac = norm_upper / norm_other
-            renormed_dists = 1 - (1 - dists)*norm_fac
-            if (renormed_dists < distance_threshold).any():
-                return True
-        else:
+        indices = self.get_neighbour_indices(chi1_bin, chi2_bin)
+        if not len(indices):
             return False
 
+        renormed_dists = self._calc_renormed_dists(point_fupper, mus, indices)
+        return bool((renormed_dists < distance_threshold).any())
+
     def add_point_by_chi_coords(self, chi_coords, mass1, mass2, spin1z, spin2z,
                           point_fupper=None, mus=None):
         """
@@ -450,41 +500,33 @@ class PartitionedTmpltbank(object):
             holds the coordinates in the [not covaried] mu parameter space for
             each value of the upper frequency cutoff.            
         """
+        if self.chi_coords is None:
+            size = 1024
+            self.chi_coords = numpy.zeros((size, len(chi_coords)))
+            self.masses = numpy.zeros((size, 4))
+            self.point_bins = numpy.zeros((size, 2), dtype=int)
+            self.freqcuts = numpy.zeros(size)
+        elif self.num_points == len(self.chi_coords):
+            self.chi_coords = _double_length(self.chi_coords)
+            self.masses = _double_length(self.masses)
+            self.point_bins = _double_length(self.point_bins)
+            self.freqcuts = _double_length(self.freqcuts)
+            if self.mus is not None:
+                self.mus = _double_length(self.mus)
+        if mus is not None and self.mus is None:
+            self.mus = numpy.zeros((len(self.chi_coords),) + mus.shape)
+
+        idx = self.num_points
         chi1_bin, chi2_bin = self.find_point_bin(chi_coords)
-        self.bank[chi1_bin][chi2_bin].append(copy.deepcopy(chi_coords))
-        curr_bank = self.massbank[chi1_bin][chi2_bin]
-        
-        if curr_bank['mass1s'].size:
-            curr_bank['mass1s'] = numpy.append(curr_bank['mass1s'],
-                                               numpy.array([mass1]))
-            curr_bank['mass2s'] = numpy.append(curr_bank['mass2s'],
-                                               numpy.array([mass2]))
-            curr_bank['spin1s'] = numpy.append(curr_bank['spin1s'],
-                                               numpy.array([spin1z]))
-            curr_bank['spin2s'] = numpy.append(curr_bank['spin2s'],
-                                               numpy.array([spin2z]))
-            if point_fupper is not None:
-                curr_bank['freqcuts'] = numpy.append(curr_bank['freqcuts'],
-                                                 numpy.array([point_fupper]))
-            # Mus needs to append onto axis 0. See below for contents of
-            # the mus variable
-            if mus is not None:
-                curr_bank['mus'] = numpy.append(curr_bank['mus'],
-                                            numpy.array([mus[:,:]]), axis=0)
-        else:
-            curr_bank['mass1s'] = numpy.array([mass1])
-            curr_bank['mass2s'] = numpy.array([mass2])
-            curr_bank['spin1s'] = numpy.array([spin1z])
-            curr_bank['spin2s'] = numpy.array([spin2z])
-            if point_fupper is not None:
-                curr_bank['freqcuts'] = numpy.array([point_fupper])
-            # curr_bank['mus'] is a 3D array
-            # NOTE: mu relates to the non-covaried Cartesian coordinate system
-            # Axis 0: Template index
-            # Axis 1: Frequency cutoff index
-            # Axis 2: Mu coordinate index
-            if mus is not None:
-                curr_bank['mus'] = numpy.array([mus[:,:]])
+        self.chi_coords[idx] = chi_coords
+        self.masses[idx] = mass1, mass2, spin1z, spin2z
+        self.point_bins[idx] = chi1_bin, chi2_bin
+        if point_fupper is not None:
+            self.freqcuts[idx] = point_fupper
+        if mus is not None:
+            self.mus[idx] = mus
+        self.bins.setdefault((chi1_bin, chi2_bin), []).append(idx)
+        self.num_points += 1
 
     def add_point_by_masses(self, mass1, mass2, spin1z, spin2z,
                             vary_fupper=False):
@@ -591,17 +633,192 @@ class PartitionedTmpltbank(object):
         spin2z : list
             List of spin2z values.
         """
-        mass1 = []
-        mass2 = []
-        spin1z = []
-        spin2z = []
-        for i in self.massbank.keys():
-            for j in self.massbank[i].keys():
-                for k in xrange(len(self.massbank[i][j]['mass1s'])):
-                    curr_bank = self.massbank[i][j]
-                    mass1.append(curr_bank['mass1s'][k])
-                    mass2.append(curr_bank['mass2s'][k])
-                    spin1z.append(curr_bank['spin1s'][k])
-                    spin2z.append(curr_bank['spin2s'][k])
-
-        return mass1, mass2, spin1z, spin2z
+        if not self.num_points:
+            return [], [], [], []
+        masses = self.masses[:self.num_points]
+        return (list(masses[:,0]), list(masses[:,1]), list(masses[:,2]),
+                list(masses[:,3]))
+
+# Sentinel chi_1 bins for the edges of the whole parameter space
+MIN_BIN = -2**62
+MAX_BIN = 2**62
+
+def place_seeds_in_blocks(bank, draw_seeds, num_seeds, max_mismatch,
+                          num_failed_cutoff, chi1_bins=(MIN_BIN, MAX_BIN)):
+    """
+    Draw random seed points and add those that are not within the mismatch
+    of the bank to it, testing them in blocks. This draws the same seeds, and
+    accepts the same points, as testing them one at a time. Blocks are cut
+    short so that the num_seeds and num_failed_cutoff limits apply at the
+    same seed as they would otherwise.
+
+    Parameters
+    -----------
+    bank : PartitionedTmpltbank
+        The bank to add the points to.
+    draw_seeds : function
+        Function taking a number of points, which returns the mass1, mass2,
+        spin1z and spin2z of that many random points and their chi
+        coordinates, with axis 0 of these being the coordinate index.
+    num_seeds : int
+        The number of seed points to draw.
+    max_mismatch : float
+        The maximum mismatch between a seed and the bank.
+    num_failed_cutoff : int
+        The number of consecutive seeds that are not accepted after which
+        placement stops.
+    chi1_bins : tuple of int, optional
+        If given, only the seeds in this range of chi_1 bins are placed, and
+        those within two bins of its edges are also returned. These are the
+        seeds that may have been covered by templates in the bins at the
+        edges.
+
+    Returns
+    --------
+    num_added : int
+        The number of points added to the bank.
+    border : list
+        The seed number, chi coordinates, mass1, mass2, spin1z and spin2z of
+        the seeds near the edges of chi1_bins, or an empty list if there are
+        none.
+    """
+    lo, hi = chi1_bins
+    border = []
+    N = Np = Nr = 0
+    while Np < num_seeds and Nr <= num_failed_cutoff:
+        # For optimization we generate points in sets of 100000
+        mass1, mass2, spin1z, spin2z, vecs = draw_seeds(100000)
+        logging.info("%d seeds" % Np)
+        num = min(100000, num_seeds - Np)
+        seed_bins = numpy.floor((vecs[0,:num] - bank.chi1_min) /
+                                bank.bin_spacing)
+        keep = numpy.flatnonzero((seed_bins >= lo) & (seed_bins < hi))
+        near = keep[(seed_bins[keep] < lo + 2) | (seed_bins[keep] >= hi - 2)]
+        if len(near):
+            border.append((Np + near, vecs[:,near], mass1[near],
+                           mass2[near], spin1z[near], spin2z[near]))
+        Np = Np + num
+
+        Ns = 0
+        while Ns < len(keep):
+            size = min(10000, len(keep) - Ns, num_failed_cutoff - Nr + 1)
+            block = keep[Ns:Ns + size]
+            accepted = bank.test_and_add_points(vecs[:,block], max_mismatch,
+                           mass1[block], mass2[block], spin1z[block],
+                           spin2z[block])
+            Ns = Ns + size
+            if accepted.any():
+                N = N + accepted.sum()
+                Nr = size - 1 - numpy.flatnonzero(accepted)[-1]
+            else:
+                Nr = Nr + size
+            if Nr > num_failed_cutoff:
+                break
+        logging.info("%d templates" % N)
+
+    if border:
+        border = [numpy.concatenate(b, axis=-1) for b in zip(*border)]
+    return N, border
+
+# The arguments of place_seeds_in_regions, which are inherited by the worker
+# processes rather than sent to them
+_region_placement = None
+
+def _place_region(args):
+    """
+    Place the seeds in a range of chi_1 bins in a worker process. Return
+    the templates that are more than one bin from the edges of the range,
+    and the seeds near the edges.
+    """
+    chi1_bins, random_state = args
+    bank, draw_seeds, num_seeds, max_mismatch, num_failed_cutoff = \
+                                                        _region_placement
+    # All processes draw the same seeds, and keep those in their region
+    numpy.random.set_state(random_state)
+    _, border = place_seeds_in_blocks(bank, draw_seeds, num_seeds,
+                                      max_mismatch, num_failed_cutoff,
+                                      chi1_bins)
+
+    lo, hi = chi1_bins
+    num = bank.num_points
+    if not num:
+        return [], [], border
+    bins = bank.point_bins[:num,0]
+    interior = (bins > lo) & (bins < hi - 1)
+    return (bank.chi_coords[:num][interior], bank.masses[:num][interior],
+            border)
+
+def place_seeds_in_regions(bank, draw_seeds, num_seeds, max_mismatch,
+                           num_failed_cutoff, processes):
+    """
+    Place seed points as place_seeds_in_blocks does, with the chi_1 direction
+    split into regions with similar numbers of seeds which are placed in
+    parallel. Every process draws the same seeds, and keeps those that fall
+    in its region.
+
+    The templates of each region that are more than one bin from its edges
+    are kept. The seeds within two bins of the edges are then placed again,
+    in the order they were drawn, against these. Any seed whose covering
+    template was dropped is among them, so every seed is within the mismatch
+    of a template, and templates from neighbouring regions cannot overlap.
+    The num_failed_cutoff limit applies to the seeds of each region.
+
+    The bank must use a bin_range_check of 1, and the worker processes are
+    forked, so draw_seeds need not be picklable. The arguments are as for
+    place_seeds_in_blocks, with processes giving the number of regions.
+
+    Returns
+    --------
+    num_added : int
+        The number of points added to the bank.
+    """
+    global _region_placement
+    random_state = numpy.random.get_state()
+
+    # Choose the regions to have similar numbers of seeds
+    vecs = draw_seeds(100000)[4]
+    sample_bins = numpy.floor((vecs[0] - bank.chi1_min) / bank.bin_spacing)
+    quantiles = numpy.arange(1, processes) / float(processes)
+    edges = numpy.unique(numpy.percentile(sample_bins, 100 * quantiles))
+    edges = [MIN_BIN] + [int(e) for e in edges] + [MAX_BIN]
+    regions = zip(edges[:-1], edges[1:])
+
+    logging.info("Placing %d regions in parallel" % len(regions))
+    _region_placement = (bank, draw_seeds, num_seeds, max_mismatch,
+                         num_failed_cutoff)
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_place_region,
+                           [(region, random_state) for region in regions])
+    finally:
+        pool.close()
+        pool.join()
+        _region_placement = None
+
+    N = bank.num_points
+    for chi_coords, masses, _ in results:
+        for vs, (mass1, mass2, spin1z, spin2z) in zip(chi_coords, masses):
+            bank.add_point_by_chi_coords(vs, mass1, mass2, spin1z, spin2z)
+    N = bank.num_points - N
+    logging.info("%d templates away from region borders" % N)
+
+    borders = [border for _, _, border in results if border]
+    if borders:
+        seed_num, vecs, mass1, mass2, spin1z, spin2z = \
+                   [numpy.concatenate(b, axis=-1) for b in zip(*borders)]
+        order = seed_num.argsort()
+        logging.info("Placing %d seeds near region borders" % len(order))
+        for i in xrange(0, len(order), 10000):
+            block = order[i:i + 10000]
+            accepted = bank.test_and_add_points(vecs[:,block], max_mismatch,
+                           mass1[block], mass2[block], spin1z[block],
+                           spin2z[block])
+            N = N + accepted.sum()
+    logging.info("%d templates" % N)
+    return N
+
+def _double_length(arr):
+    """
+    Return a copy of arr with axis 0 twice as long, padded with zeros.
+    """
+    return numpy.concatenate([arr, numpy.zeros_like(arr)])
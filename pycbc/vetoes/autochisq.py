@@ -17,7 +17,8 @@ from pycbc.filter import make_frequency_series
 from pycbc.filter import  matched_filter_core
 from pycbc.types import Array
 import numpy as np
-import logging
+import logging, weakref
+from collections import OrderedDict
 
 BACKEND_PREFIX="pycbc.vetoes.autochisq_"
 
@@ -65,21 +66,51 @@ def autochisq_from_precomputed(sn, corr_sn, hautocorr, indices,
         returns autochisq values and snr corresponding to the instances 
         of time defined by indices
     """
-    Nsnr = len(sn)
+    offsets, num_points = autochisq_offsets(len(sn), stride, num_points,
+                                            oneside)
+    hautocorr = _as_numpy(hautocorr)
+    achisq = autochisq_from_taps(sn, corr_sn, hautocorr[offsets], offsets,
+                                 indices, twophase=twophase,
+                                 maxvalued=maxvalued)
 
-    indx = np.array([])
+    dof = num_points
+    if oneside is None:
+        dof = dof * 2
+    if twophase:
+        dof = dof * 2
 
-    achisq = np.zeros(len(indices))
+    return dof, achisq, indices
+
+def autochisq_offsets(Nsnr, stride=1, num_points=None, oneside=None):
+    """
+    Return the offsets from a trigger of the points at which the auto-chisq
+    is computed, and the number of points used on each side.
+
+    Parameters
+    ----------
+    Nsnr: int
+        The length of the snr time series
+    stride: [int, optional; default = 1]
+        stride for points selection for autochisq
+    num_points: [int, optional; default=None]
+        Number of points used for autochisq on each side, if None all points
+        are used.
+    oneside: [str, optional; default=None]
+        If given, 'left' or 'right' to only use points on that side.
+
+    Returns
+    -------
+    offsets: numpy.ndarray
+        The offsets, in samples, of the points
+    num_points: int
+        The number of points on each side
+    """
     num_points_all = int(Nsnr/stride)
     if num_points is None:
         num_points = num_points_all
     if (num_points > num_points_all):
         num_points = num_points_all
 
-    snrabs = np.abs(sn[indices])
-    cphi_array = (sn[indices]).real / snrabs
-    sphi_array = (sn[indices]).imag / snrabs
-
     start_point = - stride*num_points
     end_point = stride*num_points+1
     if oneside == 'left':
@@ -91,51 +122,89 @@ def autochisq_from_precomputed(sn, corr_sn, hautocorr, indices,
         achisq_idx_list_pt2 = np.arange(stride, end_point, stride)
         achisq_idx_list = np.append(achisq_idx_list_pt1,
                                     achisq_idx_list_pt2)
+    return achisq_idx_list, num_points
+
+def autochisq_from_taps(sn, corr_sn, hauto_corr_vec, offsets, indices,
+                        twophase=True, maxvalued=False, block_size=4096):
+    """
+    Compute the auto-chisq at all the indices at once, given the template
+    autocorrelation at the offsets being tested.
+
+    Parameters
+    ----------
+    sn: Array[complex]
+        normalized (!) array of complex snr for the template that produced the
+        trigger(s) being tested
+    corr_sn : Array[complex]
+        normalized (!) array of complex snr for the template that you want to
+        produce a correlation chisq test for.
+    hauto_corr_vec: numpy.ndarray
+        The template autocorrelation at each of the offsets
+    offsets: numpy.ndarray
+        The offsets from each index of the points to test, as returned by
+        autochisq_offsets
+    indices: Array[int]
+        compute correlation chisquare at the points specified in this array
+    twophase: Boolean, optional; default=True
+        If True calculate the auto-chisq using both phases of the filter.
+    maxvalued: Boolean, optional; default=False
+        Return the largest auto-chisq at any of the points tested if True.
+    block_size: int, optional
+        The number of indices to process at once, which bounds the size of
+        the (indices, offsets) arrays.
+
+    Returns
+    -------
+    achisq: numpy.ndarray
+        The auto-chisq at each index
+    """
+    sn = _as_numpy(sn)
+    corr_sn = _as_numpy(corr_sn)
+    indices = np.array(_as_numpy(indices), dtype=int, ndmin=1)
+    Nsnr = len(sn)
 
-    hauto_corr_vec = hautocorr[achisq_idx_list]
     hauto_norm = hauto_corr_vec.real*hauto_corr_vec.real
     # REMOVE THIS LINE TO REPRODUCE OLD RESULTS
     hauto_norm += hauto_corr_vec.imag*hauto_corr_vec.imag
     chisq_norm = 1.0 - hauto_norm
 
-    for ip,ind in enumerate(indices):
-        curr_achisq_idx_list = achisq_idx_list + ind
-        
-        cphi = cphi_array[ip]
-        sphi = sphi_array[ip]
+    achisq = np.zeros(len(indices))
+    for start in xrange(0, len(indices), block_size):
+        ind = indices[start:start + block_size]
+
+        snrabs = np.abs(sn[ind])
+        cphi = (sn[ind]).real / snrabs
+        sphi = (sn[ind]).imag / snrabs
         # By construction, the other "phase" of the SNR is 0
-        snr_ind =  sn[ind].real*cphi + sn[ind].imag*sphi
+        snr_ind = (sn[ind].real*cphi + sn[ind].imag*sphi)[:, None]
+        cphi = cphi[:, None]
+        sphi = sphi[:, None]
 
-        # Wrap index if needed (maybe should fail in this case?)
-        if curr_achisq_idx_list[0] < 0:
-            curr_achisq_idx_list[curr_achisq_idx_list < 0] += Nsnr
-        if curr_achisq_idx_list[-1] > (Nsnr - 1):
-            curr_achisq_idx_list[curr_achisq_idx_list > (Nsnr-1)] -= Nsnr
+        # Points to test for every index, wrapping around the ends of the
+        # time series if needed (maybe should fail in this case?)
+        idx = np.mod(ind[:, None] + offsets[None, :], Nsnr)
+        corr = corr_sn[idx]
 
-        z = corr_sn[curr_achisq_idx_list].real*cphi + \
-             corr_sn[curr_achisq_idx_list].imag*sphi
+        z = corr.real*cphi + corr.imag*sphi
         dz = z - hauto_corr_vec.real*snr_ind
-        curr_achisq_list = dz*dz/chisq_norm
+        curr_achisq = dz*dz/chisq_norm
 
         if twophase:
-            chisq_norm = 1.0 - hauto_norm
-            z = -corr_sn[curr_achisq_idx_list].real*sphi + \
-                 corr_sn[curr_achisq_idx_list].imag*cphi
+            z = -corr.real*sphi + corr.imag*cphi
             dz = z - hauto_corr_vec.imag*snr_ind
-            curr_achisq_list += dz*dz/chisq_norm
-          
+            curr_achisq += dz*dz/chisq_norm
+
         if maxvalued:
-            achisq[ip] = curr_achisq_list.max()
+            achisq[start:start + block_size] = curr_achisq.max(axis=1)
         else:
-            achisq[ip] = curr_achisq_list.sum()
-
-    dof = num_points
-    if oneside is None:
-        dof = dof * 2
-    if twophase:
-        dof = dof * 2
+            achisq[start:start + block_size] = curr_achisq.sum(axis=1)
+    return achisq
 
-    return dof, achisq, indices
+def _as_numpy(vec):
+    """ Return the data of a pycbc Array, or the input as a numpy array """
+    if isinstance(vec, Array):
+        return vec.data
+    return np.asarray(vec)
 
 class SingleDetAutoChisq(object):
     """Class that handles precomputation and memory management for efficiently
@@ -143,7 +212,7 @@ class SingleDetAutoChisq(object):
     """	
     def __init__(self, stride, num_points, onesided=None, twophase=False,
                  reverse_template=False, take_maximum_value=False,
-                 maximal_value_dof=None):
+                 maximal_value_dof=None, cache_size=64):
         """
         Initialize autochisq calculation instance
 
@@ -171,6 +240,10 @@ class SingleDetAutoChisq(object):
         maximal_value_dof : int, required if using take_maximum_value
             If using take_maximum_value the expected value is not known. This
             value specifies what to store in the cont_chisq_dof output.
+        cache_size : optional, default=64
+            The number of template and PSD pairs to keep the autocorrelation
+            of. When filtering a batch of templates this should be at least
+            the number of templates in the batch.
         """
         if stride > 0:
             self.do = True
@@ -195,8 +268,10 @@ class SingleDetAutoChisq(object):
                     raise ValueError(err_msg)
                 self.dof = maximal_value_dof
             
-            self._autocor = None
-            self._autocor_id = None
+            # The autocorrelation at the tested offsets of the most recently
+            # used template and PSD pairs
+            self.cache_size = cache_size
+            self._autocor = OrderedDict()
         else:
             self.do = False
 
@@ -229,9 +304,19 @@ class SingleDetAutoChisq(object):
         if self.do and (len(indices) > 0):
             htilde = make_frequency_series(template)
 
-            # Check if we need to recompute the autocorrelation
-            key = (id(template), id(psd))
-            if key != self._autocor_id:
+            offsets, num_points = autochisq_offsets(len(sn), self.stride,
+                                                    self.num_points,
+                                                    self.one_sided)
+
+            # Check if we need to recompute the autocorrelation. The entries
+            # hold weak references to the template and PSD, so that an entry
+            # is not used for a new object given the id of a freed one.
+            key = (id(template), id(psd), len(sn))
+            entry = self._autocor.pop(key, None)
+            if entry is not None and entry[0]() is template \
+                    and entry[1]() is psd:
+                autocor = entry[2]
+            else:
                 logging.info("Calculating autocorrelation")
 
                 if not self.reverse_template:
@@ -240,7 +325,6 @@ class SingleDetAutoChisq(object):
                               low_frequency_cutoff=low_frequency_cutoff,
                               high_frequency_cutoff=high_frequency_cutoff)
                     Pt = Pt * (1./ Pt[0])
-                    self._autocor = Array(Pt, copy=True)
                 else:
                     Pt, _Ptilde, P_norm = matched_filter_core(htilde.conj(),
                               htilde, psd=psd,
@@ -253,8 +337,12 @@ class SingleDetAutoChisq(object):
                     #        code is really slow ... why??
                     norm_fac = P_norm / float(((template.sigmasq(psd))**0.5))
                     Pt *= norm_fac
-                    self._autocor = Array(Pt, copy=True)
-                self._autocor_id = key
+                autocor = _as_numpy(Pt)[offsets]
+
+            self._autocor[key] = (weakref.ref(template), weakref.ref(psd),
+                                  autocor)
+            if len(self._autocor) > self.cache_size:
+                self._autocor.popitem(last=False)
             
             logging.info("...Calculating autochisquare")
             sn = sn*norm
@@ -268,12 +356,15 @@ class SingleDetAutoChisq(object):
             else:
                 correlation_snr = sn
 
-            achi_list = np.array([])
-            index_list = np.array(indices)
-            dof, achi_list, _ = autochisq_from_precomputed(sn, correlation_snr,
-                               self._autocor, index_list, stride=self.stride,
-                               num_points=self.num_points,
-                               oneside=self.one_sided, twophase=self.two_phase,
+            achi_list = autochisq_from_taps(sn, correlation_snr,
+                               autocor, offsets, indices,
+                               twophase=self.two_phase,
                                maxvalued=self.take_maximum_value)
+
+            dof = num_points
+            if self.one_sided is None:
+                dof = dof * 2
+            if self.two_phase:
+                dof = dof * 2
             self.dof = dof
             return achi_list
@@ -22,8 +22,12 @@
 # =============================================================================
 #
 import logging, numpy
+from pycbc import scheme
 from pycbc.types import Array, zeros, real_same_precision_as, TimeSeries
-from pycbc.filter import overlap_cplx, matched_filter_core
+from pycbc.filter import overlap_cplx, matched_filter_core, get_cutoff_indices
+from pycbc.filter.matchedfilter import BatchCorrelator
+from pycbc.fft import IFFT
+from pycbc.fft.backend_support import get_backend
 from pycbc.waveform import FilterBank
 from math import sqrt
 
@@ -162,6 +166,117 @@ def bank_chisq_from_filters(tmplt_snr, tmplt_norm, bank_snrs, bank_norms,
         return TimeSeries(bank_chisq, delta_t=tmplt_snr.delta_t,
                           epoch=tmplt_snr.start_time, copy=False)
 
+def batch_template_overlaps(bank_rows, bank_sigmasqs, bank_params, template,
+                            psd, low_frequency_cutoff):
+    """ This function calculates the overlaps between the template and all
+    the bank veto templates at once.
+
+    Parameters
+    ----------
+    bank_rows: numpy.ndarray
+        2-D array holding one bank veto template in each row
+    bank_sigmasqs: numpy.ndarray
+        The sigmasq of each bank veto template
+    bank_params: list
+        The parameters of each bank veto template
+    template: FrequencySeries
+    psd: FrequencySeries
+    low_frequency_cutoff: float
+
+    Returns
+    -------
+    overlaps: numpy.ndarray of complex overlap values.
+    """
+    kmin, kmax = get_cutoff_indices(low_frequency_cutoff, None,
+                                    template.delta_f, (len(template)-1) * 2)
+    template_ow = numpy.array((template / psd).data[kmin:kmax],
+                              dtype=numpy.complex128).conj()
+
+    # Accumulate in double precision, as overlap_cplx does, a piece of the
+    # frequency range at a time to bound the temporary memory
+    overlaps = numpy.zeros(len(bank_rows), dtype=numpy.complex128)
+    step = 65536
+    for k in xrange(kmin, kmax, step):
+        block = bank_rows[:, k:min(k + step, kmax)]
+        overlaps += numpy.dot(block.astype(numpy.complex128),
+                              template_ow[k - kmin:k - kmin + block.shape[1]])
+    overlaps *= 4 * template.delta_f
+    overlaps *= numpy.sqrt(1 / template.sigmasq(psd) / bank_sigmasqs)
+
+    for i in numpy.flatnonzero(abs(overlaps) > 0.99):
+        errMsg = "Overlap > 0.99 between bank template and filter. "
+        errMsg += "This bank template will not be used to calculate "
+        errMsg += "bank chisq for this filter template. The expected "
+        errMsg += "value will be added to the chisq to account for "
+        errMsg += "the removal of this template.\n"
+        errMsg += "Masses of filter template: %e %e\n" \
+                  %(template.params.mass1, template.params.mass2)
+        errMsg += "Masses of bank filter template: %e %e\n" \
+                  %(bank_params[i].mass1, bank_params[i].mass2)
+        errMsg += "Overlap: %e" %(abs(overlaps[i]))
+        logging.debug(errMsg)
+    return overlaps
+
+def batch_bank_chisq(tmplt_snr, tmplt_norm, bank_snrs, bank_norms,
+                     tmplt_bank_matches, indices=None):
+    """ This function calculates the bank veto for all the bank veto
+    templates at once. It returns the same values as bank_chisq_from_filters.
+
+    Parameters
+    ----------
+    tmplt_snr: TimeSeries
+        The SNR time series from filtering the segment against the current
+        search template
+    tmplt_norm: float
+        The normalization factor for the search template
+    bank_snrs: numpy.ndarray
+        2-D array holding the SNR time series between each of the bank veto
+        templates and the segment in each row
+    bank_norms: numpy.ndarray
+        The normalization factors for the bank veto templates
+    tmplt_bank_matches: numpy.ndarray
+        The complex overlap between the search template and each
+        of the bank templates
+    indices: {None, Array}, optional
+        Array of indices into the bank veto snr time series. If given, the
+        bank chisq will only be calculated at these values, and tmplt_snr
+        holds the search template SNR at these indices.
+
+    Returns
+    -------
+    bank_chisq: TimeSeries of the bank vetos
+    """
+    snr = numpy.array(tmplt_snr.data, copy=False)
+    if indices is not None:
+        if isinstance(indices, Array):
+            indices = indices.data
+        bank_snrs = bank_snrs[:, indices]
+
+    # Bank templates very close to the filter template add the expected
+    # value of 2 rather than being calculated, as in bank_chisq_from_filters
+    matches = numpy.array(tmplt_bank_matches)
+    close = abs(matches) > 0.99
+    matches = matches[~close]
+    bank_snrs = bank_snrs[~close]
+    bank_norm = numpy.sqrt((1 - matches * matches.conj()).real)
+
+    dtype = snr.dtype
+    bank_fac = (numpy.array(bank_norms)[~close] / bank_norm).astype(dtype)
+    tmplt_fac = (matches.conj() * tmplt_norm / bank_norm).astype(dtype)
+
+    diff = bank_snrs * bank_fac[:, None]
+    diff -= tmplt_fac[:, None] * snr[None, :]
+    bank_chisq = (diff.real ** 2 + diff.imag ** 2).sum(axis=0)
+    bank_chisq += 2. * close.sum()
+    bank_chisq = Array(bank_chisq.astype(real_same_precision_as(tmplt_snr)),
+                       copy=False)
+
+    if indices is not None:
+        return bank_chisq
+    else:
+        return TimeSeries(bank_chisq, delta_t=tmplt_snr.delta_t,
+                          epoch=tmplt_snr.start_time, copy=False)
+
 class SingleDetBankVeto(object):
     """This class reads in a template bank file for a bank veto, handles the
        memory management of its filters internally, and calculates the bank
@@ -187,9 +302,32 @@ class SingleDetBankVeto(object):
                     dtype=self.cdtype,
                     approximant=approximant, **kwds)
 
-            self.filters = list(bank_veto_bank)
             self.dof = len(bank_veto_bank) * 2
 
+            # On the CPU the filters are generated into one array, with a
+            # stride of the segment length in time, so that their snrs can be
+            # found with a batched correlation and inverse fft, if the fft
+            # backend provides one
+            self.batch = isinstance(scheme.mgr.state, scheme.CPUScheme) and \
+                         hasattr(get_backend(), 'IFFT')
+            if self.batch:
+                nfilters = len(bank_veto_bank)
+                tlen = self.seg_len_time
+                self.filter_mem = zeros(tlen * nfilters, dtype=self.cdtype)
+                self.corr_mem = zeros(tlen * nfilters, dtype=self.cdtype)
+                self.snr_mem = zeros(tlen * nfilters, dtype=self.cdtype)
+                self.ifft = IFFT(self.corr_mem, self.snr_mem,
+                                 nbatch=nfilters, size=tlen)
+                self.kmin, self.kmax = get_cutoff_indices(f_low, None,
+                                                          delta_f, tlen)
+
+                bank_veto_bank.out = self.filter_mem
+                self.filters = bank_veto_bank.get_block(0, nfilters)
+                self.filter_rows = numpy.array(self.filter_mem.data,
+                          copy=False).reshape(nfilters, tlen)[:, :flen]
+            else:
+                self.filters = list(bank_veto_bank)
+
             self._overlaps_cache = {}
             self._segment_snrs_cache = {}
         else:
@@ -199,7 +337,10 @@ class SingleDetBankVeto(object):
         key = (id(stilde), id(psd))
         if key not in self._segment_snrs_cache:
             logging.info("Precalculate the bank veto template snrs")
-            data = segment_snrs(self.filters, stilde, psd, self.f_low)
+            if self.batch:
+                data = self._batch_segment_snrs(stilde, psd)
+            else:
+                data = segment_snrs(self.filters, stilde, psd, self.f_low)
             self._segment_snrs_cache[key] = data
         return self._segment_snrs_cache[key]
 
@@ -207,10 +348,35 @@ class SingleDetBankVeto(object):
         key = (id(template.params), id(psd))
         if key not in self._overlaps_cache:
             logging.info("...Calculate bank veto overlaps")
-            o = template_overlaps(self.filters, template, psd, self.f_low)
+            if self.batch:
+                sigmasqs = numpy.array([f.sigmasq(psd) for f in self.filters])
+                params = [f.params for f in self.filters]
+                o = batch_template_overlaps(self.filter_rows, sigmasqs,
+                                            params, template, psd,
+                                            self.f_low)
+            else:
+                o = template_overlaps(self.filters, template, psd, self.f_low)
             self._overlaps_cache[key] = o
         return self._overlaps_cache[key]
 
+    def _batch_segment_snrs(self, stilde, psd):
+        """ Return the snr time series of all the bank veto templates against
+        the segment, as the rows of a 2-D array, and their normalizations.
+        """
+        nfilters = len(self.filters)
+        corr = BatchCorrelator(self.filter_mem, stilde, self.corr_mem,
+                               self.seg_len_time, nfilters,
+                               self.kmin, self.kmax)
+        corr.correlate()
+        self.ifft.execute()
+
+        # The snr memory is reused for the next segment, so keep a copy
+        snrs = numpy.array(self.snr_mem.data, copy=True)
+        snrs = snrs.reshape(nfilters, self.seg_len_time)
+        norms = numpy.array([4.0 * stilde.delta_f / sqrt(f.sigmasq(psd))
+                             for f in self.filters])
+        return snrs, norms
+
     def values(self, template, psd, stilde, snrv, norm, indices):
         """
         Returns
@@ -225,7 +391,11 @@ class SingleDetBankVeto(object):
             logging.info("...Doing bank veto")
             overlaps = self.cache_overlaps(template, psd)
             bank_veto_snrs, bank_veto_norms = self.cache_segment_snrs(stilde, psd)
-            chisq = bank_chisq_from_filters(snrv, norm, bank_veto_snrs,
+            if self.batch:
+                chisq = batch_bank_chisq(snrv, norm, bank_veto_snrs,
+                                         bank_veto_norms, overlaps, indices)
+            else:
+                chisq = bank_chisq_from_filters(snrv, norm, bank_veto_snrs,
                                             bank_veto_norms, overlaps, indices) 
             dof = numpy.repeat(self.dof, len(chisq))
             return chisq, dof
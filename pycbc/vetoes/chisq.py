@@ -21,7 +21,8 @@
 #
 # =============================================================================
 #
-import numpy, logging, math, pycbc.fft
+import numpy, logging, math, hashlib, pycbc.fft
+from collections import OrderedDict
 
 from pycbc.types import zeros, real_same_precision_as, TimeSeries, complex_same_precision_as
 from pycbc.filter import sigmasq_series, make_frequency_series, matched_filter_core, get_cutoff_indices
@@ -133,6 +134,49 @@ def power_chisq_at_points_from_precomputed(corr, snr, snr_norm, bins, indices):
     chisq = shift_sum(corr, indices, bins)
     return (chisq * num_bins - (snr.conj() * snr).real) * (snr_norm ** 2.0)
 
+@schemed(BACKEND_PREFIX)
+def shift_sum_block(v1s, shifts, bins):
+    """ Calculate the time shifted sum of several FrequencySeries, each at
+    its own shifts and with its own bins, in a single call
+    """
+    pass
+
+def power_chisq_at_points_block(corrs, snrs, snr_norms, bins, indices):
+    """Calculate the chisq at select points for several templates at once.
+
+    This is power_chisq_at_points_from_precomputed for each template, with
+    the time shifted sums of all templates done by one kernel call, which
+    avoids the fixed cost of each call when templates have only a few points.
+
+    Parameters
+    ----------
+    corrs: list of FrequencySeries
+        The product of each template and the data in the frequency domain.
+    snrs: list of numpy.ndarray
+        The unnormalized snr of each template at its points in `indices`.
+    snr_norms: list of floats
+        The normalization of the snr of each template.
+    bins: list of lists of integers
+        The edges of the equal power bins of each template.
+    indices: list of Arrays
+        The indices where we will calculate the chisq of each template. These
+        must be relative to the corresponding `corr` series.
+
+    Returns
+    -------
+    chisq: list of Arrays
+        For each template, an array of the chisq at its selected points.
+    """
+    import pycbc.scheme
+    if not isinstance(pycbc.scheme.mgr.state, pycbc.scheme.CPUScheme):
+        return [power_chisq_at_points_from_precomputed(c, s, n, b, i)
+                for c, s, n, b, i in zip(corrs, snrs, snr_norms, bins, indices)]
+
+    logging.info('doing fast point chisq for %s templates' % len(corrs))
+    chisqs = shift_sum_block(corrs, indices, bins)
+    return [(chisq * (len(b) - 1) - (snr.conj() * snr).real) * (norm ** 2.0)
+            for chisq, snr, norm, b in zip(chisqs, snrs, snr_norms, bins)]
+
 _q_l = None
 _qtilde_l = None
 _chisq_l = None
@@ -282,11 +326,113 @@ def power_chisq(template, data, num_bins, psd,
     return power_chisq_from_precomputed(corr, total_snr, tnorm, bins)
 
 
+def psd_hash(psd):
+    """ Return a hash of the contents of a psd. This is stored as an
+    attribute of the psd, so the psd must not be changed afterwards.
+    """
+    if not hasattr(psd, 'content_hash'):
+        data = numpy.ascontiguousarray(psd.numpy())
+        digest = hashlib.sha1(data.view(numpy.uint8))
+        digest.update(repr((float(psd.delta_f), len(psd), data.dtype.str)))
+        psd.content_hash = digest.hexdigest()
+    return psd.content_hash
+
+class PowerChisqBinTable(object):
+    """ The chisq bins of every template of a bank for one psd.
+
+    Parameters
+    ----------
+    hashes: numpy.ndarray
+        The template hash of each template
+    offsets: numpy.ndarray
+        The bins of template i are edges[offsets[i]:offsets[i+1]]
+    edges: numpy.ndarray
+        The bin edges of all templates, one after another
+    """
+    def __init__(self, hashes, offsets, edges):
+        order = numpy.argsort(hashes, kind='mergesort')
+        self.hashes = numpy.array(hashes)[order]
+        self.order = order
+        self.offsets = numpy.array(offsets)
+        self.edges = numpy.array(edges)
+
+    def get(self, thash):
+        """ Return the bins of the template with the given hash, or None if
+        it is not in the table.
+        """
+        i = numpy.searchsorted(self.hashes, thash)
+        if i == len(self.hashes) or self.hashes[i] != thash:
+            return None
+        row = self.order[i]
+        return self.edges[self.offsets[row]:self.offsets[row + 1]]
+
+    def write(self, filename, key):
+        """ Store the table in an hdf file, under the given key.
+
+        The table is added to a copy of the file, which then replaces it, so
+        that jobs reading the file never see it partly written. If several
+        jobs write to the same file at once some of their tables may be lost,
+        but the file is not corrupted.
+        """
+        import h5py, os, shutil, tempfile
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        os.close(fd)
+        try:
+            if os.path.exists(filename):
+                shutil.copyfile(filename, tmp)
+            else:
+                os.remove(tmp)
+            f = h5py.File(tmp, 'a')
+            if key not in f:
+                f[key + '/template_hash'] = self.hashes[numpy.argsort(self.order)]
+                f[key + '/offsets'] = self.offsets
+                f[key + '/edges'] = self.edges
+            f.close()
+            os.rename(tmp, filename)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def read(cls, filename, key):
+        """ Read a table stored with write, or return None if the file does
+        not hold one under the given key.
+        """
+        import h5py, os
+        if not os.path.exists(filename):
+            return None
+        f = h5py.File(filename, 'r')
+        table = None
+        if key in f:
+            table = cls(f[key + '/template_hash'][:], f[key + '/offsets'][:],
+                        f[key + '/edges'][:])
+        f.close()
+        return table
+
+class BankTemplateParams(object):
+    """ The attributes of a generated template that the chisq bins option
+    can use, for a template of a bank that has not been generated.
+    """
+    def __init__(self, params, approximant, f_lower, end_frequency, end_idx):
+        self.params = params
+        self.approximant = approximant
+        self.f_lower = f_lower
+        self.end_frequency = end_frequency
+        self.end_idx = end_idx
+
 class SingleDetPowerChisq(object):
     """Class that handles precomputation and memory management for efficiently
     running the power chisq in a single detector inspiral analysis.
+
+    The chisq bins are cached by template hash and psd contents, keeping the
+    cache_size most recently used. If a bank is given, the bins of every
+    template in it are computed at once for each psd, when possible, and
+    these are read from and stored in bin_file if it is given.
     """
-    def __init__(self, num_bins=0, snr_threshold=None):
+    def __init__(self, num_bins=0, snr_threshold=None, cache_size=10000,
+                 bank=None, bin_file=None, write_bin_file=False):
         if not (num_bins == "0" or num_bins == 0):
             self.do = True
             self.column_name = "chisq"
@@ -295,7 +441,13 @@ class SingleDetPowerChisq(object):
         else:
             self.do = False
         self.snr_threshold = snr_threshold
-        self._bin_cache = {}
+        self.cache_size = cache_size
+        self.bank = bank
+        self.bin_file = bin_file
+        self.write_bin_file = write_bin_file
+        self._bin_cache = OrderedDict()
+        self._bank_bins = OrderedDict()
+        self._bank_hash = None
 
     @staticmethod
     def parse_option(row, arg):
@@ -306,22 +458,141 @@ class SingleDetPowerChisq(object):
         return eval(arg, {"__builtins__":None}, safe_dict)
 
     def cached_chisq_bins(self, template, psd):
-        key = (id(template.params), id(psd))
-        if key not in self._bin_cache:
-            num_bins = int(self.parse_option(template, self.num_bins))
-
-            if hasattr(psd, 'sigmasq_vec') and template.approximant in psd.sigmasq_vec:
-                logging.info("...Calculating fast power chisq bins")
-                kmin = int(template.f_lower / psd.delta_f)
-                kmax = template.end_idx
-                bins = power_chisq_bins_from_sigmasq_series(
-                    psd.sigmasq_vec[template.approximant], num_bins, kmin, kmax)
-            else:
-                logging.info("...Calculating power chisq bins")
-                bins = power_chisq_bins(template, num_bins, psd, template.f_lower)
+        from pycbc.waveform.bank import template_hash
+        thash = template_hash(template.params)
+        phash = psd_hash(psd)
+
+        if self.bank is not None:
+            table = self.bank_chisq_bins(psd)
+            bins = table.get(thash) if table is not None else None
+            if bins is not None:
+                return bins
+
+        num_bins = int(self.parse_option(template, self.num_bins))
+        key = (thash, template.approximant, template.f_lower,
+               template.end_idx, num_bins, phash)
+        if key in self._bin_cache:
+            # Move the entry to the most recently used end
+            bins = self._bin_cache.pop(key)
             self._bin_cache[key] = bins
+            return bins
+
+        if hasattr(psd, 'sigmasq_vec') and template.approximant in psd.sigmasq_vec:
+            logging.info("...Calculating fast power chisq bins")
+            kmin = int(template.f_lower / psd.delta_f)
+            kmax = template.end_idx
+            bins = power_chisq_bins_from_sigmasq_series(
+                psd.sigmasq_vec[template.approximant], num_bins, kmin, kmax)
+        else:
+            logging.info("...Calculating power chisq bins")
+            bins = power_chisq_bins(template, num_bins, psd, template.f_lower)
 
-        return self._bin_cache[key]
+        self._bin_cache[key] = bins
+        if len(self._bin_cache) > self.cache_size:
+            self._bin_cache.popitem(last=False)
+        return bins
+
+    def bank_chisq_bins(self, psd):
+        """ Return the PowerChisqBinTable of the bank for the given psd, or
+        None if the bins cannot be computed from psd.sigmasq_vec.
+        """
+        phash = psd_hash(psd)
+        if phash in self._bank_bins:
+            return self._bank_bins[phash]
+
+        bank = self.bank
+        key = '%s/%s/%r/%s' % (self.bank_hash(), phash, float(bank.f_lower),
+                               self.num_bins)
+        table = None
+        if self.bin_file is not None:
+            table = PowerChisqBinTable.read(self.bin_file, key)
+        if table is None:
+            table = self._compute_bank_chisq_bins(psd)
+            if table is not None and self.write_bin_file:
+                table.write(self.bin_file, key)
+
+        # The tables are not evicted, as the templates are filtered against
+        # each segment in turn and so every psd of the job is used again
+        # for the next template
+        self._bank_bins[phash] = table
+        return table
+
+    def bank_hash(self):
+        """ Return a hash identifying the templates of the bank and the
+        options used to generate them, which together with the psd determine
+        their chisq bins.
+        """
+        if self._bank_hash is None:
+            from pycbc.waveform.bank import template_hash
+            bank = self.bank
+            hashes = numpy.array([template_hash(bank.table[i])
+                                  for i in xrange(len(bank))], dtype=numpy.int64)
+            digest = hashlib.sha1(hashes.view(numpy.uint8))
+            digest.update(repr((str(bank.approximant), float(bank.delta_f),
+                                int(bank.filter_length),
+                                sorted(bank.extra_args.items()))))
+            self._bank_hash = digest.hexdigest()
+        return self._bank_hash
+
+    def _compute_bank_chisq_bins(self, psd):
+        """ Compute the chisq bins of every template in the bank at once,
+        using psd.sigmasq_vec. Returns None if this is not available for the
+        approximants of the bank.
+        """
+        import pycbc.waveform
+        from pycbc.waveform.bank import template_hash
+        bank = self.bank
+        num = len(bank)
+
+        logging.info("...Calculating power chisq bins for the bank")
+        approximants = [bank.get_approximant(i) for i in xrange(num)]
+        for approximant in set(approximants):
+            if not pycbc.waveform.waveform_norm_exists(approximant):
+                return None
+            if not hasattr(psd, 'sigmasq_vec'):
+                psd.sigmasq_vec = {}
+            if approximant not in psd.sigmasq_vec:
+                psd.sigmasq_vec[approximant] = \
+                        pycbc.waveform.get_waveform_filter_norm(approximant,
+                                psd, len(psd), psd.delta_f, bank.f_lower)
+
+        end_frequency = bank.end_frequencies(approximants)
+        kmax = (end_frequency / bank.delta_f).astype(int)
+        num_bins = numpy.zeros(num, dtype=int)
+        hashes = numpy.zeros(num, dtype=numpy.int64)
+        for i in xrange(num):
+            t = BankTemplateParams(bank.table[i], approximants[i],
+                                   bank.f_lower, end_frequency[i], kmax[i])
+            num_bins[i] = int(self.parse_option(t, self.num_bins))
+            hashes[i] = template_hash(t.params)
+
+        kmin = int(bank.f_lower / psd.delta_f)
+        offsets = numpy.concatenate([[0], (num_bins + 1).cumsum()])
+        edges = numpy.zeros(offsets[-1], dtype=int)
+        approximants = numpy.array(approximants)
+
+        # This is power_chisq_bins_from_sigmasq_series for every template
+        # with the same approximant and number of bins at once. As
+        # sigmasq_vec is not decreasing, searching sigmasq_vec[kmin:] and
+        # clipping the edges to kmax is the same as searching
+        # sigmasq_vec[kmin:kmax].
+        for approximant in numpy.unique(approximants):
+            sigmasq_vec = numpy.array(psd.sigmasq_vec[approximant])
+            for nb in numpy.unique(num_bins):
+                idx = numpy.flatnonzero((num_bins == nb) &
+                                        (approximants == approximant))
+                if not len(idx):
+                    continue
+                sigmasq = sigmasq_vec[kmax[idx] - 1]
+                edge_vec = numpy.arange(0, nb)[None, :] * sigmasq[:, None] / nb
+                bins = numpy.searchsorted(sigmasq_vec[kmin:],
+                                          edge_vec.ravel(), side='right')
+                bins = bins.reshape(len(idx), nb) + kmin
+                bins = numpy.minimum(bins, kmax[idx][:, None])
+                bins = numpy.concatenate([bins, kmax[idx][:, None]], axis=1)
+                pos = offsets[idx][:, None] + numpy.arange(nb + 1)[None, :]
+                edges[pos] = bins
+        return PowerChisqBinTable(hashes, offsets, edges)
 
     def values(self, corr, snrv, snr_norm, psd, indices, template):
         """ Calculate the chisq at points given by indices.
@@ -367,3 +638,52 @@ class SingleDetPowerChisq(object):
             return rchisq, numpy.repeat(dof, len(indices))# dof * numpy.ones_like(indices)
         else:
             return None, None
+
+    def block_values(self, corrs, snrvs, snr_norms, psd, indices, templates):
+        """ Calculate the chisq at points given by indices for several
+        templates filtered against the same data, in one kernel call.
+
+        Returns
+        -------
+        values: list of tuples
+            The (chisq, chisq_dof) of each template, as returned by values.
+        """
+        if not self.do:
+            return [(None, None)] * len(templates)
+
+        logging.info("...Doing power chisq for %s templates" % len(templates))
+
+        aboves, args = [], []
+        for corr, snrv, norm, idx, template in zip(corrs, snrvs, snr_norms,
+                                                   indices, templates):
+            above = slice(None)
+            if self.snr_threshold:
+                above = abs(snrv * norm) > self.snr_threshold
+                if not above.any():
+                    aboves.append(None)
+                    continue
+            bins = self.cached_chisq_bins(template, psd)
+            aboves.append(above)
+            args.append((corr, snrv[above], norm, bins, idx[above]))
+
+        chisqs = []
+        if len(args):
+            chisqs = power_chisq_at_points_block(*zip(*args))
+
+        values = []
+        chisqs = iter(chisqs)
+        arg_bins = iter([a[3] for a in args])
+        for above, idx in zip(aboves, indices):
+            if above is None:
+                values.append((numpy.zeros(len(idx), dtype=numpy.float32),
+                               numpy.repeat(-100, len(idx))))
+                continue
+
+            chisq = next(chisqs)
+            dof = (len(next(arg_bins)) - 1) * 2 - 2
+            if self.snr_threshold:
+                rchisq = numpy.zeros(len(idx), dtype=numpy.float32)
+                rchisq[above] = chisq
+                chisq = rchisq
+            values.append((chisq, numpy.repeat(dof, len(idx))))
+        return values
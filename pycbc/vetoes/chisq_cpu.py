@@ -23,7 +23,7 @@
 #
 import numpy, pycbc
 from pycbc.types import real_same_precision_as
-from scipy.weave import inline
+from pycbc.kernels import inline, declare
 
 if pycbc.HAVE_OMP:
     omp_libs = ['gomp']
@@ -35,18 +35,22 @@ else:
 def chisq_accum_bin_numpy(chisq, q):
     chisq += q.squared_norm()
     
-def chisq_accum_bin_inline(chisq, q):
-    
-    chisq = numpy.array(chisq.data, copy=False)
-    q = numpy.array(q.data, copy=False)
-    N = len(chisq)
-    code = """
+accum_code = """
         #pragma omp parallel for
         for (int i=0; i<N; i++){
             chisq[i] += q[i].real()*q[i].real()+q[i].imag()*q[i].imag();
         }
     """
-    inline(code, ['chisq', 'q', 'N'], 
+for _rtype in ['float', 'double']:
+    declare(accum_code, ['chisq', 'q', 'N'],
+            [_rtype + '*', 'std::complex<%s>*' % _rtype, 'int'])
+
+def chisq_accum_bin_inline(chisq, q):
+    
+    chisq = numpy.array(chisq.data, copy=False)
+    q = numpy.array(q.data, copy=False)
+    N = len(chisq)
+    inline(accum_code, ['chisq', 'q', 'N'], 
                     extra_compile_args=['-march=native -O3 -w'] + omp_flags,
                     libraries=omp_libs
           )
@@ -145,6 +149,11 @@ point_chisq_code = """
 
 point_chisq_code_single = point_chisq_code.replace('TYPE', 'float')
 point_chisq_code_double = point_chisq_code.replace('TYPE', 'double')
+for _code, _rtype in [(point_chisq_code_single, 'float'),
+                      (point_chisq_code_double, 'double')]:
+    declare(_code, ['v1', 'n', 'chisq', 'slen', 'shifts', 'bins', 'blen'],
+            ['std::complex<%s>*' % _rtype, 'int', _rtype + '*', 'int',
+             _rtype + '*', 'unsigned int*', 'int'])
 
 def shift_sum(v1, shifts, bins):
     real_type = real_same_precision_as(v1)
@@ -171,3 +180,175 @@ def shift_sum(v1, shifts, bins):
           )
           
     return  chisq
+
+block_chisq_code = """
+    // Each task sums one part of one chisq bin of one template at all of
+    // the points of that template
+    #pragma omp parallel for schedule(dynamic)
+    for (int task=0; task<ntasks; task++){
+        int b = task / nsplit;
+        int s = task % nsplit;
+        int t = bin_tmplt[b];
+        int np = pt_off[t + 1] - pt_off[t];
+        int bstart = bins[b + t];
+        int blen = bins[b + t + 1] - bstart;
+        int start = bstart + blen * s / nsplit;
+        int end = bstart + blen * (s + 1) / nsplit;
+
+        const std::complex<TYPE>* v = v1 + v_off[t];
+        const TYPE* sh = shifts + pt_off[t];
+        TYPE* outr = partr + part_off[b] + s * np;
+        TYPE* outi = parti + part_off[b] + s * np;
+
+        TYPE* pr = (TYPE*) malloc(sizeof(TYPE)*np);
+        TYPE* pi = (TYPE*) malloc(sizeof(TYPE)*np);
+        TYPE* vsr = (TYPE*) malloc(sizeof(TYPE)*np);
+        TYPE* vsi = (TYPE*) malloc(sizeof(TYPE)*np);
+
+        for (int i=0; i<np; i++){
+            pr[i] = cos(2 * 3.141592653 * sh[i] * (start) / slen);
+            pi[i] = sin(2 * 3.141592653 * sh[i] * (start) / slen);
+            vsr[i] = cos(2 * 3.141592653 * sh[i] / slen);
+            vsi[i] = sin(2 * 3.141592653 * sh[i] / slen);
+            outr[i] = 0;
+            outi[i] = 0;
+        }
+
+        TYPE t1, t2, k1, k2, k3, vs, va;
+
+        for (int j=start; j<end; j++){
+            TYPE vr = v[j].real();
+            TYPE vi = v[j].imag();
+            vs = vr + vi;
+            va = vi - vr;
+
+            for (int i=0; i<np; i++){
+                t1 = pr[i];
+                t2 = pi[i];
+
+                // Complex multiply pr[i] * v
+                k1 = vr * (t1 + t2);
+                k2 = t1 * va;
+                k3 = t2 * vs;
+
+                outr[i] += k1 - k3;
+                outi[i] += k1 + k2;
+
+                // phase shift for the next frequency sample
+                pr[i] = t1 * vsr[i] - t2 * vsi[i];
+                pi[i] = t1 * vsi[i] + t2 * vsr[i];
+            }
+        }
+
+        free(pr);
+        free(pi);
+        free(vsr);
+        free(vsi);
+    }
+
+    // Add the power of each bin to the chisq of its points
+    #pragma omp parallel for schedule(dynamic)
+    for (int t=0; t<ntmplt; t++){
+        int np = pt_off[t + 1] - pt_off[t];
+        for (int b=bin_off[t]; b<bin_off[t + 1]; b++){
+            for (int i=0; i<np; i++){
+                TYPE sr = 0;
+                TYPE si = 0;
+                for (int s=0; s<nsplit; s++){
+                    sr += partr[part_off[b] + s * np + i];
+                    si += parti[part_off[b] + s * np + i];
+                }
+                chisq[pt_off[t] + i] += sr * sr + si * si;
+            }
+        }
+    }
+"""
+
+block_chisq_code_single = block_chisq_code.replace('TYPE', 'float')
+block_chisq_code_double = block_chisq_code.replace('TYPE', 'double')
+for _code, _rtype in [(block_chisq_code_single, 'float'),
+                      (block_chisq_code_double, 'double')]:
+    declare(_code, ['v1', 'v_off', 'slen', 'shifts', 'pt_off', 'bins',
+                    'bin_off', 'bin_tmplt', 'part_off', 'partr', 'parti',
+                    'chisq', 'ntasks', 'nsplit', 'ntmplt'],
+            ['std::complex<%s>*' % _rtype, 'int64_t*', 'int', _rtype + '*',
+             'int*', 'int*', 'int*', 'int*', 'int64_t*', _rtype + '*',
+             _rtype + '*', _rtype + '*', 'int', 'int', 'int'])
+
+def _flat_rows(rows):
+    """ Return a flat array holding all of the given arrays, and the offset
+    of each one in it. If they are equally spaced views into one buffer, as
+    the rows of the correlation memory of the batched matched filter are,
+    a view of that buffer is used rather than a copy.
+    """
+    r0 = rows[0]
+    itemsize = r0.itemsize
+    ptrs = numpy.array([r.ctypes.data for r in rows], dtype=numpy.int64)
+    steps = numpy.diff(ptrs)
+
+    # The array that owns the memory of the first row
+    owner = r0
+    while isinstance(owner.base, numpy.ndarray):
+        owner = owner.base
+    start = owner.ctypes.data
+    span = int(ptrs[-1] - ptrs[0]) + len(rows[-1]) * itemsize
+
+    if (all(r.dtype == r0.dtype and r.flags['C_CONTIGUOUS'] for r in rows)
+            and owner.flags['C_CONTIGUOUS']
+            and (len(steps) == 0 or (steps[0] > 0 and (steps == steps[0]).all()
+                                     and steps[0] % itemsize == 0))
+            and ptrs[0] >= start
+            and ptrs[0] + span <= start + owner.nbytes):
+        flat = numpy.ndarray((span // itemsize,), dtype=r0.dtype,
+                             buffer=owner, offset=int(ptrs[0] - start))
+        return flat, (ptrs - ptrs[0]) // itemsize
+
+    offsets = numpy.cumsum([0] + [len(r) for r in rows[:-1]])
+    return numpy.concatenate(rows), offsets.astype(numpy.int64)
+
+def shift_sum_block(v1s, shifts, bins, num_tasks=64):
+    """ Calculate shift_sum for several correlation vectors, each with its
+    own points and bins, in a single call. The bins are split into parts so
+    that there are at least num_tasks parts to share between threads.
+    """
+    rows = [numpy.array(v.data, copy=False) for v in v1s]
+    real_type = real_same_precision_as(v1s[0])
+    slen = len(rows[0])
+    if any(len(r) != slen for r in rows):
+        raise ValueError("The correlation vectors must have the same length")
+
+    v1, v_off = _flat_rows(rows)
+    ntmplt = len(rows)
+
+    npoints = numpy.array([len(s) for s in shifts], dtype=numpy.int64)
+    nbins = numpy.array([len(b) - 1 for b in bins], dtype=numpy.int64)
+    pt_off = numpy.concatenate([[0], npoints.cumsum()]).astype(numpy.int32)
+    bin_off = numpy.concatenate([[0], nbins.cumsum()]).astype(numpy.int32)
+    shifts = numpy.concatenate(shifts).astype(real_type)
+    bins = numpy.concatenate(bins).astype(numpy.int32)
+    v_off = v_off.astype(numpy.int64)
+
+    total_bins = int(bin_off[-1])
+    nsplit = max(1, -(-num_tasks // max(total_bins, 1)))
+    ntasks = total_bins * nsplit
+
+    bin_tmplt = numpy.repeat(numpy.arange(ntmplt), nbins).astype(numpy.int32)
+    part_size = npoints[bin_tmplt] * nsplit
+    part_off = numpy.concatenate([[0], part_size.cumsum()]).astype(numpy.int64)
+    partr = numpy.zeros(part_off[-1], dtype=real_type)
+    parti = numpy.zeros(part_off[-1], dtype=real_type)
+    chisq = numpy.zeros(pt_off[-1], dtype=real_type)
+
+    if v1.dtype.name == 'complex64':
+        code = block_chisq_code_single
+    else:
+        code = block_chisq_code_double
+
+    inline(code, ['v1', 'v_off', 'slen', 'shifts', 'pt_off', 'bins',
+                  'bin_off', 'bin_tmplt', 'part_off', 'partr', 'parti',
+                  'chisq', 'ntasks', 'nsplit', 'ntmplt'],
+                    extra_compile_args=['-march=native -O3 -w'] + omp_flags,
+                    libraries=omp_libs
+          )
+
+    return [chisq[pt_off[i]:pt_off[i + 1]] for i in xrange(ntmplt)]
@@ -25,9 +25,10 @@
 """
 This module provides classes that describe banks of waveforms
 """
-import types
+import types, os
+import numpy
 import pycbc.waveform
-from pycbc.types import zeros
+from pycbc.types import zeros, Array, FrequencySeries
 from glue.ligolw import ligolw, table, lsctables, utils as ligolw_utils
 from pycbc.filter import sigmasq
 from pycbc import DYN_RANGE_FAC
@@ -57,6 +58,184 @@ def sigma_cached(self, psd):
             self._sigmasq[key] = sigmasq(self, psd, low_frequency_cutoff=self.f_lower)                    
     return self._sigmasq[key]
     
+def template_hash(params):
+    """ Return the hash used to associate triggers with their template, as
+    stored in the template_hash column of the hdf format banks and triggers.
+    """
+    return hash((numpy.float32(params.mass1), numpy.float32(params.mass2),
+                 numpy.float32(params.spin1z), numpy.float32(params.spin2z)))
+
+class TemplateCache(object):
+    """ A persistent store of frequency domain templates in an hdf file.
+
+    Templates are keyed by their template hash, approximant, delta_f,
+    f_lower, f_final, filter length, dtype and the other arguments given to
+    the waveform generator, such as the phase order and taper. Only the nonzero part of each template
+    is stored, in a contiguous dataset, so that it can be read through a
+    memory map of the file rather than through the hdf library.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the cache file.
+    write : {False, bool}, optional
+        If True, the file is created if needed and templates that are not
+        present can be added with the store method. Only one process should
+        write to a cache file at a time.
+    """
+    def __init__(self, filename, write=False):
+        import h5py
+        self.filename = filename
+        self.write = write
+        if write:
+            self.file = h5py.File(filename, 'a')
+        else:
+            self.file = h5py.File(filename, 'r')
+        self._mmap = None
+
+    @staticmethod
+    def key(params, approximant, delta_f, f_lower, f_final, length, dtype,
+            **kwds):
+        """ Return the name of the dataset holding the given template. The
+        keyword arguments are those passed on to the waveform generator.
+        """
+        import hashlib
+        args = hashlib.sha1(repr(sorted(kwds.items()))).hexdigest()
+        return '%s/%r/%r/%r/%s/%s/%s/%s' % (approximant, float(delta_f),
+                                            float(f_lower), float(f_final),
+                                            int(length),
+                                            numpy.dtype(dtype).name, args,
+                                            template_hash(params))
+
+    def __contains__(self, key):
+        return key in self.file
+
+    def _read(self, dset):
+        """ Return the data of a dataset, using a memory map of the file
+        when the cache is only being read.
+        """
+        offset = dset.id.get_offset()
+        if self.write or offset is None:
+            return dset[:]
+
+        if self._mmap is None:
+            self._mmap = numpy.memmap(self.filename, dtype=numpy.uint8,
+                                      mode='r')
+        nbytes = dset.size * dset.dtype.itemsize
+        return self._mmap[offset:offset + nbytes].view(dtype=dset.dtype)
+
+    def load(self, key, out, delta_f):
+        """ Copy a stored template into the given memory.
+
+        Parameters
+        ----------
+        key : str
+            The key of the template, as returned by the key method.
+        out : Array
+            Memory of the filter length to hold the template. It should
+            already be cleared.
+        delta_f : float
+            The frequency step of the template.
+
+        Returns
+        -------
+        htilde : FrequencySeries
+            The template, using the memory of out, with the length_in_time and
+            chirp_length attributes found when it was generated.
+        """
+        dset = self.file[key]
+        kmin = dset.attrs['kmin']
+        if dset.size:
+            out[kmin:kmin + dset.size] = Array(self._read(dset), copy=False)
+
+        htilde = FrequencySeries(out, delta_f=delta_f, copy=False)
+        for attr in ['length_in_time', 'chirp_length']:
+            setattr(htilde, attr, dset.attrs.get(attr, None))
+        return htilde
+
+    def store(self, key, htilde):
+        """ Add a template to the cache.
+        """
+        if not self.write:
+            raise ValueError("Template cache %s is read only" % self.filename)
+
+        data = htilde.numpy()
+        nonzero = numpy.flatnonzero(data)
+        kmin, kmax = (nonzero[0], nonzero[-1] + 1) if len(nonzero) else (0, 0)
+
+        dset = self.file.create_dataset(key, data=data[kmin:kmax])
+        dset.attrs['kmin'] = kmin
+        for attr in ['length_in_time', 'chirp_length']:
+            value = getattr(htilde, attr, None)
+            if value is not None:
+                dset.attrs[attr] = value
+
+    def close(self):
+        self._mmap = None
+        self.file.close()
+
+class TemplateRow(object):
+    """ The parameters of a single template of an hdf format bank, with the
+    columns of the bank as attributes.
+    """
+    # Durations that are updated when the template is generated, if they are
+    # not given by the bank
+    template_duration = 0
+    ttotal = 0
+
+    def __init__(self, **params):
+        self.__dict__.update(params)
+
+class HDFBankTable(object):
+    """ The templates of an hdf format bank, such as made by
+    pycbc_coinc_bank2hdf.
+
+    Each one dimensional dataset of the file is read as a column of
+    parameters. Row objects are only created when a template is accessed,
+    and are kept so that later updates to their attributes persist.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the bank file.
+    row_range : {None, tuple}, optional
+        The (start, stop) range of rows to read. By default all rows are read.
+    """
+    def __init__(self, filename, row_range=None):
+        import h5py
+        start, stop = row_range if row_range is not None else (0, None)
+        self.columns = {}
+        f = h5py.File(filename, 'r')
+        for name, dset in f.items():
+            if isinstance(dset, h5py.Dataset) and len(dset.shape) == 1:
+                self.columns[str(name)] = dset[start:stop]
+        f.close()
+
+        lengths = set(len(col) for col in self.columns.values())
+        if len(lengths) != 1:
+            raise ValueError("Could not find template columns of equal length "
+                             "in %s" % filename)
+        self.length = lengths.pop()
+        self._rows = {}
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("Template index out of range")
+
+        if index not in self._rows:
+            params = dict((name, col[index].item())
+                          for name, col in self.columns.items())
+            self._rows[index] = TemplateRow(**params)
+        return self._rows[index]
+
+    def get_column(self, name):
+        return self.columns[name]
+
 # dummy class needed for loading LIGOLW files
 class LIGOLWContentHandler(ligolw.LIGOLWContentHandler):
     pass
@@ -64,8 +243,10 @@ lsctables.use_in(LIGOLWContentHandler)
 
 class FilterBank(object):
     def __init__(self, filename, filter_length, delta_f, f_lower,
-                 dtype, out=None, approximant=None, **kwds):
+                 dtype, out=None, approximant=None, template_cache=None,
+                 row_range=None, **kwds):
         self.out = out
+        self.template_cache = template_cache
         self.dtype = dtype
         self.f_lower = f_lower
         self.approximant = approximant
@@ -76,11 +257,17 @@ class FilterBank(object):
         self.filter_length = filter_length
         self.kmin = int(f_lower / delta_f)
 
-        self.indoc = ligolw_utils.load_filename(
-            filename, False, contenthandler=LIGOLWContentHandler)
-        self.table = table.get_table(
-            self.indoc, lsctables.SnglInspiralTable.tableName)
-        self.extra_args = kwds  
+        if filename.endswith(('.hdf', '.h5')):
+            self.indoc = None
+            self.table = HDFBankTable(filename, row_range=row_range)
+        else:
+            self.indoc = ligolw_utils.load_filename(
+                filename, False, contenthandler=LIGOLWContentHandler)
+            self.table = table.get_table(
+                self.indoc, lsctables.SnglInspiralTable.tableName)
+            if row_range is not None:
+                self.table = self.table[row_range[0]:row_range[1]]
+        self.extra_args = kwds
 
     @staticmethod
     def parse_option(row, arg):
@@ -99,7 +286,47 @@ class FilterBank(object):
             tempout = zeros(self.filter_length, dtype=self.dtype)
         else:
             tempout = self.out
+        return self.generate_template(index, tempout)
 
+    def get_block(self, start, stop, stride=None):
+        """ Generate a contiguous block of templates.
+
+        Parameters
+        ----------
+        start : int
+            The index of the first template in the block.
+        stop : int
+            One past the index of the last template in the block. This is
+            truncated to the length of the bank.
+        stride : {None, int}, optional
+            The separation, in samples, between consecutive templates in the
+            output memory. Defaults to self.N, which is the layout expected by
+            a batched MatchedFilterControl.
+
+        Returns
+        -------
+        templates : list of FrequencySeries
+            The templates, which are views into consecutive slices of the
+            output memory if it was given.
+        """
+        stride = self.N if stride is None else stride
+        stop = min(stop, len(self))
+        if self.out is not None and len(self.out) < stride * (stop - start):
+            raise ValueError("Output memory is too small for %s templates"
+                             % (stop - start))
+
+        templates = []
+        for i, index in enumerate(xrange(start, stop)):
+            if self.out is None:
+                tempout = zeros(self.filter_length, dtype=self.dtype)
+            else:
+                tempout = self.out[i * stride:(i + 1) * stride]
+            templates.append(self.generate_template(index, tempout))
+        return templates
+
+    def get_approximant(self, index):
+        """ Return the approximant of the template at the given index.
+        """
         if self.approximant is not None:
             if 'params' in self.approximant:
                 t = type('t', (object,), {'params' : self.table[index]})
@@ -108,25 +335,80 @@ class FilterBank(object):
                 approximant = self.approximant
         else:
             raise ValueError("Reading approximant from template bank not yet supported")
+        return approximant
 
+    def end_frequency(self, index, approximant):
+        """ Return the frequency at which the template at the given index
+        ends, limited to the highest frequency of the filter.
+        """
         # Get the end of the waveform if applicable (only for SPAtmplt atm)
         f_end = pycbc.waveform.get_waveform_end_frequency(self.table[index],
                               approximant=approximant, **self.extra_args)
 
         if f_end is None or f_end >= (self.filter_length * self.delta_f):
             f_end = (self.filter_length-1) * self.delta_f
+        return f_end
+
+    def end_frequencies(self, approximants):
+        """ Return the end_frequency of every template in the bank, given
+        the approximant of each. Where the end of the approximant only
+        depends on the masses, this is computed from the mass columns of the
+        table at once.
+        """
+        from pycbc.waveform.spa_tmplt import spa_tmplt_end
+        approximants = numpy.array(approximants)
+        f_end = numpy.zeros(len(self), dtype=numpy.float64)
+        for approximant in numpy.unique(approximants):
+            idx = numpy.flatnonzero(approximants == approximant)
+            if (approximant == 'SPAtmplt' and
+                    hasattr(self.table, 'get_column') and
+                    'mass1' not in self.extra_args and
+                    'mass2' not in self.extra_args):
+                mass1 = numpy.asarray(self.table.get_column('mass1'),
+                                      dtype=numpy.float64)[idx]
+                mass2 = numpy.asarray(self.table.get_column('mass2'),
+                                      dtype=numpy.float64)[idx]
+                f_end[idx] = spa_tmplt_end(mass1=mass1, mass2=mass2)
+            else:
+                for i in idx:
+                    f_end[i] = self.end_frequency(i, str(approximant))
+
+        f_max = self.filter_length * self.delta_f
+        f_end[f_end >= f_max] = (self.filter_length-1) * self.delta_f
+        return f_end
+
+    def generate_template(self, index, tempout):
+        """ Generate the template at the given index of the bank into the
+        given memory.
+        """
+        approximant = self.get_approximant(index)
+        f_end = self.end_frequency(index, approximant)
 
         poke  = tempout.data
         # Clear the storage memory
         tempout.clear()
 
-        # Get the waveform filter
-        distance = 1.0 / DYN_RANGE_FAC
-        htilde = pycbc.waveform.get_waveform_filter(
-            tempout[0:self.filter_length], self.table[index],
-            approximant=approximant, f_lower=self.f_lower, f_final=f_end,
-            delta_f=self.delta_f, delta_t=self.delta_t, distance=distance,
-            **self.extra_args)
+        # Get the waveform filter, from the template cache if possible
+        cache_key = None
+        if self.template_cache is not None:
+            cache_key = self.template_cache.key(self.table[index],
+                                approximant, self.delta_f, self.f_lower,
+                                f_end, self.filter_length, self.dtype,
+                                **self.extra_args)
+
+        if cache_key is not None and cache_key in self.template_cache:
+            htilde = self.template_cache.load(cache_key,
+                              tempout[0:self.filter_length], self.delta_f)
+        else:
+            distance = 1.0 / DYN_RANGE_FAC
+            htilde = pycbc.waveform.get_waveform_filter(
+                tempout[0:self.filter_length], self.table[index],
+                approximant=approximant, f_lower=self.f_lower, f_final=f_end,
+                delta_f=self.delta_f, delta_t=self.delta_t, distance=distance,
+                **self.extra_args)
+
+            if cache_key is not None and self.template_cache.write:
+                self.template_cache.store(cache_key, htilde.astype(self.dtype))
 
         # If available, record the total duration (which may
         # include ringdown) and the duration up to merger since they will be 
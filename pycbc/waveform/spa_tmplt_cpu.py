@@ -19,7 +19,7 @@ import lal
 import pycbc
 from pycbc.types import Array, float32, FrequencySeries
 from pycbc.waveform.spa_tmplt import spa_tmplt_precondition
-from scipy.weave import inline
+from pycbc.kernels import inline, declare
 
 support = """
     #include <stdio.h>
@@ -68,18 +68,7 @@ def sin_cos_lookup():
     return Array(numpy.sin(vec)).astype(float32)
 sin_cos = Array([], dtype=float32)
 
-def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN, 
-                    pfa2,  pfa3,  pfa4,  pfa5,  pfl5,
-                    pfa6,  pfl6,  pfa7, amp_factor):
-    """ Calculate the spa tmplt phase 
-    """
-    kfac = numpy.array(spa_tmplt_precondition(len(htilde), delta_f, kmin).data, copy=False)
-    htilde = numpy.array(htilde.data, copy=False)
-    cbrt_vec = numpy.array(get_cbrt(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
-    logv_vec = numpy.array(get_log(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
-    length = len(htilde)
-    
-    code = """ 
+spa_code = """ 
     float piM13 = cbrtf(piM);
     float logpiM13 = log(piM13);
     float log4 = log(4.);
@@ -188,11 +177,29 @@ def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN,
         
         htilde[i] = std::complex<float>(cosp, - sinp) * amp;
     }
+"""
+spa_args = ['htilde', 'cbrt_vec', 'logv_vec', 'kmin', 'phase_order',
+            'piM',  'pfaN', 'amp_factor', 'kfac',
+            'pfa2',  'pfa3',  'pfa4',  'pfa5',  'pfl5',
+            'pfa6',  'pfl6',  'pfa7', 'length']
+declare(spa_code, spa_args,
+        ['std::complex<float>*', 'float*', 'float*', 'int', 'int',
+         'double', 'double', 'double', 'float*',
+         'double', 'double', 'double', 'double', 'double',
+         'double', 'double', 'double', 'int'], support_code=support)
+
+def spa_tmplt_engine(htilde,  kmin,  phase_order, delta_f, piM,  pfaN, 
+                    pfa2,  pfa3,  pfa4,  pfa5,  pfl5,
+                    pfa6,  pfl6,  pfa7, amp_factor):
+    """ Calculate the spa tmplt phase 
     """
-    inline(code, ['htilde', 'cbrt_vec', 'logv_vec', 'kmin', 'phase_order', 
-                   'piM',  'pfaN', 'amp_factor', 'kfac',
-                   'pfa2',  'pfa3',  'pfa4',  'pfa5',  'pfl5',
-                   'pfa6',  'pfl6',  'pfa7', 'length'],
+    kfac = numpy.array(spa_tmplt_precondition(len(htilde), delta_f, kmin).data, copy=False)
+    htilde = numpy.array(htilde.data, copy=False)
+    cbrt_vec = numpy.array(get_cbrt(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
+    logv_vec = numpy.array(get_log(len(htilde)*delta_f + kmin, delta_f).data, copy=False)
+    length = len(htilde)
+    
+    inline(spa_code, spa_args,
                     extra_compile_args=['-march=native -O3 -w'] + omp_flags,
                     support_code = support,
                     libraries=omp_libs
@@ -32,6 +32,7 @@ except:
 from distutils.errors import DistutilsError
 from distutils.core import setup, Command, Extension
 from distutils.command.clean import clean as _clean
+from distutils.command.build import build as _build
 from distutils.file_util import write_file
 from distutils.version import LooseVersion
 
@@ -97,7 +98,8 @@ def find_package_data(dirname):
 class clean(_clean):
     def finalize_options (self):
         _clean.finalize_options(self)
-        self.clean_files = []
+        self.clean_files = ['pycbc/libpycbc_kernels.so',
+                            'pycbc/libpycbc_kernels.so.cpuflags']
         self.clean_folders = ['docs/_build']
     def run(self):
         _clean.run(self)
@@ -133,6 +135,43 @@ class install(_install):
 
         _install.run(self)
 
+# Compile the CPU kernels ahead of time, so that they do not need to be
+# compiled by scipy.weave when first used
+class build_kernels(Command):
+    user_options = [('inplace', 'i', "put the kernel library in the source "
+                                     "directory rather than the build one")]
+    description = "compile the CPU kernels into a shared library"
+    boolean_options = ['inplace']
+    def initialize_options(self):
+        self.inplace = False
+        self.build_lib = None
+    def finalize_options(self):
+        self.set_undefined_options('build', ('build_lib', 'build_lib'))
+    def run(self):
+        if self.inplace:
+            lib_dir = os.path.abspath('.')
+        else:
+            self.run_command('build_py')
+            lib_dir = os.path.abspath(self.build_lib)
+
+        path = os.path.join(lib_dir, 'pycbc', 'libpycbc_kernels.so')
+        env = os.environ.copy()
+        if 'PYTHONPATH' in env:
+            env['PYTHONPATH'] = lib_dir + ":" + env['PYTHONPATH']
+        else:
+            env['PYTHONPATH'] = lib_dir
+
+        cmd = [sys.executable, '-c', 'import pycbc.kernels; '
+               'pycbc.kernels.build_library(%r)' % path]
+        try:
+            subprocess.check_call(cmd, env=env, cwd=lib_dir)
+        except (subprocess.CalledProcessError, OSError):
+            print ("WARNING: the CPU kernels could not be compiled, they will "
+                   "be compiled by scipy.weave when they are first used")
+
+class build(_build):
+    sub_commands = _build.sub_commands + [('build_kernels', None)]
+
 def do_setup(*args):
     return True
 
@@ -325,6 +364,8 @@ cmdclass = { 'test'  : test,
              'build_gh_pages' : build_gh_pages,
              'build_docs_test' : build_docs_test,
              'install' : install,
+             'build' : build,
+             'build_kernels' : build_kernels,
              'test_cpu':test_cpu,
              'test_cuda':test_cuda,
              'clean' : clean,
@@ -367,6 +408,7 @@ setup (
                'bin/pycbc_aligned_stoch_bank',
                'bin/pycbc_make_faithsim',
                'bin/pycbc_get_ffinal',
+               'bin/pycbc_make_template_cache',
                'bin/pycbc_timeslides',
                'bin/pycbc_sqlite_simplify',
                'bin/pycbc_calculate_far',
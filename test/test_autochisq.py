@@ -16,6 +16,49 @@ import time
 
 _scheme, _context = parse_args_all_schemes("Auto Chi-squared Veto")
 
+def autochisq_loop(sn, corr_sn, hautocorr, indices, stride, num_points,
+                   oneside, twophase, maxvalued):
+    """ The auto-chisq computed one index at a time, as it was before being
+    vectorized, to compare against.
+    """
+    Nsnr = len(sn)
+    achisq = np.zeros(len(indices))
+    start_point = - stride*num_points
+    end_point = stride*num_points+1
+    if oneside == 'left':
+        achisq_idx_list = np.arange(start_point, 0, stride)
+    elif oneside == 'right':
+        achisq_idx_list = np.arange(stride, end_point, stride)
+    else:
+        achisq_idx_list = np.append(np.arange(start_point, 0, stride),
+                                    np.arange(stride, end_point, stride))
+
+    hauto_corr_vec = hautocorr[achisq_idx_list]
+    hauto_norm = hauto_corr_vec.real*hauto_corr_vec.real
+    hauto_norm += hauto_corr_vec.imag*hauto_corr_vec.imag
+    chisq_norm = 1.0 - hauto_norm
+
+    for ip, ind in enumerate(indices):
+        idx = achisq_idx_list + ind
+        idx[idx < 0] += Nsnr
+        idx[idx > (Nsnr - 1)] -= Nsnr
+
+        snrabs = abs(sn[ind])
+        cphi = sn[ind].real / snrabs
+        sphi = sn[ind].imag / snrabs
+        snr_ind = sn[ind].real*cphi + sn[ind].imag*sphi
+
+        z = corr_sn[idx].real*cphi + corr_sn[idx].imag*sphi
+        dz = z - hauto_corr_vec.real*snr_ind
+        curr = dz*dz/chisq_norm
+        if twophase:
+            z = -corr_sn[idx].real*sphi + corr_sn[idx].imag*cphi
+            dz = z - hauto_corr_vec.imag*snr_ind
+            curr += dz*dz/chisq_norm
+
+        achisq[ip] = curr.max() if maxvalued else curr.sum()
+    return achisq
+
 
 class TestAutochisquare(unittest.TestCase):
     def setUp(self):
@@ -182,7 +225,54 @@ class TestAutochisquare(unittest.TestCase):
 	#   self.assertTrue(achi_list[i,2] > 2.e3)
  
 
-         
+    def test_autochisq_from_taps(self):
+        np.random.seed(1234)
+        n = 1000
+        sn = np.random.normal(size=n) + 1.0j * np.random.normal(size=n)
+        corr_sn = sn + 0.1 * (np.random.normal(size=n) +
+                              1.0j * np.random.normal(size=n))
+        hautocorr = 0.5 * (np.random.uniform(size=n) +
+                           1.0j * np.random.uniform(size=n))
+        # Include indices whose points wrap around both ends
+        indices = np.array([0, 3, 17, 500, 501, 980, 999])
+
+        for oneside in [None, 'left', 'right']:
+            for twophase in [False, True]:
+                for maxvalued in [False, True]:
+                    offsets, num_points = autochisq_offsets(n, 3, 10, oneside)
+                    achisq = autochisq_from_taps(sn, corr_sn,
+                                   hautocorr[offsets], offsets, indices,
+                                   twophase=twophase, maxvalued=maxvalued,
+                                   block_size=3)
+                    expected = autochisq_loop(sn, corr_sn, hautocorr,
+                                   indices, 3, num_points, oneside,
+                                   twophase, maxvalued)
+                    self.assertTrue(np.allclose(achisq, expected,
+                                                rtol=1e-12, atol=0))
+
+    def test_autocorrelation_cache(self):
+        np.random.seed(1234)
+        psd = FrequencySeries(self.Psd, delta_f=self.htilde.delta_f)
+        n = self.seg_len_idx
+        sn = TimeSeries(np.random.normal(size=n) +
+                        1.0j * np.random.normal(size=n), delta_t=self.del_t)
+        indices = np.array([0, 100, 5000, n - 1])
+        autochisq = SingleDetAutoChisq(4, 20)
+
+        def cached_autocor():
+            self.assertEqual(len(autochisq._autocor), 1)
+            return list(autochisq._autocor.values())[0][2]
+
+        # A second segment with the same template and psd reuses the
+        # autocorrelation of the first
+        first = autochisq.values(sn, indices, self.htilde, psd, 1.0,
+                                 low_frequency_cutoff=self.low_frequency_cutoff)
+        autocor = cached_autocor()
+        second = autochisq.values(sn, indices, self.htilde, psd, 1.0,
+                                  low_frequency_cutoff=self.low_frequency_cutoff)
+        self.assertTrue(cached_autocor() is autocor)
+        self.assertTrue(np.allclose(first, second, rtol=1e-12, atol=0))
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestAutochisquare))
 
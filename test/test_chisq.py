@@ -36,6 +36,12 @@ _scheme, _context = parse_args_all_schemes("correlate")
 
 from pycbc.vetoes.chisq_cpu import chisq_accum_bin_numpy
 from pycbc.vetoes import chisq_accum_bin
+from pycbc.vetoes.chisq import power_chisq_at_points_block, \
+                               power_chisq_at_points_from_precomputed
+from pycbc.vetoes.bank_chisq import template_overlaps, \
+                                    bank_chisq_from_filters, \
+                                    batch_template_overlaps, batch_bank_chisq
+from pycbc.filter import sigmasq
 trusted_accum = chisq_accum_bin_numpy
 
 class TestChisq(unittest.TestCase):
@@ -56,7 +62,214 @@ class TestChisq(unittest.TestCase):
             for i in range(0, 4):
                 chisq_accum_bin(z, self.x)
             self.assertTrue(self.z.almost_equal_elem(z, self.tolerance))
-            
+
+    def test_point_chisq_block(self):
+        with self.context:
+            corrs = [self.x[i * 4096:(i + 1) * 4096] for i in range(3)]
+            snrs = [numpy.random.normal(size=n) + 1.0j for n in (1, 5, 2)]
+            norms = [1.0, 0.5, 2.0]
+            bins = [[10, 500, 1200, 4000], [5, 100, 2000], [0, 4096]]
+            indices = [numpy.random.randint(0, 4096, size=len(s))
+                       for s in snrs]
+
+            block = power_chisq_at_points_block(corrs, snrs, norms, bins,
+                                                indices)
+            for args, chisq in zip(zip(corrs, snrs, norms, bins, indices),
+                                   block):
+                single = power_chisq_at_points_from_precomputed(*args)
+                self.assertTrue(numpy.allclose(chisq, single, rtol=1e-4))
+
+    if _scheme == 'cpu':
+        def test_flat_rows_no_copy(self):
+            from pycbc.vetoes.chisq_cpu import _flat_rows, shift_sum, \
+                                               shift_sum_block
+            tlen, ntmplt = 4096, 3
+            mem = zeros(tlen * ntmplt, dtype=complex64)
+            mem.data[:] = self.x[:tlen * ntmplt].numpy()
+            corrs = [mem[i * tlen:(i + 1) * tlen] for i in range(ntmplt)]
+            rows = [numpy.array(c.data, copy=False) for c in corrs]
+
+            # Views of the batched memory are used in place
+            flat, offsets = _flat_rows(rows)
+            self.assertEqual(flat.ctypes.data, mem.ptr)
+            self.assertTrue(numpy.may_share_memory(flat, mem.numpy()))
+            self.assertEqual(list(offsets), [0, tlen, 2 * tlen])
+
+            # Separately allocated vectors are copied
+            copies = [r.copy() for r in rows]
+            flat, offsets = _flat_rows(copies)
+            self.assertFalse(any(numpy.may_share_memory(flat, r)
+                                 for r in copies))
+            self.assertEqual(list(offsets), [0, tlen, 2 * tlen])
+
+            shifts = [numpy.random.uniform(0, 1, size=n) for n in (2, 4, 1)]
+            bins = [[10, 500, 1200, 4000], [5, 100, 2000], [0, 4096]]
+            block = shift_sum_block(corrs, shifts, bins)
+            for c, s, b, chisq in zip(corrs, shifts, bins, block):
+                single = shift_sum(c, s, b)
+                self.assertTrue(numpy.allclose(chisq, single, rtol=1e-4))
+
+        def test_batch_bank_chisq(self):
+            class Params(object):
+                def __init__(self, mass1, mass2):
+                    self.mass1, self.mass2 = mass1, mass2
+
+            def random_filter(mass1, mass2, data=None):
+                if data is None:
+                    data = numpy.random.normal(size=flen) + \
+                           1.0j * numpy.random.normal(size=flen)
+                htilde = FrequencySeries(data, delta_f=delta_f,
+                                         dtype=complex64)
+                htilde.params = Params(mass1, mass2)
+                htilde.sigmasq = lambda psd, h=htilde: sigmasq(h, psd,
+                                                  low_frequency_cutoff=flow)
+                return htilde
+
+            tlen, delta_f, flow = 4096, 0.25, 20.0
+            flen = tlen / 2 + 1
+            psd = FrequencySeries(numpy.random.uniform(1, 2, size=flen),
+                                  delta_f=delta_f, dtype=float32)
+            template = random_filter(10.0, 10.0)
+
+            # The last bank filter is the template itself, so its overlap is
+            # above 0.99 and it adds the expected value instead
+            filters = [random_filter(1.4 * (i + 1), 1.4) for i in range(5)]
+            filters.append(random_filter(10.0, 10.0, template.numpy()))
+            rows = numpy.array([f.numpy() for f in filters])
+            sigmasqs = numpy.array([f.sigmasq(psd) for f in filters])
+            params = [f.params for f in filters]
+
+            overlaps = template_overlaps(filters, template, psd, flow)
+            batch_overlaps = batch_template_overlaps(rows, sigmasqs, params,
+                                                     template, psd, flow)
+            self.assertTrue(abs(overlaps[-1]) > 0.99)
+            self.assertTrue(numpy.allclose(batch_overlaps, overlaps,
+                                           rtol=1e-5))
+
+            def random_snr():
+                data = numpy.random.normal(size=tlen) + \
+                       1.0j * numpy.random.normal(size=tlen)
+                return TimeSeries(data, delta_t=1.0 / 4096, dtype=complex64)
+
+            snr = random_snr()
+            bank_snrs = [random_snr() for f in filters]
+            bank_rows = numpy.array([b.numpy() for b in bank_snrs])
+            norm = 0.5
+            bank_norms = numpy.random.uniform(0.5, 2, size=len(filters))
+
+            chisq = bank_chisq_from_filters(snr, norm, bank_snrs, bank_norms,
+                                            overlaps)
+            batch = batch_bank_chisq(snr, norm, bank_rows, bank_norms,
+                                     overlaps)
+            self.assertTrue(numpy.allclose(batch.numpy(), chisq.numpy(),
+                                           rtol=1e-4))
+            self.assertEqual(batch.delta_t, chisq.delta_t)
+
+            indices = numpy.random.randint(0, tlen, size=50)
+            snrv = Array(snr.numpy()[indices], copy=False)
+            chisq = bank_chisq_from_filters(snrv, norm, bank_snrs,
+                                            bank_norms, overlaps, indices)
+            batch = batch_bank_chisq(snrv, norm, bank_rows, bank_norms,
+                                     overlaps, indices)
+            self.assertTrue(numpy.allclose(batch.numpy(), chisq.numpy(),
+                                           rtol=1e-4))
+
+        def test_bank_veto_batch(self):
+            import os, shutil, tempfile, h5py
+            from pycbc.waveform import FilterBank
+            from pycbc.vetoes.bank_chisq import SingleDetBankVeto, segment_snrs
+
+            tmpdir = tempfile.mkdtemp()
+            try:
+                bank_file = os.path.join(tmpdir, 'bank.hdf')
+                f = h5py.File(bank_file, 'w')
+                f['mass1'] = numpy.array([1.4, 3.0, 10.0])
+                f['mass2'] = numpy.array([1.3, 1.4, 5.0])
+                f['spin1z'] = numpy.array([0.0, 0.2, -0.3])
+                f['spin2z'] = numpy.array([0.0, 0.0, 0.1])
+                f.close()
+
+                flen, delta_f, flow = 2049, 1.0 / 16, 30.0
+                veto = SingleDetBankVeto(bank_file, flen, delta_f, flow,
+                                         complex64, approximant='SPAtmplt')
+                self.assertTrue(veto.batch)
+                self.assertEqual(len(veto.filters), 3)
+
+                # The template is the second bank filter, so its overlap
+                # with that filter is above 0.99
+                bank = FilterBank(bank_file, flen, delta_f, flow,
+                                  dtype=complex64, approximant='SPAtmplt')
+                template = bank[1]
+                psd = FrequencySeries(numpy.random.uniform(1, 2, size=flen),
+                                      delta_f=delta_f, dtype=float32)
+                data = numpy.random.normal(size=flen) + \
+                       1.0j * numpy.random.normal(size=flen)
+                stilde = FrequencySeries(data, delta_f=delta_f,
+                                         dtype=complex64)
+                indices = numpy.random.randint(0, (flen - 1) * 2, size=20)
+                snrv = Array(numpy.random.normal(size=20) + 1.0j,
+                             dtype=complex64)
+
+                chisq, dof = veto.values(template, psd, stilde, snrv, 0.5,
+                                         indices)
+                self.assertEqual(list(dof), [6] * 20)
+
+                filters = list(bank)
+                snrs, norms = segment_snrs(filters, stilde, psd, flow)
+                overlaps = template_overlaps(filters, template, psd, flow)
+                self.assertTrue(abs(overlaps[1]) > 0.99)
+                expected = bank_chisq_from_filters(snrv, 0.5, snrs, norms,
+                                                   overlaps, indices)
+                self.assertTrue(numpy.allclose(chisq.numpy(),
+                                               expected.numpy(), rtol=1e-4))
+            finally:
+                shutil.rmtree(tmpdir)
+
+        def test_bank_chisq_bins(self):
+            import os, shutil, tempfile, h5py
+            from pycbc.waveform import FilterBank
+            from pycbc.vetoes.chisq import SingleDetPowerChisq
+            from pycbc.waveform.bank import template_hash
+
+            tmpdir = tempfile.mkdtemp()
+            try:
+                bank_file = os.path.join(tmpdir, 'bank.hdf')
+                f = h5py.File(bank_file, 'w')
+                f['mass1'] = numpy.array([1.4, 3.0, 10.0, 50.0])
+                f['mass2'] = numpy.array([1.3, 1.4, 5.0, 50.0])
+                f['spin1z'] = numpy.array([0.0, 0.2, -0.3, 0.0])
+                f['spin2z'] = numpy.array([0.0, 0.0, 0.1, 0.0])
+                f.close()
+
+                flen, delta_f, flow = 2049, 1.0 / 16, 30.0
+                bank = FilterBank(bank_file, flen, delta_f, flow,
+                                  dtype=complex64, approximant='SPAtmplt')
+                approximants = [bank.get_approximant(i)
+                                for i in range(len(bank))]
+                end_frequencies = [bank.end_frequency(i, a)
+                                   for i, a in enumerate(approximants)]
+                self.assertTrue(numpy.allclose(
+                    bank.end_frequencies(approximants), end_frequencies,
+                    rtol=1e-12))
+
+                # The psd is infinite below 60 Hz, so the sigmasq series of
+                # the heaviest template is zero up to past its end
+                psd = numpy.random.uniform(1, 2, size=flen)
+                psd[:int(60 / delta_f)] = numpy.inf
+                psd = FrequencySeries(psd, delta_f=delta_f, dtype=float32)
+
+                num_bins = '4 if params.mass1 > 5 else 8'
+                table = SingleDetPowerChisq(num_bins, bank=bank
+                                            ).bank_chisq_bins(psd)
+                single = SingleDetPowerChisq(num_bins)
+                for template in bank:
+                    bins = table.get(template_hash(template.params))
+                    expected = single.cached_chisq_bins(template, psd)
+                    self.assertEqual(list(bins), list(expected))
+                    self.assertTrue(max(bins) <= template.end_idx)
+            finally:
+                shutil.rmtree(tmpdir)
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestChisq))
 
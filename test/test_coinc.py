@@ -0,0 +1,150 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the pycbc.events.coinc module
+"""
+import unittest
+import numpy
+from pycbc.events import coinc
+from utils import parse_args_cpu_only, simple_exit
+
+parse_args_cpu_only("Coincidence")
+
+class TestCoinc(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1234)
+
+    def brute_force_coincidence(self, t1, t2, window, slide_step):
+        """ Pair every trigger of t1 with every trigger of t2 and keep those
+        within the window, in any timeslide.
+        """
+        if slide_step:
+            fold1, fold2 = t1 % slide_step, t2 % slide_step
+            shifts = [-slide_step, 0, slide_step]
+        else:
+            fold1, fold2 = t1, t2
+            shifts = [0]
+
+        pairs = []
+        for i in range(len(t1)):
+            for j in range(len(t2)):
+                for shift in shifts:
+                    t = fold2[j] + shift
+                    if fold1[i] - window <= t < fold1[i] + window:
+                        if slide_step:
+                            slide = int(numpy.rint(t1[i] / slide_step -
+                                                   t2[j] / slide_step))
+                        else:
+                            slide = 0
+                        pairs.append((i, j, slide))
+        return sorted(pairs)
+
+    def test_time_coincidence(self):
+        for slide_step in [0, 0.1, 5.0]:
+            t1 = numpy.random.uniform(0, 100, size=300)
+            t2 = numpy.random.uniform(0, 100, size=200)
+            window = 0.02
+            idx1, idx2, slide = coinc.time_coincidence(t1, t2, window,
+                                                       slide_step)
+            pairs = sorted(zip(idx1.tolist(), idx2.tolist(), slide.tolist()))
+            self.assertEqual(pairs,
+                self.brute_force_coincidence(t1, t2, window, slide_step))
+
+        # Triggers without coincidences
+        idx1, idx2, slide = coinc.time_coincidence(numpy.array([1.0]),
+                                                   numpy.array([]), 0.01, 0.1)
+        self.assertEqual(len(idx1), 0)
+        self.assertEqual(len(idx2), 0)
+
+    def numpy_cluster_coincs(self, stat, time1, time2, timeslide_id, slide,
+                             window):
+        """ The previous pure numpy implementation of cluster_coincs, which
+        offsets the timeslides from each other in extended precision.
+        """
+        if numpy.isfinite(slide):
+            time = (time2 + (time1 + timeslide_id * slide)) / 2
+        else:
+            time = 0.5 * (time2 + time1)
+
+        tslide = timeslide_id.astype(numpy.float128)
+        time = time.astype(numpy.float128)
+        span = (time.max() - time.min()) + window * 10
+        time = time + span * tslide
+
+        time_sorting = time.argsort()
+        stat = stat[time_sorting]
+        time = time[time_sorting]
+        left = numpy.searchsorted(time, time - window)
+        right = numpy.searchsorted(time, time + window)
+        indices = numpy.zeros(len(left), dtype=numpy.uint32)
+
+        i = 0
+        j = 0
+        while i < len(left):
+            l = left[i]
+            r = right[i]
+            if (r - l) == 1:
+                indices[j] = i
+                j += 1
+                i += 1
+                continue
+
+            max_loc = stat[l:r].argmax() + l
+            if max_loc == i:
+                indices[j] = i
+                i = r
+                j += 1
+            elif max_loc > i:
+                i = max_loc
+            elif max_loc < i:
+                i += 1
+
+        return time_sorting[indices[:j]]
+
+    def test_cluster_coincs(self):
+        num = 5000
+        slide = 0.1
+        for window, num_slides in [(10.0, 20), (1.0, 200), (100.0, 5)]:
+            time1 = 1e9 + numpy.random.uniform(0, 10000, size=num)
+            time2 = time1 + numpy.random.normal(0, 0.005, size=num)
+            slide_id = numpy.random.randint(-num_slides, num_slides + 1,
+                                            size=num)
+            time1 -= slide_id * slide
+            stat = numpy.random.chisquare(2, size=num).astype(numpy.float32)
+
+            for step in [slide, numpy.inf]:
+                args = (stat, time1, time2, slide_id, step, window)
+                cindex = coinc.cluster_coincs(*args)
+                self.assertEqual(cindex.tolist(),
+                                 self.numpy_cluster_coincs(*args).tolist())
+
+        # No coincidences
+        empty = numpy.array([])
+        self.assertEqual(len(coinc.cluster_coincs(empty, empty, empty, empty,
+                                                  slide, 10.0)), 0)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestCoinc))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
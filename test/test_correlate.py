@@ -58,7 +58,27 @@ class Testcorrelate(unittest.TestCase):
             z = zeros(2**20, dtype=complex64)
             correlate(self.x, self.y, z)
             self.assertTrue(self.z.almost_equal_elem(z, self.tolerance))
-            
+
+    def test_batch_correlate(self):
+        if self.scheme != 'cpu':
+            return
+        size, nbatch = 2**12, 4
+        kmin, kmax = 10, 2**11 + 1
+        with self.context:
+            xb = Array(self.x[0:size * nbatch], copy=True)
+            y = Array(self.y[0:size], copy=True)
+            z = zeros(size * nbatch, dtype=complex64)
+            corr = BatchCorrelator(xb, y, z, size, nbatch, kmin, kmax)
+            corr.correlate()
+
+        for i in range(nbatch):
+            x = xb[i * size + kmin:i * size + kmax]
+            zt = zeros(kmax - kmin, dtype=complex64)
+            trusted_correlate(x, y[kmin:kmax], zt)
+            self.assertTrue(zt.almost_equal_elem(
+                            z[i * size + kmin:i * size + kmax], self.tolerance))
+            self.assertEqual(abs(z[i * size:i * size + kmin]).max(), 0)
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(Testcorrelate))
 
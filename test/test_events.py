@@ -0,0 +1,146 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the cuts of pycbc.events.EventManager
+"""
+import unittest
+import numpy
+from pycbc.events import EventManager, newsnr
+from utils import parse_args_cpu_only, simple_exit
+
+parse_args_cpu_only("Event cuts")
+
+class Options(object):
+    chisq_bins = '16'
+
+class TestEventCuts(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1234)
+        num = 2000
+        names = ['time_index', 'snr', 'chisq', 'chisq_dof']
+        types = [int, numpy.complex64, numpy.float32, int]
+        self.event_mgr = EventManager(Options(), names, types)
+
+        events = numpy.zeros(num, dtype=self.event_mgr.event_dtype)
+        # The template id identifies each event in the comparisons
+        events['template_id'] = numpy.arange(num)
+        events['time_index'] = numpy.random.randint(0, 100000, size=num)
+        events['snr'] = (numpy.random.uniform(4, 20, size=num) *
+                         numpy.exp(1j * numpy.random.uniform(0, 6, size=num)))
+        events['chisq'] = numpy.random.uniform(0, 100, size=num)
+        events['chisq_dof'] = 2 * numpy.random.randint(1, 16, size=num) - 2
+
+        # Events whose statistics are nan, in separate intervals so that the
+        # order of the kept events does not depend on how ties are sorted
+        events['snr'][:10] = numpy.nan
+        events['time_index'][:10] = numpy.arange(10) * 10000 + 5
+        events['chisq'][10:20] = numpy.nan
+        events['chisq'][20:30] = 0
+        events['chisq_dof'][20:30] = 0
+        self.events = events
+        self.event_mgr.events = events.copy()
+
+    def loop_chisq_threshold(self, value, delta):
+        remove = []
+        for i, event in enumerate(self.events):
+            xi = event['chisq'] / (event['chisq_dof'] / 2 + 1 + delta *
+                                   event['snr'].conj() * event['snr'])
+            if xi > value:
+                remove.append(i)
+        return numpy.delete(self.events, remove)
+
+    def loop_newsnr_threshold(self, threshold):
+        remove = [i for i, e in enumerate(self.events) if \
+            newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof']) < threshold]
+        return numpy.delete(self.events, remove)
+
+    def loop_keep_loudest_in_interval(self, window, num_keep):
+        e = self.events
+        stat = newsnr(abs(e['snr']), e['chisq'] / e['chisq_dof'])
+        wtime = (e['time_index'] / window).astype(numpy.int32)
+        keep = []
+        for b in numpy.unique(wtime):
+            bloc = numpy.where((wtime == b))[0]
+            bloudest = stat[bloc].argsort()[-num_keep:]
+            keep.append(bloc[bloudest])
+        return e[numpy.concatenate(keep)]
+
+    def assertSameEvents(self, expected):
+        numpy.testing.assert_array_equal(self.event_mgr.events['template_id'],
+                                         expected['template_id'])
+
+    def test_chisq_threshold(self):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            for value, delta in [(2.0, 0), (4.0, 0), (2.0, 0.1)]:
+                self.event_mgr.events = self.events.copy()
+                self.event_mgr.chisq_threshold(value, 16, delta=delta)
+                self.assertSameEvents(self.loop_chisq_threshold(value, delta))
+
+    def test_newsnr_threshold(self):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            for threshold in [5.0, 8.0]:
+                self.event_mgr.events = self.events.copy()
+                self.event_mgr.newsnr_threshold(threshold)
+                self.assertSameEvents(self.loop_newsnr_threshold(threshold))
+
+        # No events and a single event
+        self.event_mgr.events = self.events[:0]
+        self.event_mgr.newsnr_threshold(5.0)
+        self.assertEqual(len(self.event_mgr.events), 0)
+        self.event_mgr.events = self.events[100:101]
+        self.event_mgr.newsnr_threshold(0.0)
+        self.assertEqual(len(self.event_mgr.events), 1)
+
+    def test_keep_loudest_in_interval(self):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            for window, num_keep in [(1000, 1), (1000, 3), (10, 2),
+                                     (10000.5, 5)]:
+                self.event_mgr.events = self.events.copy()
+                self.event_mgr.keep_loudest_in_interval(window, num_keep)
+                expected = self.loop_keep_loudest_in_interval(window,
+                                                              num_keep)
+                self.assertSameEvents(expected)
+
+    def test_apply_cut(self):
+        e = self.events
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            self.event_mgr.apply_cut("(abs(snr) > 6) & "
+                                     "(chisq / chisq_dof < 2)")
+            keep = (abs(e['snr']) > 6) & (e['chisq'] / e['chisq_dof'] < 2)
+        self.assertSameEvents(e[keep])
+
+        self.event_mgr.events = e.copy()
+        self.event_mgr.apply_cut("time_index % 2 == 0")
+        self.assertSameEvents(e[e['time_index'] % 2 == 0])
+
+        self.event_mgr.events = e.copy()
+        self.event_mgr.apply_cut("True")
+        self.assertSameEvents(e)
+
+        self.assertRaises(ValueError, self.event_mgr.apply_cut, "abs(snr)")
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestEventCuts))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
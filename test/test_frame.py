@@ -132,6 +132,51 @@ class FrameTestBase(unittest.TestCase):
                           'channel1', start_time=self.epoch+1, 
                           end_time=self.epoch)
 
+    def test_frame_cache(self):
+        import os.path, shutil, tempfile
+        filename = "data/frametest" + str(self.data1.dtype) + ".gwf"
+        if not os.path.exists(filename):
+            filename =  "test/" + filename
+
+        tmpdir = tempfile.mkdtemp()
+        # The cache directory is created when it is first used
+        cache_dir = os.path.join(tmpdir, 'cache')
+        try:
+            start = self.epoch+10
+            end = self.epoch+50
+            startind = int(10/self.delta_t)
+            endind = int(50/self.delta_t)
+
+            # The first read fills the cache and the second is served from it
+            for i in range(2):
+                ts = pycbc.frame.read_frame(filename, ['channel1', 'channel2'],
+                                            start_time=start, end_time=end,
+                                            cache_dir=cache_dir)
+                self.assertEqual(ts[0], self.expected_data1[startind:endind])
+                self.assertEqual(ts[1], self.expected_data2[startind:endind])
+                self.assertEqual(ts[0].start_time, start)
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # Data served from the cache can be modified without changing it
+            ts[0].numpy()[:] = 0
+            ts = pycbc.frame.read_frame(filename, 'channel1',
+                                        cache_dir=cache_dir)
+            self.assertEqual(ts, self.expected_data1)
+
+            # Only the newest entry is kept when the cache is over its limit
+            shutil.rmtree(cache_dir)
+            os.environ['PYCBC_FRAME_CACHE_SIZE'] = '0'
+            try:
+                ts = pycbc.frame.read_frame(filename, ['channel1', 'channel2'],
+                                            cache_dir=cache_dir)
+            finally:
+                del os.environ['PYCBC_FRAME_CACHE_SIZE']
+            self.assertEqual(ts[0], self.expected_data1)
+            self.assertEqual(ts[1], self.expected_data2)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
 # We take a factory approach so we can test all possible dtypes we support
 TestClasses = []
 types = [numpy.float32, numpy.float64, numpy.complex64, numpy.complex128]
@@ -0,0 +1,118 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the DictArray class of the pycbc.io.hdf module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import h5py
+from pycbc.io.hdf import DictArray
+from utils import parse_args_cpu_only, simple_exit
+
+parse_args_cpu_only("DictArray")
+
+class TestDictArray(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1234)
+        self.tmpdir = tempfile.mkdtemp()
+        self.stat1 = numpy.random.normal(size=50)
+        self.stat2 = numpy.random.normal(size=30)
+        self.time1 = numpy.arange(50, dtype=numpy.float64)
+        self.time2 = numpy.arange(50, 80, dtype=numpy.float64)
+
+        # The first file is stored contiguously, so that it is memory mapped,
+        # and the second is chunked and compressed, so that it is read
+        self.files = [os.path.join(self.tmpdir, 'a.hdf'),
+                      os.path.join(self.tmpdir, 'b.hdf')]
+        f = h5py.File(self.files[0], 'w')
+        f['stat'] = self.stat1
+        f['time'] = self.time1
+        f.close()
+        f = h5py.File(self.files[1], 'w')
+        f.create_dataset('stat', data=self.stat2, chunks=True,
+                         compression='gzip')
+        f.create_dataset('time', data=self.time2, chunks=True,
+                         compression='gzip')
+        f.close()
+
+        self.stat = numpy.concatenate([self.stat1, self.stat2])
+        self.time = numpy.concatenate([self.time1, self.time2])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_files(self):
+        d = DictArray(files=self.files, groups=['stat', 'time'])
+        self.assertEqual(len(d), 80)
+        self.assertEqual(sorted(d.data.keys()), ['stat', 'time'])
+        numpy.testing.assert_array_equal(d.stat, self.stat)
+        numpy.testing.assert_array_equal(d.data['time'], self.time)
+
+        # Columns that cannot be memory mapped are not kept in memory
+        pieces = d._store.pieces('stat')
+        self.assertTrue(isinstance(pieces[0], numpy.memmap))
+        self.assertFalse(isinstance(pieces[1], numpy.ndarray))
+
+    def test_select_remove(self):
+        for d in [DictArray(files=self.files, groups=['stat', 'time']),
+                  DictArray(data={'stat': self.stat, 'time': self.time})]:
+            idx = numpy.random.permutation(80)[:25]
+            view = d.select(idx)
+            self.assertEqual(len(view), 25)
+            numpy.testing.assert_array_equal(view.stat, self.stat[idx])
+            numpy.testing.assert_array_equal(view.time, self.time[idx])
+
+            # Views of views index the original rows
+            sub = view.remove([0, 3])
+            numpy.testing.assert_array_equal(sub.stat,
+                                    numpy.delete(self.stat[idx], [0, 3]))
+            sub = view.select(view.stat > 0)
+            numpy.testing.assert_array_equal(sub.time,
+                                    self.time[idx][self.stat[idx] > 0])
+
+            self.assertEqual(len(d.select([])), 0)
+            self.assertEqual(len(d.select([]).stat), 0)
+
+            # The original is unchanged
+            self.assertEqual(len(d), 80)
+            numpy.testing.assert_array_equal(d.stat, self.stat)
+
+            # Combining views materializes their columns
+            both = d.select([1, 2]) + d.select([60])
+            numpy.testing.assert_array_equal(both.time, self.time[[1, 2, 60]])
+
+    def test_data_read_only(self):
+        d = DictArray(data={'stat': self.stat, 'time': self.time})
+        def assign():
+            d.data['stat'] = self.time
+        self.assertRaises(TypeError, assign)
+        self.assertRaises(AttributeError, getattr, d, 'snr')
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestDictArray))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
@@ -0,0 +1,97 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the compiled kernels of the pycbc.kernels module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import pycbc.kernels
+from pycbc.types import Array, float32, float64, complex64, complex128
+from pycbc.vetoes import chisq_cpu
+from utils import parse_args_cpu_only, simple_exit
+
+parse_args_cpu_only("Compiled kernels")
+
+class TestKernels(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmpdir, pycbc.kernels.LIBRARY_NAME)
+        pycbc.kernels.build_library(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_chisq_accum_bin(self):
+        lib = pycbc.kernels.load_library(self.path)
+        self.assertTrue(lib is not None)
+
+        library, functions = pycbc.kernels._library, pycbc.kernels._functions
+        pycbc.kernels._library, pycbc.kernels._functions = lib, {}
+        try:
+            for rtype, ctype in [(float32, complex64), (float64, complex128)]:
+                q = numpy.random.normal(size=(2, 1000))
+                q = Array(q[0] + 1.0j * q[1], dtype=ctype)
+                chisq = Array(numpy.random.uniform(size=1000), dtype=rtype)
+                expected = Array(chisq, copy=True)
+
+                # The kernel is run through the compiled library
+                arg_types = [pycbc.kernels.c_type(chisq.numpy()),
+                             pycbc.kernels.c_type(q.numpy()), 'int']
+                self.assertTrue(pycbc.kernels.get_kernel(
+                            chisq_cpu.accum_code, None, arg_types) is not None)
+
+                chisq_cpu.chisq_accum_bin_numpy(expected, q)
+                chisq_cpu.chisq_accum_bin_inline(chisq, q)
+                numpy.testing.assert_allclose(chisq.numpy(), expected.numpy(),
+                                              rtol=1e-6)
+        finally:
+            pycbc.kernels._library = library
+            pycbc.kernels._functions = functions
+
+    def test_cpu_flags(self):
+        if pycbc.kernels.cpu_flags() is None:
+            return
+        self.assertTrue(pycbc.kernels.library_supported(self.path))
+
+        # A library built for a CPU with other flags is not used
+        flags_file = self.path + pycbc.kernels.CPU_FLAGS_SUFFIX
+        shutil.copy(flags_file, flags_file + '.orig')
+        try:
+            f = open(flags_file, 'a')
+            f.write(' not_a_cpu_flag')
+            f.close()
+            self.assertFalse(pycbc.kernels.library_supported(self.path))
+            self.assertTrue(pycbc.kernels.load_library(self.path) is None)
+        finally:
+            shutil.move(flags_file + '.orig', flags_file)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestKernels))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
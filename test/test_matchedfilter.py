@@ -141,6 +141,155 @@ class TestMatchedFilter(unittest.TestCase):
 
             self.assertRaises(ValueError,match,self.filt,self.filt[0:len(self.filt)-1])
 
+    if _scheme == 'cpu':
+        def test_batch_segments(self):
+            from pycbc.strain import StrainSegments
+            numpy.random.seed(1234)
+            sample_rate, seg_len, flow, window = 1024, 16, 20.0, 256
+
+            # White noise with a one-sided psd of one, so that the snr of a
+            # white template is of order one
+            data = numpy.random.normal(size=64 * sample_rate) * \
+                   sqrt(sample_rate / 2.0)
+            strain = TimeSeries(data, delta_t=1.0 / sample_rate,
+                                dtype=float32)
+
+            tlen = seg_len * sample_rate
+            flen = tlen / 2 + 1
+            template_mem = zeros(tlen, dtype=complex64)
+            template = numpy.array(template_mem.data, copy=False)
+            template[:flen] = numpy.random.normal(size=flen) + \
+                              1.0j * numpy.random.normal(size=flen)
+            norm = sigmasq(FrequencySeries(template_mem[:flen],
+                                           delta_f=1.0 / seg_len),
+                           low_frequency_cutoff=flow)
+
+            single = StrainSegments(strain, segment_length=seg_len,
+                                    segment_start_pad=2, segment_end_pad=2)
+            segments = single.fourier_segments()
+            single_mf = MatchedFilterControl(flow, None, 3.5, tlen,
+                                             single.delta_f, complex64,
+                                             segments, template_mem, True)
+
+            batch = StrainSegments(strain, segment_length=seg_len,
+                                   segment_start_pad=2, segment_end_pad=2)
+            batch_segments = batch.fourier_segments(contiguous=True)
+            batch_mf = MatchedFilterControl(flow, None, 3.5, tlen,
+                                    batch.delta_f, complex64, batch_segments,
+                                    template_mem, True,
+                                    segment_memory=batch.fourier_segment_mem)
+            results = batch_mf.multi_segment_matched_filter_and_cluster(
+                                          [norm] * len(batch_segments), window)
+
+            self.assertTrue(len(segments) > 1)
+            self.assertEqual(len(results), len(segments))
+            num_triggers = 0
+            for s_num, stilde in enumerate(segments):
+                self.assertTrue(numpy.allclose(batch_segments[s_num].numpy(),
+                                               stilde.numpy(), rtol=1e-5))
+                self.assertEqual(batch_segments[s_num].analyze,
+                                 stilde.analyze)
+
+                snr, snr_norm, corr, idx, snrv = \
+                    single_mf.matched_filter_and_cluster(s_num, norm, window)
+                b_snr, b_norm, b_corr, b_idx, b_snrv = results[s_num]
+                self.assertEqual(len(b_idx), len(idx))
+                if not len(idx):
+                    continue
+                num_triggers += len(idx)
+                self.assertEqual(b_norm, snr_norm)
+                self.assertEqual(list(b_idx), list(idx))
+                self.assertTrue(numpy.allclose(numpy.array(b_snrv),
+                                               numpy.array(snrv), rtol=1e-4))
+                ana = stilde.analyze
+                self.assertTrue(numpy.allclose(b_snr[ana].numpy(),
+                                               snr[ana].numpy(), rtol=1e-4,
+                                               atol=1e-3))
+            self.assertTrue(num_triggers > 0)
+
+        def test_batch_templates(self):
+            import os, shutil, tempfile, h5py
+            from pycbc.strain import StrainSegments
+            from pycbc.waveform import FilterBank
+            numpy.random.seed(4321)
+            sample_rate, seg_len, flow, window = 1024, 16, 30.0, 256
+            batch_size = 3
+
+            tmpdir = tempfile.mkdtemp()
+            try:
+                bank_file = os.path.join(tmpdir, 'bank.hdf')
+                f = h5py.File(bank_file, 'w')
+                f['mass1'] = numpy.array([1.4, 3.0, 10.0, 5.0, 2.0])
+                f['mass2'] = numpy.array([1.3, 1.4, 5.0, 5.0, 1.5])
+                f['spin1z'] = numpy.array([0.0, 0.2, -0.3, 0.0, 0.5])
+                f['spin2z'] = numpy.array([0.0, 0.0, 0.1, 0.0, -0.2])
+                f.close()
+
+                data = numpy.random.normal(size=64 * sample_rate) * \
+                       sqrt(sample_rate / 2.0)
+                strain = TimeSeries(data, delta_t=1.0 / sample_rate,
+                                    dtype=float32)
+                segs = StrainSegments(strain, segment_length=seg_len,
+                                      segment_start_pad=2, segment_end_pad=2)
+                segments = segs.fourier_segments()
+                tlen, flen = segs.time_len, segs.freq_len
+                psd = FrequencySeries(numpy.ones(flen), delta_f=segs.delta_f,
+                                      dtype=float32)
+
+                single_mem = zeros(tlen, dtype=complex64)
+                single_bank = FilterBank(bank_file, flen, segs.delta_f, flow,
+                                         dtype=complex64, out=single_mem,
+                                         approximant='SPAtmplt')
+                single_mf = MatchedFilterControl(flow, None, 3.5, tlen,
+                                     segs.delta_f, complex64, segments,
+                                     single_mem, True)
+
+                batch_mem = zeros(tlen * batch_size, dtype=complex64)
+                batch_bank = FilterBank(bank_file, flen, segs.delta_f, flow,
+                                        dtype=complex64, out=batch_mem,
+                                        approximant='SPAtmplt')
+                batch_mf = MatchedFilterControl(flow, None, 3.5, tlen,
+                                     segs.delta_f, complex64, segments,
+                                     batch_mem, True, batch_size=batch_size)
+
+                num_triggers = 0
+                for start in range(0, len(single_bank), batch_size):
+                    templates = batch_bank.get_block(start,
+                                                     start + batch_size)
+                    self.assertEqual(len(templates),
+                            min(batch_size, len(single_bank) - start))
+                    norms = [t.sigmasq(psd) for t in templates]
+
+                    for s_num in range(len(segments)):
+                        results = batch_mf.batch_matched_filter_and_cluster(
+                                                        s_num, norms, window)
+                        for i, template in enumerate(templates):
+                            single = single_bank[start + i]
+                            self.assertTrue(numpy.allclose(template.numpy(),
+                                            single.numpy(), rtol=1e-5))
+                            self.assertEqual(template.params.mass1,
+                                             single.params.mass1)
+
+                            snr, norm, corr, idx, snrv = \
+                                single_mf.matched_filter_and_cluster(s_num,
+                                          single.sigmasq(psd), window)
+                            b_snr, b_norm, b_corr, b_idx, b_snrv = results[i]
+                            self.assertEqual(len(b_idx), len(idx))
+                            if not len(idx):
+                                continue
+                            num_triggers += len(idx)
+                            self.assertAlmostEqual(b_norm, norm)
+                            self.assertEqual(list(b_idx), list(idx))
+                            self.assertTrue(numpy.allclose(
+                                numpy.array(b_snrv), numpy.array(snrv),
+                                rtol=1e-4))
+                            ana = segments[s_num].analyze
+                            self.assertTrue(numpy.allclose(
+                                b_snr[ana].numpy(), snr[ana].numpy(),
+                                rtol=1e-4, atol=1e-3))
+                self.assertTrue(num_triggers > 0)
+            finally:
+                shutil.rmtree(tmpdir)
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestMatchedFilter))
@@ -106,6 +106,41 @@ class TestPSD(unittest.TestCase):
                         msg='seg_len=%d seg_stride=%d method=%s -> rms=%.3f' % \
                         (seg_len, seg_stride, method, err_rms))
 
+    def test_estimate_welch_p2(self):
+        """Test Welch's method with a running estimate of the median"""
+        seg_len = 4096
+        noise_model = (numpy.linspace(1., 100., seg_len/2 + 1)) ** (-2)
+        for method in ('median', 'median-mean'):
+            with self.context:
+                exact = pycbc.psd.welch(self.noise, seg_len=seg_len,
+                            seg_stride=seg_len/2, avg_method=method)
+                psd = pycbc.psd.welch(self.noise, seg_len=seg_len,
+                            seg_stride=seg_len/2, avg_method=method,
+                            median_method='p2', batch_size=16)
+            error = (psd.numpy() - noise_model) / noise_model
+            err_rms = numpy.sqrt(numpy.mean(error ** 2))
+            self.assertTrue(err_rms < 0.2,
+                            msg='method=%s -> rms=%.3f' % (method, err_rms))
+            self.assertEqual(len(psd), len(exact))
+
+    def test_incremental_psd(self):
+        """Test that sliding PSD windows agree with Welch's method"""
+        seg_len = 1024
+        stride = seg_len / 2
+        for method in ('mean', 'median', 'median-mean'):
+            with self.context:
+                est = pycbc.psd.IncrementalPSD(self.noise, seg_len, stride,
+                                               avg_method=method, batch_size=4)
+                for first in (0, 3, 4, 2, 20):
+                    start = first * stride
+                    end = start + 9 * stride
+                    psd = est.psd(start, end)
+                    exact = pycbc.psd.welch(self.noise[start:end],
+                                seg_len=seg_len, seg_stride=stride,
+                                avg_method=method)
+                    numpy.testing.assert_allclose(psd.numpy(), exact.numpy(),
+                                                  rtol=1e-4)
+
     def test_truncation(self):
         """Test inverse PSD truncation"""
         for seg_len in (2048, 4096, 8192):
@@ -25,6 +25,7 @@
 These are the unittests for the pycbc.filter.matchedfilter module
 """
 import sys
+import numpy
 import unittest
 from pycbc.types import *
 from pycbc.filter import *
@@ -57,6 +58,26 @@ class TestUtils(unittest.TestCase):
             rb = resample_to_delta_t(self.b, self.delta_t)
             self.assertAlmostEqual(rb[0], 1)
 
+        def test_resample_polyphase(self):
+            numpy.random.seed(4321)
+            ts = TimeSeries(numpy.random.normal(size=4096 * 4),
+                            delta_t=self.delta_t, dtype=float32)
+            for factor in (2, 4):
+                ldas = resample_to_delta_t(ts, factor * self.delta_t,
+                                           method='ldas')
+                poly = resample_to_delta_t(ts, factor * self.delta_t,
+                                           method='polyphase')
+                self.assertEqual(len(poly), len(ldas))
+                self.assertAlmostEqual(poly.delta_t, ldas.delta_t)
+                numpy.testing.assert_allclose(poly.numpy(), ldas.numpy(),
+                                              rtol=1e-5, atol=1e-6)
+
+            poly = resample_to_delta_t(ts, 3 * self.delta_t,
+                                       method='polyphase')
+            self.assertEqual(len(poly), (len(ts) + 2) / 3)
+            self.assertRaises(ValueError, resample_to_delta_t, ts,
+                              2.5 * self.delta_t, method='polyphase')
+
     def test_resample_errors(self):
         self.assertRaises(TypeError, resample_to_delta_t, self.c, self.target_delta_t)
         self.assertRaises(TypeError, resample_to_delta_t, self.d, self.target_delta_t)
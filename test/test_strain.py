@@ -0,0 +1,70 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+"""
+These are the unittests for the strain conditioning of the pycbc.strain module
+"""
+import unittest
+import numpy
+from pycbc.types import TimeSeries, float32, float64
+from pycbc.filter import resample_to_delta_t
+from pycbc.strain import ConditioningPipeline, gate_data
+from utils import parse_args_cpu_only, simple_exit
+
+parse_args_cpu_only("Strain conditioning")
+
+class TestConditioningPipeline(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1234)
+        self.sample_rate = 4096
+        self.dyn_range_fac = 2. ** 69
+        self.strain = TimeSeries(numpy.random.normal(size=16 * 4096) * 1e-21,
+                                 delta_t=1.0 / self.sample_rate, dtype=float64)
+        self.gates = [numpy.array([5.0, 0.25, 0.5]),
+                      numpy.array([15.9, 0.1, 0.2])]
+
+    def condition_separately(self, delta_t):
+        strain = (self.strain * self.dyn_range_fac).astype(float32)
+        strain = gate_data(strain, self.gates, data_start_time=0)
+        return resample_to_delta_t(strain, delta_t, method='ldas')
+
+    def test_pipeline(self):
+        for factor in (1, 2, 4, 8, 16):
+            delta_t = factor * self.strain.delta_t
+            expected = self.condition_separately(delta_t)
+            pipeline = ConditioningPipeline(delta_t,
+                                            dyn_range_fac=self.dyn_range_fac,
+                                            gate_params=self.gates,
+                                            data_start_time=0,
+                                            block_size=10000)
+            strain = pipeline.condition(self.strain)
+            self.assertEqual(strain.dtype, float32)
+            self.assertEqual(len(strain), len(expected))
+            self.assertAlmostEqual(strain.delta_t, expected.delta_t)
+            numpy.testing.assert_allclose(strain.numpy(), expected.numpy(),
+                                          rtol=1e-5, atol=1e-6)
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestConditioningPipeline))
+
+if __name__ == '__main__':
+    results = unittest.TextTestRunner(verbosity=2).run(suite)
+    simple_exit(results)
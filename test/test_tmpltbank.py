@@ -205,6 +205,33 @@ class TmpltbankTestClass(unittest.TestCase):
             diff = stockScaled - testScaled
             self.assertTrue(not (diff > 1E-4).any(), msg=errMsg)
 
+    def test_metric_cache(self):
+        import shutil, tempfile
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for i in range(2):
+                # The first pass writes the cache and the second reads it
+                metricParams = pycbc.tmpltbank.metricParameters(self.pnOrder,\
+                         self.f_low, self.f_upper, self.deltaF, self.f0,\
+                         cache_dir=cache_dir)
+                metricParams.psd = self.psd
+                metricParams = pycbc.tmpltbank.determine_eigen_directions(
+                                                                  metricParams)
+                evalsCV, evecsCV = pycbc.tmpltbank.estimate_covariance_evecs(
+                       1000, self.massRangeParams, metricParams, self.f_upper)
+                if i == 0:
+                    evecsFirst = evecsCV
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            self.assertTrue(numpy.allclose(metricParams.evals[self.f_upper],
+                                self.metricParams.evals[self.f_upper]))
+            self.assertTrue(numpy.allclose(metricParams.evecs[self.f_upper],
+                                self.metricParams.evecs[self.f_upper]))
+            self.assertEqual(metricParams.moments['J7'][self.f_upper], 1)
+            self.assertTrue(numpy.allclose(evecsCV, evecsFirst))
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_get_random_mass(self):
         # Want to do this for a variety of mass combinations
         for i in update_mass_parameters(self):
@@ -500,6 +527,92 @@ class TmpltbankTestClass(unittest.TestCase):
         errMsg = "Obtained distance does not agree with expected value."
         self.assertTrue( diff < 1E-5, msg=errMsg)
 
+    def test_partitioned_bank_batch(self):
+        # Placing a block of points at once must accept the same points as
+        # placing them one at a time
+        mass,eta,beta,sigma,gamma,spin1z,spin2z = \
+                      pycbc.tmpltbank.get_random_mass(2000, self.massRangeParams)
+        diff = (mass*mass * (1-4*eta))**0.5
+        mass1 = (mass + diff)/2.
+        mass2 = (mass - diff)/2.
+        chis = (spin1z + spin2z)/2.
+        xis = numpy.array(pycbc.tmpltbank.get_cov_params(mass, eta, beta,
+                  sigma, gamma, chis, self.metricParams, self.f_upper))
+        max_mismatch = 0.03
+
+        # Also with bins narrower than the mismatch, where the blocks are
+        # tested through the bins only
+        for bin_spacing in [max_mismatch**0.5, 0.5 * max_mismatch**0.5]:
+            serial = pycbc.tmpltbank.PartitionedTmpltbank(
+                       self.massRangeParams, self.metricParams, self.f_upper,
+                       bin_spacing)
+            for i in xrange(len(mass)):
+                if not serial.test_point_distance(xis[:,i], max_mismatch):
+                    serial.add_point_by_chi_coords(xis[:,i], mass1[i],
+                                            mass2[i], spin1z[i], spin2z[i])
+
+            batch = pycbc.tmpltbank.PartitionedTmpltbank(
+                       self.massRangeParams, self.metricParams, self.f_upper,
+                       bin_spacing)
+            for i in xrange(0, len(mass), 300):
+                block = slice(i, i + 300)
+                batch.test_and_add_points(xis[:,block], max_mismatch,
+                                          mass1[block], mass2[block],
+                                          spin1z[block], spin2z[block])
+
+            errMsg = "Placing points in blocks changes the bank."
+            self.assertEqual(serial.output_all_points(),
+                             batch.output_all_points(), msg=errMsg)
+
+    def test_partitioned_bank_regions(self):
+        # Placing the bank in regions in parallel must cover the seeds, and
+        # the parameter space, as well as placing it serially does
+        def draw_seeds(num):
+            mass,eta,beta,sigma,gamma,spin1z,spin2z = \
+                      pycbc.tmpltbank.get_random_mass(num, self.massRangeParams)
+            diff = (mass*mass * (1-4*eta))**0.5
+            mass1 = (mass + diff)/2.
+            mass2 = (mass - diff)/2.
+            chis = (spin1z + spin2z)/2.
+            xis = numpy.array(pycbc.tmpltbank.get_cov_params(mass, eta, beta,
+                      sigma, gamma, chis, self.metricParams, self.f_upper))
+            return mass1, mass2, spin1z, spin2z, xis
+
+        max_mismatch = 0.03
+        num_seeds = 5000
+        banks = []
+        for processes in [1, 3]:
+            bank = pycbc.tmpltbank.PartitionedTmpltbank(self.massRangeParams,
+                       self.metricParams, self.f_upper, max_mismatch**0.5)
+            numpy.random.seed(42)
+            if processes == 1:
+                pycbc.tmpltbank.place_seeds_in_blocks(bank, draw_seeds,
+                                     num_seeds, max_mismatch, 1000000000)
+            else:
+                pycbc.tmpltbank.place_seeds_in_regions(bank, draw_seeds,
+                                     num_seeds, max_mismatch, 1000000000,
+                                     processes)
+            banks.append(bank)
+        serial, sharded = banks
+
+        # Every seed is within the mismatch of a template
+        numpy.random.seed(42)
+        seeds = draw_seeds(100000)[4][:,:num_seeds]
+        for i in xrange(num_seeds):
+            self.assertTrue(sharded.test_point_distance(seeds[:,i],
+                                                        max_mismatch))
+
+        # And so is a similar fraction of other points
+        numpy.random.seed(1234)
+        points = draw_seeds(2000)[4]
+        covered = [numpy.mean([bank.test_point_distance(points[:,i],
+                                                        max_mismatch)
+                               for i in xrange(points.shape[1])])
+                   for bank in banks]
+        errMsg = "Placing the bank in regions covers less of the space."
+        self.assertTrue(covered[1] >= covered[0] - 0.02, msg=errMsg)
+        self.assertTrue(sharded.num_points < 1.2 * serial.num_points)
+
     def test_conv_to_sngl(self):
         # Just run the function, no checking output
         masses1 = [(2,2,0.4,0.3),(4.01,0.249,0.41,0.29)]
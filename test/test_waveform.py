@@ -132,6 +132,62 @@ class TestWaveform(unittest.TestCase):
             self.assertRaises(ValueError,func,approximant="IMRPhenomB",mass1=3,mass2=3,phase_order=7)
             self.assertRaises(ValueError,func,approximant="IMRPhenomB",mass1=3)
 
+    def test_template_cache(self):
+        if not isinstance(self.context, CPUScheme):
+            return
+        import os, shutil, tempfile, h5py
+        from pycbc.waveform.bank import FilterBank, TemplateCache
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            bank_file = os.path.join(tmpdir, 'bank.hdf')
+            f = h5py.File(bank_file, 'w')
+            f['mass1'] = numpy.array([1.4, 3.0, 10.0])
+            f['mass2'] = numpy.array([1.3, 1.4, 5.0])
+            f['spin1z'] = numpy.array([0.0, 0.2, -0.3])
+            f['spin2z'] = numpy.array([0.0, 0.0, 0.1])
+            f.close()
+
+            flen, delta_f, f_lower = 2049, 1.0 / 16, 30.0
+            def make_bank(cache=None, order=-1):
+                return FilterBank(bank_file, flen, delta_f, f_lower,
+                                  dtype=complex64, approximant='SPAtmplt',
+                                  template_cache=cache, phase_order=order)
+
+            def generate(bank):
+                return [bank[i].numpy().copy() for i in range(len(bank))]
+
+            expected = generate(make_bank())
+
+            cache_file = os.path.join(tmpdir, 'cache.hdf')
+            cache = TemplateCache(cache_file, write=True)
+            stored = generate(make_bank(cache))
+            cache.close()
+            for a, b in zip(expected, stored):
+                self.assertTrue(numpy.array_equal(a, b))
+
+            # The templates are read back from the cache
+            cache = TemplateCache(cache_file)
+            bank = make_bank(cache)
+            for i in range(len(bank)):
+                approximant = bank.get_approximant(i)
+                key = cache.key(bank.table[i], approximant, delta_f, f_lower,
+                                bank.end_frequency(i, approximant), flen,
+                                complex64, **bank.extra_args)
+                self.assertTrue(key in cache)
+                self.assertTrue(numpy.array_equal(bank[i].numpy(),
+                                                  expected[i]))
+
+            # A different phase order is not served from the cache
+            other = generate(make_bank(order=4))
+            bank = make_bank(cache, order=4)
+            for i in range(len(bank)):
+                t = bank[i].numpy()
+                self.assertTrue(numpy.array_equal(t, other[i]))
+                self.assertFalse(numpy.array_equal(t, expected[i]))
+            cache.close()
+        finally:
+            shutil.rmtree(tmpdir)
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestWaveform))
@@ -27,9 +27,15 @@ test $? -ne 0 && RESULT=1
 python test/test_chisq.py
 test $? -ne 0 && RESULT=1
 
+python test/test_coinc.py
+test $? -ne 0 && RESULT=1
+
 python test/test_correlate.py
 test $? -ne 0 && RESULT=1
 
+python test/test_events.py
+test $? -ne 0 && RESULT=1
+
 #python test/test_fft_unthreaded.py
 #test $? -ne 0 && RESULT=1
 
@@ -39,9 +45,15 @@ test $? -ne 0 && RESULT=1
 python test/test_frequencyseries.py
 test $? -ne 0 && RESULT=1
 
+python test/test_hdf.py
+test $? -ne 0 && RESULT=1
+
 #python test/test_injection.py
 #test $? -ne 0 && RESULT=1
 
+python test/test_kernels.py
+test $? -ne 0 && RESULT=1
+
 python test/test_matchedfilter.py
 test $? -ne 0 && RESULT=1
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+""" Compare the time taken to cluster coincidences by
+pycbc.events.coinc.cluster_coincs with that of the previous pure python
+implementation, and check that both keep the same coincidences.
+"""
+import numpy
+import timeit
+from optparse import OptionParser
+from pycbc.events.coinc import cluster_coincs
+
+parser = OptionParser()
+parser.add_option('--num-coincs', type=int, default=1000000,
+                  help='Number of coincidences to cluster')
+parser.add_option('--num-slides', type=int, default=1000,
+                  help='Number of timeslides the coincidences are spread over')
+parser.add_option('--duration', type=float, default=1000000,
+                  help='Length of the analyzed time in seconds')
+parser.add_option('--slide-interval', type=float, default=0.1,
+                  help='Timeslide interval in seconds')
+parser.add_option('--cluster-window', type=float, default=10,
+                  help='Clustering window in seconds')
+parser.add_option('--iterations', type=int, default=1,
+                  help='Number of iterations to perform')
+(options, args) = parser.parse_args()
+
+def cluster_coincs_loop(stat, time1, time2, timeslide_id, slide, window):
+    """ The previous implementation of cluster_coincs """
+    if numpy.isfinite(slide):
+        time = (time2 + (time1 + timeslide_id * slide)) / 2
+    else:
+        time = 0.5 * (time2 + time1)
+
+    tslide = timeslide_id.astype(numpy.float128)
+    time = time.astype(numpy.float128)
+
+    span = (time.max() - time.min()) + window * 10
+    time = time + span * tslide
+
+    time_sorting = time.argsort()
+    stat = stat[time_sorting]
+    time = time[time_sorting]
+
+    left = numpy.searchsorted(time, time - window)
+    right = numpy.searchsorted(time, time + window)
+    indices = numpy.zeros(len(left), dtype=numpy.uint32)
+
+    i = 0
+    j = 0
+    while i < len(left):
+        l = left[i]
+        r = right[i]
+        if (r - l) == 1:
+            indices[j] = i
+            j += 1
+            i += 1
+            continue
+
+        max_loc = stat[l:r].argmax() + l
+        if max_loc == i:
+            indices[j] = i
+            i = r
+            j += 1
+        elif max_loc > i:
+            i = max_loc
+        elif max_loc < i:
+            i += 1
+
+    return time_sorting[indices[:j]]
+
+n = options.num_coincs
+time1 = 1e9 + numpy.random.uniform(0, options.duration, size=n)
+time2 = time1 + numpy.random.normal(0, 0.005, size=n)
+slide_id = numpy.random.randint(-options.num_slides / 2,
+                                options.num_slides / 2 + 1, size=n)
+time1 -= slide_id * options.slide_interval
+stat = numpy.random.chisquare(2, size=n).astype(numpy.float32)
+args = (stat, time1, time2, slide_id, options.slide_interval,
+        options.cluster_window)
+
+# Compile the clustering kernel before timing it
+new = cluster_coincs(*args)
+old = cluster_coincs_loop(*args)
+print "SAME RESULT: %s (%s kept)" % (numpy.array_equal(new, old), len(new))
+
+niter = options.iterations
+t = timeit.Timer(lambda: cluster_coincs(*args)).timeit(number=niter) / niter
+print "CLUSTER_COINCS  %.3f sec" % t
+
+t = timeit.Timer(lambda: cluster_coincs_loop(*args)).timeit(number=niter) / niter
+print "PYTHON LOOP     %.3f sec" % t
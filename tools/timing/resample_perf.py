@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+""" Compare the time taken to resample a time series with the polyphase
+method of pycbc.filter.resample_to_delta_t with that of the ldas method, and
+the largest difference between their outputs.
+"""
+import numpy
+import timeit
+from optparse import OptionParser
+from pycbc.types import TimeSeries, float32
+from pycbc.filter import resample_to_delta_t
+
+parser = OptionParser()
+parser.add_option('--duration', type=int, default=2048,
+                  help='Length of the time series in seconds')
+parser.add_option('--sample-rate', type=int, default=16384,
+                  help='Sample rate of the time series')
+parser.add_option('--factors', type=str, default='2,4,8,16',
+                  help='Comma separated list of resampling factors')
+parser.add_option('--iterations', type=int, default=3,
+                  help='Number of iterations to perform')
+(options, args) = parser.parse_args()
+
+data = numpy.random.normal(size=options.duration * options.sample_rate)
+ts = TimeSeries(data, delta_t=1.0 / options.sample_rate, dtype=float32)
+niter = options.iterations
+
+for factor in [int(f) for f in options.factors.split(',')]:
+    delta_t = factor * ts.delta_t
+    poly = resample_to_delta_t(ts, delta_t, method='polyphase')
+    ldas = resample_to_delta_t(ts, delta_t, method='ldas')
+    diff = abs(poly.numpy() - ldas.numpy()).max()
+
+    t_poly = timeit.Timer(lambda: resample_to_delta_t(ts, delta_t,
+                          method='polyphase')).timeit(number=niter) / niter
+    t_ldas = timeit.Timer(lambda: resample_to_delta_t(ts, delta_t,
+                          method='ldas')).timeit(number=niter) / niter
+    print "FACTOR %2d  POLYPHASE %.3f sec  LDAS %.3f sec  MAX DIFF %.2e" % \
+          (factor, t_poly, t_ldas, diff)